@@ -0,0 +1,185 @@
+"""
+Arkivering av inspelade kommandon för utvärdering i efterhand.
+
+Varje yttrande sparas komprimerat (FLAC eller Opus) tillsammans med en
+JSON-fil med transkription, Vosk-resultat och tidsmätningar, så att
+modeller och trösklar kan provas mot riktiga inspelningar. Skrivningen
+sker i en egen tråd: submit() kopierar bara ljudet och lägger det i en
+begränsad kö, och släpper yttrandet om kön är full. Äldsta filerna tas
+bort när arkivet blir för stort eller för gammalt.
+"""
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import uuid
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+import numpy as np
+import soundfile as sf
+
+from metrics import metrics
+
+# Filändelse och soundfile-format per ARCHIVE_FORMAT
+FORMATS = {
+    "flac": ("flac", "FLAC", "PCM_16"),
+    "opus": ("opus", "OGG", "OPUS"),
+}
+
+class UtteranceArchiver:
+    """
+    Bakgrundstråd som sparar yttranden till disk.
+
+    Användning:
+        archiver = UtteranceArchiver("archive", 16000)
+        archiver.start()
+        archiver.submit(audio, {"text": "tänd lampan"})
+    """
+
+    def __init__(self, directory: str, sample_rate: int, audio_format: str = "flac",
+                 fraction: float = 1.0, queue_size: int = 8, max_mb: float = 500,
+                 max_age_days: float = 30):
+        """
+        Args:
+            directory: Arkivkatalog
+            sample_rate: Ljudets samplingsfrekvens
+            audio_format: "flac" (förlustfritt) eller "opus" (mindre)
+            fraction: Andel av yttrandena som sparas (0–1)
+            queue_size: Max antal yttranden som väntar på att skrivas
+            max_mb: Max total storlek i MB (0 = obegränsat)
+            max_age_days: Max ålder i dagar (0 = obegränsat)
+        """
+        if audio_format not in FORMATS:
+            raise ValueError(f"Okänt arkivformat: {audio_format} (välj {', '.join(FORMATS)})")
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.audio_format = audio_format
+        self.fraction = fraction
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_age_days * 86400
+        self._queue: "queue.Queue[Optional[Tuple[np.ndarray, dict]]]" = queue.Queue(maxsize=queue_size)
+        # (mtime, sökväg, storlek) för arkiverade filer, äldst först
+        self._files: Deque[Tuple[float, str, int]] = deque()
+        self._total = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Starta skrivtråden."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Skriv det som redan köats och stoppa tråden."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logging.warning("Arkivkön är full vid avslut, osparade yttranden går förlorade")
+            return
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, audio: np.ndarray, record: dict) -> bool:
+        """
+        Köa ett yttrande för arkivering utan att blockera.
+
+        Args:
+            audio: Inspelat ljud (kopieras, kan vara en vy ur capture-ringen)
+            record: Metadata som sparas i JSON-filen
+
+        Returns:
+            True om yttrandet köades
+        """
+        if audio is None or not len(audio) or random.random() >= self.fraction:
+            return False
+        try:
+            self._queue.put_nowait((np.array(audio, dtype=np.int16), record))
+        except queue.Full:
+            metrics.incr("archive.dropped")
+            logging.debug("Arkivkön är full, yttrandet sparas inte")
+            return False
+        return True
+
+    def _run(self) -> None:
+        """Skriv köade yttranden och rotera arkivet."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._scan()
+        except OSError as e:
+            logging.error(f"Arkivkatalogen {self.directory} kan inte användas: {e}")
+        while True:
+            try:
+                item = self._queue.get(timeout=3600)
+            except queue.Empty:
+                self._rotate()
+                continue
+            if item is None:
+                return
+            try:
+                with metrics.timer("archive.write"):
+                    self._write(*item)
+                metrics.incr("archive.written")
+            except Exception as e:
+                metrics.incr("archive.errors")
+                logging.error(f"Kunde inte arkivera yttrande: {e}")
+            self._rotate()
+
+    def _write(self, audio: np.ndarray, record: dict) -> None:
+        """Spara ljudet och metadata under ett gemensamt filnamn."""
+        extension, container, subtype = FORMATS[self.audio_format]
+        timestamp = record.get("timestamp", time.time())
+        stem = os.path.join(self.directory, time.strftime("%Y%m%d-%H%M%S", time.localtime(timestamp))
+                            + f"-{uuid.uuid4().hex[:6]}")
+        audio_path = f"{stem}.{extension}"
+        sf.write(audio_path, audio, self.sample_rate, format=container, subtype=subtype)
+        meta = {**record, "timestamp": timestamp, "audio": os.path.basename(audio_path),
+                "sample_rate": self.sample_rate,
+                "duration_s": round(len(audio) / self.sample_rate, 3)}
+        meta_path = f"{stem}.json"
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        for path in (audio_path, meta_path):
+            size = os.path.getsize(path)
+            self._files.append((time.time(), path, size))
+            self._total += size
+
+    def _scan(self) -> None:
+        """Läs in filerna som redan finns i arkivet."""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.rsplit(".", 1)[-1] in ("json", "flac", "opus"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        files.sort()
+        self._files = deque(files)
+        self._total = sum(size for _, _, size in files)
+
+    def _rotate(self) -> None:
+        """Ta bort de äldsta filerna tills arkivet håller sig inom gränserna."""
+        cutoff = time.time() - self.max_age if self.max_age > 0 else None
+        removed = 0
+        while self._files:
+            mtime, path, size = self._files[0]
+            too_big = self.max_bytes > 0 and self._total > self.max_bytes
+            too_old = cutoff is not None and mtime < cutoff
+            if not (too_big or too_old):
+                break
+            self._files.popleft()
+            self._total -= size
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"Kunde inte ta bort {path} ur arkivet: {e}")
+        if removed:
+            logging.debug(f"Arkivet roterat: {removed} filer borttagna, "
+                          f"{self._total / 1024 / 1024:.1f} MB kvar")
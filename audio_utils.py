@@ -5,7 +5,11 @@ import io
 import time
 import wave
 import logging
-from typing import Optional
+import threading
+from contextlib import contextmanager
+from fractions import Fraction
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
 import numpy as np
 import pyaudio
 import soundfile as sf
@@ -15,6 +19,1010 @@ class AudioError(Exception):
     """Bas exception för ljud-relaterade fel."""
     pass
 
+class AudioStallError(AudioError):
+    """Ingångsenheten har slutat leverera ljud."""
+    pass
+
+@lru_cache(maxsize=16)
+def _design_filter_bank(up: int, down: int, zero_crossings: int = 16,
+                        beta: float = 8.6) -> np.ndarray:
+    """
+    Designa en polyfas-filterbank (Kaiser-fönstrad sinc) för omsampling up/down.
+    
+    Resultatet cachas per förhållande så att varje takt-par bara designas en gång.
+    
+    Args:
+        up: Uppsamplingsfaktor
+        down: Nedsamplingsfaktor
+        zero_crossings: Antal sinc-nollgenomgångar på var sida om centrum
+        beta: Kaiser-fönstrets beta (högre = bättre stoppbandsdämpning)
+        
+    Returns:
+        Skrivskyddad array med formen (up, taps_per_phase)
+    """
+    cutoff = 1.0 / max(up, down)
+    taps_per_phase = 2 * zero_crossings * max(1, -(-down // up))
+    num_taps = up * taps_per_phase
+    # Centrera på ett heltal så att fördröjningen blir exakt kompenserbar
+    n = np.arange(num_taps) - num_taps // 2
+    h = up * cutoff * np.sinc(cutoff * n) * np.kaiser(num_taps, beta)
+    # bank[p, k] = h[p + k * up]
+    bank = np.ascontiguousarray(h.reshape(taps_per_phase, up).T, dtype=np.float32)
+    bank.setflags(write=False)
+    return bank
+
+class Resampler:
+    """
+    Strömmande polyfas-omsamplare mellan två godtyckliga samplingsfrekvenser.
+    
+    Behåller filterhistorik och fas mellan anrop, så att block kan matas in
+    i valfri storlek utan skarvar. Filterbanken delas mellan instanser.
+    """
+    
+    # Max antal utsamples per vektoriserat steg (begränsar temporärt minne)
+    _MAX_BLOCK = 8192
+    
+    def __init__(self, src_rate: int, dst_rate: int):
+        """
+        Initialisera omsamplare.
+        
+        Args:
+            src_rate: Ingående samplingsfrekvens i Hz
+            dst_rate: Utgående samplingsfrekvens i Hz
+        """
+        if src_rate <= 0 or dst_rate <= 0:
+            raise ValueError(f"Ogiltiga samplingsfrekvenser: {src_rate} -> {dst_rate}")
+            
+        self.src_rate = src_rate
+        self.dst_rate = dst_rate
+        ratio = Fraction(dst_rate, src_rate)
+        self.up = ratio.numerator
+        self.down = ratio.denominator
+        self.passthrough = self.up == self.down
+        
+        if self.passthrough:
+            self._bank = None
+            self._taps = 1
+        else:
+            self._bank = _design_filter_bank(self.up, self.down)
+            self._taps = self._bank.shape[1]
+        self.reset()
+
+    def reset(self) -> None:
+        """Nollställ strömningstillstånd (historik och fas)."""
+        self._history = np.zeros(self._taps - 1, dtype=np.float32)
+        self._pos = 0
+
+    @property
+    def delay(self) -> float:
+        """Filtrets gruppfördröjning i utgående samples."""
+        if self.passthrough:
+            return 0.0
+        return (self.up * self._taps // 2) / self.down
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """
+        Omsampla nästa block av en ström.
+        
+        Args:
+            block: Mono-ljud i ingående takt (int16 eller flyttal)
+            
+        Returns:
+            Omsamplat ljud med samma dtype som indata
+        """
+        if self.passthrough:
+            return block
+            
+        x = np.asarray(block, dtype=np.float32)
+        buf = np.concatenate((self._history, x))
+        total = len(x) * self.up
+        count = max(0, -(-(total - self._pos) // self.down))
+        
+        out = np.empty(count, dtype=np.float32)
+        taps = np.arange(self._taps - 1, -1, -1)
+        for start in range(0, count, self._MAX_BLOCK):
+            stop = min(count, start + self._MAX_BLOCK)
+            pos = self._pos + np.arange(start, stop) * self.down
+            base = pos // self.up
+            phase = pos - base * self.up
+            # buf[base + K-1 - k] motsvarar x[base - k]
+            window = buf[base[:, None] + taps[None, :]]
+            out[start:stop] = np.einsum('ij,ij->i', window, self._bank[phase])
+            
+        self._pos += count * self.down - total
+        if self._taps > 1:
+            self._history = buf[len(buf) - (self._taps - 1):]
+        
+        if np.issubdtype(np.asarray(block).dtype, np.integer):
+            return np.clip(np.rint(out), -32768, 32767).astype(np.int16)
+        return out
+
+    def flush(self, dtype=np.int16) -> np.ndarray:
+        """Töm filtrets svans genom att mata in tystnad."""
+        if self.passthrough:
+            return np.zeros(0, dtype=dtype)
+        return self.process(np.zeros(self._taps, dtype=dtype))
+
+def resample(audio: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """
+    Omsampla ett helt ljudklipp (fördröjningskompenserat).
+    
+    Args:
+        audio: Mono-ljud i src_rate
+        src_rate: Ingående samplingsfrekvens i Hz
+        dst_rate: Utgående samplingsfrekvens i Hz
+        
+    Returns:
+        Ljud i dst_rate med samma dtype som indata
+    """
+    if src_rate == dst_rate or len(audio) == 0:
+        return audio
+        
+    resampler = Resampler(src_rate, dst_rate)
+    # Starta fasen så att filtercentrum hamnar exakt på en utgående sample
+    center = resampler.up * resampler._taps // 2
+    resampler._pos = center % resampler.down
+    skip = center // resampler.down
+    out = np.concatenate((resampler.process(audio), resampler.flush(audio.dtype)))
+    expected = -(-len(audio) * resampler.up // resampler.down)
+    return out[skip:skip + expected]
+
+class HighPassFilter:
+    """
+    Första ordningens DC-/högpassfilter, y[n] = x[n] - x[n-1] + r * y[n-1].
+    
+    Rekursionen löses vektoriserat som en skalad kumulativ summa:
+    y[n] = r^n * (r * y[-1] + sum_k d[k] * r^-k), där d är differensen av x.
+    Segmenten hålls korta så att r^-k håller sig långt inom float64.
+    """
+    
+    _SEGMENT = 512
+    
+    def __init__(self, sample_rate: int, cutoff_hz: float = 80.0):
+        """
+        Args:
+            sample_rate: Samplingsfrekvens i Hz
+            cutoff_hz: Brytfrekvens i Hz
+        """
+        if not 0 < cutoff_hz < sample_rate / 2:
+            raise ValueError(f"Ogiltig brytfrekvens: {cutoff_hz} Hz")
+        self.cutoff_hz = cutoff_hz
+        self.r = float(np.exp(-2 * np.pi * cutoff_hz / sample_rate))
+        k = np.arange(self._SEGMENT, dtype=np.float64)
+        self._pow = self.r ** k
+        self._inv = self.r ** -k
+        self._d = np.empty(self._SEGMENT, dtype=np.float64)
+        self.reset()
+        
+    def reset(self) -> None:
+        """Nollställ filterhistoriken."""
+        self._prev_x = 0.0
+        self._prev_y = 0.0
+        
+    def process(self, x: np.ndarray) -> None:
+        """Filtrera x (float64) på plats."""
+        for start in range(0, len(x), self._SEGMENT):
+            seg = x[start:start + self._SEGMENT]
+            n = len(seg)
+            d = self._d[:n]
+            d[0] = seg[0] - self._prev_x
+            np.subtract(seg[1:], seg[:-1], out=d[1:])
+            self._prev_x = seg[-1]
+            np.multiply(d, self._inv[:n], out=d)
+            np.cumsum(d, out=d)
+            d += self.r * self._prev_y
+            np.multiply(d, self._pow[:n], out=seg)
+            self._prev_y = seg[-1]
+
+def frame_levels(audio: np.ndarray, frame_length: int) -> np.ndarray:
+    """
+    Nivå i dBFS per ram.
+
+    Args:
+        audio: int16-ljud
+        frame_length: Ramlängd i samples (en ofullständig sista ram ignoreras)
+
+    Returns:
+        En nivå per hel ram
+    """
+    count = len(audio) // frame_length
+    if count == 0:
+        return np.zeros(0)
+    frames = audio[:count * frame_length].astype(np.float64).reshape(count, frame_length)
+    return 10 * np.log10(np.mean(frames * frames, axis=1) / 32768.0 ** 2 + 1e-12)
+
+class AutomaticGainControl:
+    """
+    Blockvis automatisk förstärkning mot en målnivå.
+    
+    Förstärkningen följer nivån snabbt nedåt (attack) och långsamt uppåt
+    (release), hålls oförändrad i tystnad (under en absolut spärr eller nära
+    det skattade brusgolvet) så att bruset inte förstärks, och rampas
+    linjärt över blocket för att undvika klick.
+    """
+    
+    def __init__(self, sample_rate: int, target_dbfs: float = -20.0,
+                 max_gain_db: float = 24.0, min_gain_db: float = -12.0,
+                 gate_dbfs: float = -55.0, gate_margin_db: float = 10.0,
+                 attack_ms: float = 20.0, release_ms: float = 500.0):
+        """
+        Args:
+            sample_rate: Samplingsfrekvens i Hz
+            target_dbfs: Målnivå (RMS) i dBFS
+            max_gain_db: Största förstärkning i dB
+            min_gain_db: Minsta förstärkning i dB
+            gate_dbfs: Under denna nivå hålls förstärkningen
+            gate_margin_db: Förstärkningen hålls även när nivån ligger inom
+                så här många dB från det skattade brusgolvet
+            attack_ms: Tidskonstant när förstärkningen minskas
+            release_ms: Tidskonstant när förstärkningen ökas
+        """
+        self.sample_rate = sample_rate
+        self.target_dbfs = target_dbfs
+        self.max_gain_db = max_gain_db
+        self.min_gain_db = min_gain_db
+        self.gate_dbfs = gate_dbfs
+        self.gate_margin_db = gate_margin_db
+        self.attack_ms = attack_ms
+        self.release_ms = release_ms
+        self._ramp = np.empty(0, dtype=np.float64)
+        self.gain_db = 0.0
+        self.noise_floor_dbfs = 0.0
+        
+    def reset(self) -> None:
+        """Återställ förstärkningen till 0 dB."""
+        self.gain_db = 0.0
+        
+    def _ramp_for(self, n: int) -> np.ndarray:
+        """Ramp (1/n .. 1) för ett block med n samples, cachad per längd."""
+        if len(self._ramp) != n:
+            self._ramp = np.arange(1, n + 1, dtype=np.float64) / n
+        return self._ramp
+        
+    def process(self, x: np.ndarray) -> None:
+        """Förstärk x (float64, int16-skala) på plats."""
+        n = len(x)
+        if n == 0:
+            return
+        level_dbfs = 10 * np.log10(np.dot(x, x) / n / 32768.0 ** 2 + 1e-12)
+        previous = self.gain_db
+        
+        if level_dbfs > self.gate_dbfs:
+            # Brusgolvet följer nivån direkt nedåt och kryper uppåt 2 dB/s
+            self.noise_floor_dbfs = min(level_dbfs, self.noise_floor_dbfs + 2.0 * n / self.sample_rate)
+        if level_dbfs > max(self.gate_dbfs, self.noise_floor_dbfs + self.gate_margin_db):
+            desired = min(self.max_gain_db, max(self.min_gain_db, self.target_dbfs - level_dbfs))
+            tau_ms = self.attack_ms if desired < self.gain_db else self.release_ms
+            coef = 1.0 - np.exp(-n * 1000.0 / (self.sample_rate * tau_ms))
+            self.gain_db += coef * (desired - self.gain_db)
+            
+        g0 = 10 ** (previous / 20)
+        g1 = 10 ** (self.gain_db / 20)
+        # Begränsa toppar så att blocket inte klipps
+        peak = float(np.max(np.abs(x)))
+        if peak * g1 > 32000.0:
+            g1 = 32000.0 / peak
+            self.gain_db = 20 * np.log10(g1)
+            g0 = min(g0, g1)
+        if g0 == g1:
+            x *= g1
+        else:
+            ramp = self._ramp_for(n)
+            x *= g0 + (g1 - g0) * ramp
+
+class NoiseSuppressor:
+    """
+    Strömmande brusreducering med spektral subtraktion.
+    
+    Ljudet delas i ramar (50 % överlapp, rot-Hann-fönster för analys och
+    syntes) och brusspektrumet skattas löpande i band som inte innehåller
+    tal. Utsignalen är fördröjd en ramlängd (frame_size samples).
+    """
+    
+    def __init__(self, sample_rate: int, frame_size: int = 512,
+                 floor_db: float = -15.0, over_subtraction: float = 2.0,
+                 noise_rise_db_per_s: float = 3.0, init_frames: int = 8):
+        """
+        Args:
+            sample_rate: Samplingsfrekvens i Hz
+            frame_size: Ramlängd i samples (jämnt tal)
+            floor_db: Lägsta förstärkning per frekvensband i dB
+            over_subtraction: Faktor för hur mycket av brusskattningen som dras bort
+            noise_rise_db_per_s: Hur snabbt brusskattningen får öka
+            init_frames: Antal första ramar som skattar bruset direkt
+        """
+        if frame_size % 2:
+            raise ValueError(f"Ramlängden måste vara jämn: {frame_size}")
+        self.frame_size = frame_size
+        self.hop = frame_size // 2
+        self.floor = 10 ** (floor_db / 20)
+        self.over_subtraction = over_subtraction
+        self.init_frames = init_frames
+        hops_per_second = sample_rate / self.hop
+        self._rise = 10 ** (noise_rise_db_per_s / 10 / hops_per_second)
+        
+        bins = frame_size // 2 + 1
+        k = np.arange(frame_size)
+        self._window = np.sqrt(0.5 - 0.5 * np.cos(2 * np.pi * k / frame_size))
+        self._frame = np.zeros(frame_size, dtype=np.float64)
+        self._windowed = np.empty(frame_size, dtype=np.float64)
+        self._ready = np.zeros(self.hop, dtype=np.float64)
+        self._tail = np.zeros(self.hop, dtype=np.float64)
+        self._power = np.empty(bins, dtype=np.float64)
+        self._gain = np.empty(bins, dtype=np.float64)
+        self._noise = np.zeros(bins, dtype=np.float64)
+        self._update = np.empty(bins, dtype=np.float64)
+        self._mask = np.empty(bins, dtype=bool)
+        self._frames_seen = 0
+        self._fill = 0
+        
+    def reset(self) -> None:
+        """Nollställ ramhistoriken men behåll brusskattningen."""
+        self._frame[:] = 0
+        self._ready[:] = 0
+        self._tail[:] = 0
+        self._fill = 0
+        
+    def _process_frame(self) -> None:
+        """Brusreducera aktuell ram och lägg till resultatet i överlappet."""
+        np.multiply(self._frame, self._window, out=self._windowed)
+        spectrum = np.fft.rfft(self._windowed)
+        np.square(spectrum.real, out=self._power)
+        self._power += np.square(spectrum.imag)
+        
+        if self._frames_seen < self.init_frames:
+            self._frames_seen += 1
+            self._noise += (self._power - self._noise) / self._frames_seen
+        else:
+            # Band som liknar bruset följs med glidande medelvärde; övriga
+            # (troligen tal) får bara krypa uppåt med self._rise per hopp
+            np.less(self._power, 3.0 * self._noise, out=self._mask)
+            np.multiply(self._noise, 0.95, out=self._update)
+            self._update += 0.05 * self._power
+            self._noise *= self._rise
+            np.copyto(self._noise, self._update, where=self._mask)
+            
+        # Förstärkning sqrt(1 - a * N / P), begränsad nedåt av golvet
+        np.divide(self._noise, self._power + 1e-9, out=self._gain)
+        self._gain *= -self.over_subtraction
+        self._gain += 1.0
+        np.maximum(self._gain, self.floor ** 2, out=self._gain)
+        np.sqrt(self._gain, out=self._gain)
+        spectrum *= self._gain
+        
+        out = np.fft.irfft(spectrum, n=self.frame_size)
+        out *= self._window
+        np.add(self._tail, out[:self.hop], out=self._ready)
+        self._tail[:] = out[self.hop:]
+        self._frame[:self.hop] = self._frame[self.hop:]
+        
+    def process(self, x: np.ndarray) -> None:
+        """Brusreducera x (float64) på plats, fördröjt en ramlängd."""
+        pos = 0
+        n = len(x)
+        while pos < n:
+            m = min(self.hop - self._fill, n - pos)
+            dst = self.hop + self._fill
+            chunk = x[pos:pos + m]
+            self._frame[dst:dst + m] = chunk
+            chunk[:] = self._ready[self._fill:self._fill + m]
+            self._fill += m
+            pos += m
+            if self._fill == self.hop:
+                self._process_frame()
+                self._fill = 0
+
+class CaptureDSP:
+    """
+    DSP-kedja för inspelat ljud före STT: högpass, brusreducering och AGC.
+    
+    Varje steg kan slås av separat. Ljudet bearbetas i block om block_size
+    samples med förallokerade arbetsbuffertar. Adaptiva skattningar (brus,
+    förstärkning) behålls mellan inspelningar.
+    """
+    
+    def __init__(self, sample_rate: int, highpass_hz: float = 80.0,
+                 agc: bool = True, agc_target_dbfs: float = -20.0,
+                 agc_max_gain_db: float = 24.0, noise_suppression: bool = True,
+                 noise_floor_db: float = -15.0, block_size: int = 512):
+        """
+        Args:
+            sample_rate: Samplingsfrekvens i Hz
+            highpass_hz: Högpassets brytfrekvens i Hz (0 = av)
+            agc: Aktivera automatisk förstärkning
+            agc_target_dbfs: AGC:ns målnivå i dBFS
+            agc_max_gain_db: AGC:ns största förstärkning i dB
+            noise_suppression: Aktivera spektral brusreducering
+            noise_floor_db: Brusreduceringens lägsta förstärkning i dB
+            block_size: Blockstorlek i samples
+        """
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.highpass = HighPassFilter(sample_rate, highpass_hz) if highpass_hz > 0 else None
+        self.noise_suppressor = (NoiseSuppressor(sample_rate, floor_db=noise_floor_db)
+                                 if noise_suppression else None)
+        self.agc = (AutomaticGainControl(sample_rate, agc_target_dbfs, agc_max_gain_db)
+                    if agc else None)
+        self._stages = [s for s in (self.highpass, self.noise_suppressor, self.agc) if s is not None]
+        self._work = np.empty(block_size, dtype=np.float64)
+        
+    @property
+    def enabled(self) -> bool:
+        """True om minst ett steg är aktivt."""
+        return bool(self._stages)
+        
+    def describe(self) -> str:
+        """Kort beskrivning för loggning."""
+        parts = []
+        if self.highpass:
+            parts.append(f"högpass {self.highpass.cutoff_hz:.0f} Hz")
+        if self.noise_suppressor:
+            parts.append("brusreducering")
+        if self.agc:
+            parts.append(f"AGC {self.agc.target_dbfs:.0f} dBFS")
+        return ", ".join(parts) if parts else "av"
+        
+    def reset(self) -> None:
+        """
+        Förbered för en ny, icke sammanhängande inspelning.
+        
+        Filtertillstånd nollställs, men brusskattning och förstärkning behålls.
+        """
+        if self.highpass:
+            self.highpass.reset()
+        if self.noise_suppressor:
+            self.noise_suppressor.reset()
+        
+    def process(self, block: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Bearbeta ett block int16-ljud.
+        
+        Args:
+            block: int16-ljud i sample_rate (valfri längd)
+            out: int16-array att skriva resultatet till (får vara block)
+            
+        Returns:
+            out, eller en ny int16-array med samma längd
+        """
+        if out is None:
+            out = np.empty(len(block), dtype=np.int16)
+        for start in range(0, len(block), self.block_size):
+            src = block[start:start + self.block_size]
+            work = self._work[:len(src)]
+            work[:] = src
+            for stage in self._stages:
+                stage.process(work)
+            np.clip(work, -32768, 32767, out=work)
+            out[start:start + len(src)] = work
+        return out
+
+class ActivityGate:
+    """
+    Energi- och nollgenomgångsgrind framför wakeword-detektorn.
+    
+    Grinden öppnar när ramens energi ligger tydligt över det skattade
+    brusgolvet, eller något över golvet med en talliknande
+    nollgenomgångsfrekvens. Den stänger först efter en eftersläpningstid
+    utan aktivitet (hysteres). De senaste ramarna sparas i en
+    återblicksbuffert och släpps igenom när grinden öppnar, så att början
+    av wakewordet inte klipps.
+    """
+    
+    def __init__(self, sample_rate: int, frame_length: int, threshold_db: float = 9.0,
+                 lookback_ms: float = 400.0, hangover_ms: float = 1000.0,
+                 min_dbfs: float = -70.0, zcr_range: Tuple[float, float] = (0.02, 0.35),
+                 noise_floor_dbfs: Optional[float] = None):
+        """
+        Args:
+            sample_rate: Samplingsfrekvens i Hz
+            frame_length: Ramlängd i samples
+            threshold_db: Nivå över brusgolvet som öppnar grinden
+            lookback_ms: Återblicksbuffertens längd
+            hangover_ms: Tid utan aktivitet innan grinden stänger
+            min_dbfs: Under denna nivå räknas ramen alltid som tystnad
+            zcr_range: Nollgenomgångar per sample som räknas som talliknande
+            noise_floor_dbfs: Startvärde för brusgolvet (None = första ramens nivå)
+        """
+        self.frame_length = frame_length
+        self.threshold_db = threshold_db
+        self.min_dbfs = min_dbfs
+        self.zcr_range = zcr_range
+        frame_seconds = frame_length / sample_rate
+        self._floor_rise_db = 1.0 * frame_seconds  # 1 dB/s
+        self._hangover_frames = max(1, int(round(hangover_ms / 1000 / frame_seconds)))
+        self._lookback = np.zeros((max(0, int(round(lookback_ms / 1000 / frame_seconds))),
+                                   frame_length), dtype=np.int16)
+        self._work = np.empty(frame_length, dtype=np.float32)
+        self.noise_floor_dbfs = noise_floor_dbfs
+        self.open = False
+        self._hangover = 0
+        self._lookback_start = 0
+        self._lookback_count = 0
+        self.frames = 0
+        self.passed = 0
+        
+    def _is_active(self, frame: np.ndarray) -> bool:
+        """Avgör om ramen innehåller akustisk aktivitet och uppdatera brusgolvet."""
+        work = self._work[:len(frame)]
+        work[:] = frame
+        level_dbfs = 10 * np.log10(np.dot(work, work) / len(work) / 32768.0 ** 2 + 1e-12)
+        if self.noise_floor_dbfs is None:
+            self.noise_floor_dbfs = level_dbfs
+        above = level_dbfs - max(self.noise_floor_dbfs, self.min_dbfs)
+        self.noise_floor_dbfs = min(level_dbfs, self.noise_floor_dbfs + self._floor_rise_db)
+        if level_dbfs <= self.min_dbfs:
+            return False
+        if above >= self.threshold_db:
+            return True
+        if above >= self.threshold_db / 2:
+            signs = np.signbit(frame)
+            zcr = np.count_nonzero(signs[1:] != signs[:-1]) / len(frame)
+            return self.zcr_range[0] <= zcr <= self.zcr_range[1]
+        return False
+        
+    def process(self, frame: np.ndarray) -> List[np.ndarray]:
+        """
+        Mata in en ram och få tillbaka de ramar som ska till detektorn.
+        
+        Args:
+            frame: int16-ram med frame_length samples
+            
+        Returns:
+            Tom lista när grinden är stängd, annars aktuell ram föregången
+            av återblicksbufferten om grinden just öppnade
+        """
+        self.frames += 1
+        active = self._is_active(frame)
+        
+        if self.open:
+            if active:
+                self._hangover = self._hangover_frames
+            else:
+                self._hangover -= 1
+                if self._hangover <= 0:
+                    self.open = False
+            self.passed += 1
+            return [frame]
+            
+        if not active:
+            if len(self._lookback):
+                slot = (self._lookback_start + self._lookback_count) % len(self._lookback)
+                self._lookback[slot] = frame
+                if self._lookback_count < len(self._lookback):
+                    self._lookback_count += 1
+                else:
+                    self._lookback_start = (self._lookback_start + 1) % len(self._lookback)
+            return []
+            
+        self.open = True
+        self._hangover = self._hangover_frames
+        frames = [self._lookback[(self._lookback_start + i) % len(self._lookback)]
+                  for i in range(self._lookback_count)]
+        frames.append(frame)
+        self._lookback_start = 0
+        self._lookback_count = 0
+        self.passed += len(frames)
+        return frames
+        
+    @property
+    def lookback_capacity(self) -> int:
+        """Återblicksbuffertens storlek i ramar."""
+        return len(self._lookback)
+        
+    def take_stats(self) -> Tuple[int, int]:
+        """
+        Räknare sedan förra anropet.
+        
+        Returns:
+            Tuple (inmatade ramar, ramar som hoppades över)
+        """
+        frames, skipped = self.frames, max(0, self.frames - self.passed)
+        self.frames = 0
+        self.passed = 0
+        return frames, skipped
+
+SPEED_OF_SOUND = 343.0  # m/s
+
+class Beamformer:
+    """
+    Delay-and-sum-beamformer för mikrofonarrayer.
+    
+    Fördröjningen mellan varje kanal och kanal 0 skattas löpande med
+    GCC-PHAT (fasnormaliserad korskorrelation, glidande medelvärde över
+    block med tal). Kanalerna linjeras med heltalsfördröjningar och
+    medelvärdesbildas, vilket förstärker ljud från den dominerande
+    riktningen och dämpar okorrelerat brus. Utsignalen är fördröjd
+    max_lag samples.
+    """
+    
+    def __init__(self, channels: int, sample_rate: int, aperture_m: float = 0.1,
+                 smoothing: float = 0.8):
+        """
+        Args:
+            channels: Antal mikrofonkanaler (minst 2)
+            sample_rate: Samplingsfrekvens i Hz
+            aperture_m: Största avstånd mellan två mikrofoner i meter
+            smoothing: Glidande medelvärde för korsspektrumet (0-1, högre = stabilare)
+        """
+        if channels < 2:
+            raise ValueError(f"Beamforming kräver minst 2 kanaler: {channels}")
+        if aperture_m <= 0:
+            raise ValueError(f"Ogiltig apertur: {aperture_m} m")
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.aperture_m = aperture_m
+        self.smoothing = smoothing
+        self.max_lag = max(1, int(np.ceil(aperture_m * sample_rate / SPEED_OF_SOUND)))
+        self.reset()
+        
+    def reset(self) -> None:
+        """Nollställ historik och riktningsskattning."""
+        self.delays = np.zeros(self.channels, dtype=np.int64)
+        self._history = np.zeros((2 * self.max_lag, self.channels), dtype=np.float32)
+        self._cross: Optional[np.ndarray] = None
+        self._nfft = 0
+        self._floor = None
+        
+    def direction(self) -> Optional[float]:
+        """
+        Skattad infallsvinkel i grader (0 = rakt fram) för tvåkanalsarrayer.
+        
+        Returns:
+            Vinkel i grader, eller None för fler kanaler eller ingen skattning än
+        """
+        if self.channels != 2 or self._cross is None:
+            return None
+        sin_theta = self.delays[1] * SPEED_OF_SOUND / (self.sample_rate * self.aperture_m)
+        return float(np.degrees(np.arcsin(np.clip(sin_theta, -1.0, 1.0))))
+        
+    def describe(self) -> str:
+        """Kort beskrivning av aktuell riktning för loggning."""
+        angle = self.direction()
+        if angle is not None:
+            return f"riktning {angle:+.0f}°"
+        return f"fördröjningar {self.delays.tolist()} samples"
+        
+    def _update_delays(self, frames: np.ndarray) -> None:
+        """Uppdatera fördröjningarna med GCC-PHAT om blocket innehåller tal."""
+        energy = float(np.dot(frames[:, 0], frames[:, 0])) / len(frames) + 1e-6
+        # Brusgolvet följer energin nedåt direkt och uppåt ca 1 dB per block
+        self._floor = energy if self._floor is None else min(energy, self._floor * 1.25)
+        if energy < 4.0 * self._floor and self._cross is not None:
+            return
+            
+        nfft = 1 << (2 * len(frames) - 1).bit_length()
+        if nfft != self._nfft:
+            self._nfft = nfft
+            self._cross = None
+        spectrum = np.fft.rfft(frames, n=nfft, axis=0)
+        cross = spectrum[:, 1:] * np.conj(spectrum[:, :1])
+        cross /= np.abs(cross) + 1e-12
+        if self._cross is None:
+            self._cross = cross
+        else:
+            self._cross *= self.smoothing
+            self._cross += (1.0 - self.smoothing) * cross
+            
+        correlation = np.fft.irfft(self._cross, n=nfft, axis=0)
+        lag = self.max_lag
+        # Rader motsvarar fördröjningarna -max_lag .. max_lag
+        window = np.concatenate((correlation[-lag:], correlation[:lag + 1]))
+        self.delays[1:] = np.argmax(window, axis=0) - lag
+        
+    def process(self, frames: np.ndarray) -> np.ndarray:
+        """
+        Forma ett block flerkanalsljud till mono.
+        
+        Args:
+            frames: int16-ljud med formen (samples, channels)
+            
+        Returns:
+            Mono-ljud (int16) med samma antal samples
+        """
+        n = len(frames)
+        x = frames.astype(np.float32)
+        self._update_delays(x)
+        buf = np.concatenate((self._history, x))
+        out = np.zeros(n, dtype=np.float32)
+        # x_c[t - max_lag + d_c] ligger på buf-index max_lag + d_c + t
+        for c, delay in enumerate(self.delays):
+            start = self.max_lag + int(delay)
+            out += buf[start:start + n, c]
+        out /= self.channels
+        self._history = buf[len(buf) - 2 * self.max_lag:]
+        return np.clip(np.rint(out), -32768, 32767).astype(np.int16)
+
+class CaptureBuffer:
+    """
+    Förallokerad, trådsäker ringbuffert mellan ljudcallbacken och läsaren.
+    
+    Callbacken skriver in block med push() och läsaren kopierar ut dem
+    direkt till sin egen buffert med readinto(). Om läsaren inte hinner
+    med skrivs det äldsta ljudet över och räknas som överskridning.
+    """
+    
+    def __init__(self, capacity: int):
+        """
+        Args:
+            capacity: Kapacitet i samples
+        """
+        if capacity <= 0:
+            raise ValueError(f"Ogiltig buffertkapacitet: {capacity}")
+        self.capacity = capacity
+        self._buffer = np.zeros(capacity, dtype=np.int16)
+        self._write_pos = 0
+        self._read_pos = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.overruns = 0
+        
+    @property
+    def available(self) -> int:
+        """Antal olästa samples."""
+        with self._cond:
+            return self._write_pos - self._read_pos
+        
+    def push(self, block: np.ndarray) -> None:
+        """Skriv ett block (anropas från ljudcallbacken)."""
+        n = len(block)
+        with self._cond:
+            if n > self.capacity:
+                block = block[n - self.capacity:]
+                self._write_pos += n - self.capacity
+                n = self.capacity
+            start = self._write_pos % self.capacity
+            first = min(n, self.capacity - start)
+            self._buffer[start:start + first] = block[:first]
+            self._buffer[:n - first] = block[first:]
+            self._write_pos += n
+            lost = self._write_pos - self._read_pos - self.capacity
+            if lost > 0:
+                self._read_pos += lost
+                self.overruns += 1
+            self._cond.notify()
+            
+    def readinto(self, out: np.ndarray, timeout: float = 2.0) -> None:
+        """
+        Fyll out med nästa len(out) samples, blockerande.
+        
+        Raises:
+            AudioStallError: Om inget ljud kommer inom timeout sekunder
+            AudioError: Om bufferten stängs
+        """
+        need = len(out)
+        copied = 0
+        with self._cond:
+            while copied < need:
+                if not self._cond.wait_for(
+                        lambda: self._write_pos > self._read_pos or self._closed, timeout):
+                    raise AudioStallError(f"Inget ljud från ingångsenheten på {timeout:.1f} s")
+                if self._write_pos == self._read_pos:
+                    raise AudioError("Inspelningsströmmen är stängd")
+                count = min(self._write_pos - self._read_pos, need - copied)
+                start = self._read_pos % self.capacity
+                first = min(count, self.capacity - start)
+                out[copied:copied + first] = self._buffer[start:start + first]
+                out[copied + first:copied + count] = self._buffer[:count - first]
+                self._read_pos += count
+                copied += count
+                
+    def discard(self) -> None:
+        """Släng allt oläst ljud."""
+        with self._cond:
+            self._read_pos = self._write_pos
+            
+    def close(self) -> None:
+        """Väck väntande läsare; oläst ljud kan fortfarande läsas."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+class CaptureStream:
+    """
+    Inspelningsström som läser i enhetens egen takt och levererar måltakten.
+    
+    Enheten öppnas i sin hårdvarutakt och ljudet omsamplas i mjukvara,
+    vilket fungerar även för mikrofoner som bara stödjer 44.1/48 kHz.
+    PortAudio-callbacken skriver till en förallokerad CaptureBuffer, och
+    läsaren fyller sina egna buffertar med readinto() eller får en vy med
+    read(), utan mellanliggande kopior.
+    """
+    
+    def __init__(self, pa: pyaudio.PyAudio, device_index: Optional[int],
+                 device_rate: int, target_rate: int, frames_per_buffer: int = 1024,
+                 channels: int = 1, aperture_m: float = 0.1, buffer_seconds: float = 2.0,
+                 read_timeout: float = 2.0, device_buffer_frames: int = 0):
+        """
+        Öppna inspelningsström.
+        
+        Args:
+            pa: PyAudio-instans
+            device_index: Index för ingångsenhet (None = default)
+            device_rate: Enhetens samplingsfrekvens i Hz
+            target_rate: Önskad samplingsfrekvens för konsumenten i Hz
+            frames_per_buffer: Buffertstorlek uttryckt i måltaktens samples
+            channels: Antal kanaler att öppna; fler än 1 formas till mono
+                med delay-and-sum-beamforming
+            aperture_m: Mikrofonarrayens största mikrofonavstånd i meter
+            buffer_seconds: Ringbuffertens längd i sekunder
+            read_timeout: Sekunder utan ljud innan en läsning ger AudioStallError
+            device_buffer_frames: PortAudio-buffertens storlek i måltaktens
+                samples (0 = frames_per_buffer)
+        """
+        self.device_rate = device_rate
+        self.read_timeout = read_timeout
+        self.target_rate = target_rate
+        self.channels = channels
+        self.beamformer = (Beamformer(channels, device_rate, aperture_m)
+                           if channels > 1 else None)
+        self._resampler = Resampler(device_rate, target_rate)
+        self._device_frames = max(1, int(round((device_buffer_frames or frames_per_buffer)
+                                               * device_rate / target_rate)))
+        self.input_overflows = 0
+        self.buffer = CaptureBuffer(max(int(buffer_seconds * target_rate), 4 * frames_per_buffer))
+        self._out = np.empty(frames_per_buffer, dtype=np.int16)
+        self._stream = pa.open(
+            format=pyaudio.paInt16,
+            channels=channels,
+            rate=device_rate,
+            input=True,
+            frames_per_buffer=self._device_frames,
+            input_device_index=device_index,
+            stream_callback=self._callback
+        )
+
+    def __enter__(self):
+        """Context manager support."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Stäng strömmen vid context manager exit."""
+        self.close()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        """PortAudio-callback: forma, omsampla och skriv till ringbufferten."""
+        if status & pyaudio.paInputOverflow:
+            self.input_overflows += 1
+        block = np.frombuffer(in_data, dtype=np.int16)
+        if self.beamformer is not None:
+            block = self.beamformer.process(block.reshape(-1, self.channels))
+        # Utan omsampling skrivs vyn av PortAudio-bufferten direkt till ringen
+        self.buffer.push(self._resampler.process(block))
+        return (None, pyaudio.paContinue)
+
+    def readinto(self, out: np.ndarray) -> None:
+        """
+        Fyll out (int16) med nästa len(out) samples i måltakten.
+        
+        Raises:
+            AudioStallError: Om enheten slutar leverera ljud
+        """
+        self.buffer.readinto(out, self.read_timeout)
+
+    def read(self, num_samples: int) -> np.ndarray:
+        """
+        Läs exakt num_samples samples i måltakten.
+        
+        Args:
+            num_samples: Antal samples att returnera
+            
+        Returns:
+            Vy (int16) i en intern buffert som skrivs över vid nästa read();
+            kopiera den om den ska sparas
+        """
+        if num_samples > len(self._out):
+            self._out = np.empty(num_samples, dtype=np.int16)
+        view = self._out[:num_samples]
+        self.buffer.readinto(view, self.read_timeout)
+        return view
+
+    def discard(self) -> None:
+        """Släng ljud som har buffrats men inte lästs."""
+        self.buffer.discard()
+
+    def record_utterance(self, gate: ActivityGate, max_seconds: float,
+                         start_timeout: float) -> Optional[np.ndarray]:
+        """
+        Spela in ett yttrande med VAD-slutpunkt.
+        
+        Väntar högst start_timeout sekunder på att gate öppnar och spelar
+        sedan in tills den stänger igen (efter dess eftersläpningstid) eller
+        max_seconds har gått. Ljudet skrivs direkt till en förallokerad buffert.
+        
+        Args:
+            gate: Aktivitetsgrind (ramlängd och eftersläpning styr slutpunkten)
+            max_seconds: Max längd på yttrandet
+            start_timeout: Max väntetid på att tal börjar
+            
+        Returns:
+            Ljud (int16), eller None om inget tal började
+        """
+        frame = gate.frame_length
+        max_frames = int(max_seconds * self.target_rate) // frame
+        audio = np.empty((max_frames + gate.lookback_capacity + 1) * frame, dtype=np.int16)
+        filled = 0
+        waited = 0
+        wait_frames = int(start_timeout * self.target_rate) // frame
+        
+        while filled < max_frames * frame:
+            frames = gate.process(self.read(frame))
+            if not filled:
+                if not frames:
+                    waited += 1
+                    if waited >= wait_frames:
+                        return None
+                    continue
+            elif not gate.open:
+                break
+            for f in frames:
+                audio[filled:filled + frame] = f
+                filled += frame
+        return audio[:filled]
+
+    def close(self) -> None:
+        """Stoppa och stäng den underliggande strömmen."""
+        if self._stream is not None:
+            try:
+                self._stream.stop_stream()
+                self._stream.close()
+            finally:
+                self._stream = None
+                self.buffer.close()
+
+class CaptureWatchdog:
+    """
+    Följer läsningarna från en inspelningsström och avgör när enheten
+    behöver återställas.
+    
+    En läsning som inte fått något ljud inom strömmens read_timeout
+    (AudioStallError) utlöser återställning direkt; andra fel först när
+    max_errors har inträffat i följd utan någon lyckad läsning emellan.
+    """
+    
+    def __init__(self, max_errors: int = 5):
+        """
+        Args:
+            max_errors: Antal fel i följd som utlöser återställning
+        """
+        self.max_errors = max(1, max_errors)
+        self.errors = 0
+        
+    def progress(self) -> None:
+        """Anropas efter varje lyckad läsning."""
+        if self.errors:
+            self.errors = 0
+            
+    def failed(self, error: Exception) -> bool:
+        """
+        Registrera ett fel.
+        
+        Returns:
+            True om enheten bör återställas
+        """
+        self.errors += 1
+        return isinstance(error, AudioStallError) or self.errors >= self.max_errors
+
+def find_input_device(pa: pyaudio.PyAudio, name: str) -> Optional[int]:
+    """
+    Hitta en ingångsenhet efter namn.
+    
+    Enhetsindex kan ändras när en USB-enhet kopplas in igen, namnet gör det
+    normalt inte.
+    
+    Args:
+        pa: PyAudio-instans
+        name: Del av enhetens namn (skiftlägesokänsligt)
+        
+    Returns:
+        Enhetsindex, eller None om ingen ingångsenhet matchar
+    """
+    wanted = name.lower()
+    for index in range(pa.get_device_count()):
+        info = pa.get_device_info_by_index(index)
+        if info.get('maxInputChannels', 0) > 0 and wanted in str(info.get('name', '')).lower():
+            return index
+    return None
+
 class AudioIO:
     """
     Hanterar ljudinspelning och uppspelning med PyAudio.
@@ -26,33 +1034,188 @@ class AudioIO:
                  input_device_index: Optional[int] = None, 
                  output_device_index: Optional[int] = None,
                  max_record_seconds: int = 30,
-                 stream_stabilize_delay: float = 0.1):
+                 stream_stabilize_delay: float = 0.1,
+                 input_rate: Optional[int] = None,
+                 output_rate: Optional[int] = None,
+                 input_channels: int = 1,
+                 mic_aperture_m: float = 0.1,
+                 input_device_name: str = "",
+                 read_timeout: float = 2.0,
+                 input_buffer_frames: int = 0):
         """
         Initialisera ljudhantering.
         
         Args:
-            sample_rate: Samplingsfrekvens i Hz
+            sample_rate: Samplingsfrekvens i Hz för inspelat ljud (STT/wakeword)
             input_device_index: Index för ingångsenhet (None = default)
             output_device_index: Index för utgångsenhet (None = default)
             max_record_seconds: Max inspelningstid (säkerhet)
             stream_stabilize_delay: Fördröjning efter att stream öppnats (sekunder)
+            input_rate: Ingångsenhetens takt i Hz (None = autodetektera)
+            output_rate: Utgångsenhetens takt i Hz (None = autodetektera)
+            input_channels: Antal ingångskanaler (mikrofonarray > 1 formas till mono)
+            mic_aperture_m: Mikrofonarrayens största mikrofonavstånd i meter
+            input_device_name: Ingångsenhet efter namn (del av namnet); har
+                företräde framför input_device_index
+            read_timeout: Sekunder utan ljud innan en inspelningsläsning ger upp
+            input_buffer_frames: PortAudio-buffert för inspelning i samples
+                (0 = samma som läsblocket)
         """
         if sample_rate <= 0:
             raise ValueError(f"Ogiltig sample rate: {sample_rate}")
         if max_record_seconds <= 0:
             raise ValueError(f"Ogiltig max_record_seconds: {max_record_seconds}")
+        if input_channels < 1:
+            raise ValueError(f"Ogiltigt antal ingångskanaler: {input_channels}")
             
         self.sample_rate = sample_rate
         self.input_device_index = input_device_index
         self.output_device_index = output_device_index
         self.max_record_seconds = max_record_seconds
         self.stream_stabilize_delay = stream_stabilize_delay
+        self.input_channels = input_channels
+        self.mic_aperture_m = mic_aperture_m
+        self.input_device_name = input_device_name
+        self.read_timeout = read_timeout
+        self.input_buffer_frames = input_buffer_frames
+        self.volume = 1.0
+        self._stop_playback = threading.Event()
+        self._configured_input_rate = input_rate
+        # Skyddar self.pa mot att startas om medan en annan tråd använder den.
+        # Hålls bara runt open/close/terminate, aldrig medan en ström skriver.
+        self._pa_lock = threading.RLock()
+        # Öppna uppspelningsströmmar; reset_devices väntar tills de är stängda
+        self._output_streams = 0
+        self._output_closed = threading.Condition(self._pa_lock)
         
         try:
             self.pa = pyaudio.PyAudio()
             logging.info(f"PyAudio initialiserad (sample rate: {sample_rate} Hz)")
         except Exception as e:
             raise AudioError(f"Kunde inte initialisera PyAudio: {e}")
+            
+        if input_device_name:
+            self._resolve_input_device()
+        self.input_rate = input_rate or self._detect_rate(self.input_device_index, is_input=True)
+        self.output_rate = output_rate or self._detect_rate(output_device_index, is_input=False)
+        logging.info(f"Enhetstakter: in={self.input_rate} Hz, ut={self.output_rate} Hz")
+        if input_channels > 1:
+            logging.info(f"Mikrofonarray: {input_channels} kanaler, beamforming "
+                         f"(apertur {mic_aperture_m * 100:.0f} cm)")
+
+    def _detect_rate(self, device_index: Optional[int], is_input: bool) -> int:
+        """
+        Välj samplingsfrekvens att öppna en enhet med.
+        
+        Ingångar öppnas i måltakten om enheten stödjer den, annars i enhetens
+        standardtakt. Utgångar öppnas alltid i standardtakten och allt ljud
+        omsamplas dit.
+        
+        Args:
+            device_index: Enhetsindex (None = default)
+            is_input: True för ingångsenhet
+            
+        Returns:
+            Samplingsfrekvens i Hz
+        """
+        try:
+            if device_index is None:
+                info = (self.pa.get_default_input_device_info() if is_input
+                        else self.pa.get_default_output_device_info())
+            else:
+                info = self.pa.get_device_info_by_index(device_index)
+                
+            if is_input:
+                try:
+                    if self.pa.is_format_supported(self.sample_rate,
+                                                   input_device=int(info['index']),
+                                                   input_channels=self.input_channels,
+                                                   input_format=pyaudio.paInt16):
+                        return self.sample_rate
+                except ValueError:
+                    pass
+            return int(info['defaultSampleRate'])
+        except Exception as e:
+            logging.warning(f"Kunde inte avgöra enhetstakt, använder {self.sample_rate} Hz: {e}")
+            return self.sample_rate
+
+    def _resolve_input_device(self) -> None:
+        """
+        Slå upp ingångsenhetens index från input_device_name.
+        
+        Raises:
+            AudioError: Om ingen ingångsenhet matchar namnet
+        """
+        index = find_input_device(self.pa, self.input_device_name)
+        if index is None:
+            raise AudioError(f"Ingen ingångsenhet matchar '{self.input_device_name}'")
+        if index != self.input_device_index:
+            logging.info(f"Ingångsenhet '{self.input_device_name}': index {index}")
+        self.input_device_index = index
+
+    def reset_devices(self) -> None:
+        """
+        Starta om PortAudio och räkna upp enheterna på nytt.
+        
+        PortAudio ser nya eller återanslutna enheter först efter en ny
+        initiering. Ingångsenheten slås upp efter namn igen och dess takt
+        autodetekteras på nytt. Strömmar öppnade från den gamla instansen
+        måste vara stängda.
+        
+        Raises:
+            AudioError: Om PortAudio inte kan initieras eller enheten saknas
+        """
+        with self._pa_lock:
+            if self._output_streams:
+                # Uppspelningen hör till den gamla instansen och avbryts
+                self._stop_playback.set()
+                if not self._output_closed.wait_for(lambda: not self._output_streams, timeout=2.0):
+                    logging.warning("Uppspelningen stängdes inte, startar om PortAudio ändå")
+            try:
+                self.pa.terminate()
+            except Exception as e:
+                logging.debug(f"Fel vid avslutning av PyAudio: {e}")
+            try:
+                self.pa = pyaudio.PyAudio()
+            except Exception as e:
+                raise AudioError(f"Kunde inte initialisera PyAudio: {e}")
+            if self.input_device_name:
+                self._resolve_input_device()
+            self.input_rate = (self._configured_input_rate
+                               or self._detect_rate(self.input_device_index, is_input=True))
+
+    def recover_capture(self, frames_per_buffer: int, keep_trying: Callable[[], bool],
+                        max_backoff: float = 30.0) -> Optional[CaptureStream]:
+        """
+        Återställ ljudenheterna och öppna en ny inspelningsström.
+        
+        Försöker med exponentiellt ökande väntetid tills det lyckas eller
+        keep_trying() returnerar False. Den gamla strömmen ska vara stängd.
+        
+        Args:
+            frames_per_buffer: Buffertstorlek i samples (i self.sample_rate)
+            keep_trying: Anropas före varje försök
+            max_backoff: Längsta väntetid mellan försök i sekunder
+            
+        Returns:
+            Ny CaptureStream, eller None om keep_trying() avbröt
+        """
+        delay = 0.5
+        attempt = 0
+        while keep_trying():
+            attempt += 1
+            try:
+                self.reset_devices()
+                stream = self.open_capture(frames_per_buffer=frames_per_buffer)
+                logging.info(f"Ljudenheten återställd efter {attempt} försök "
+                             f"(index {self.input_device_index}, {self.input_rate} Hz)")
+                return stream
+            except Exception as e:
+                logging.warning(f"Kunde inte återställa ljudenheten (försök {attempt}): {e}; "
+                                f"nytt försök om {delay:.1f} s")
+                time.sleep(delay)
+                delay = min(delay * 2, max_backoff)
+        return None
 
     def __enter__(self):
         """Context manager support."""
@@ -66,17 +1229,19 @@ class AudioIO:
         """Frigör PyAudio-resurser."""
         try:
             if hasattr(self, 'pa'):
-                self.pa.terminate()
+                with self._pa_lock:
+                    self.pa.terminate()
                 logging.debug("PyAudio resurs frigjord")
         except Exception as e:
             logging.error(f"Fel vid cleanup av PyAudio: {e}")
 
-    def record(self, seconds: float) -> np.ndarray:
+    def record(self, seconds: float, dsp: Optional[CaptureDSP] = None) -> np.ndarray:
         """
         Spela in ljud under angiven tid.
         
         Args:
             seconds: Inspelningstid i sekunder
+            dsp: DSP-kedja som varje block passerar (None = obearbetat)
             
         Returns:
             NumPy array med PCM audio data
@@ -90,53 +1255,199 @@ class AudioIO:
         if seconds > self.max_record_seconds:
             raise ValueError(f"Inspelningstid ({seconds}s) överstiger max ({self.max_record_seconds}s)")
             
-        channels = 1
-        format = pyaudio.paInt16
         chunk = 1024
         stream = None
         
         try:
-            stream = self.pa.open(
-                format=format,
-                channels=channels,
-                rate=self.sample_rate,
-                input=True,
-                frames_per_buffer=chunk,
-                input_device_index=self.input_device_index
-            )
+            stream = self.open_capture(frames_per_buffer=chunk)
             
             # Kort paus för att låta ljudströmmen stabiliseras
             # Detta förhindrar att första chunks innehåller brus eller ofullständig data
             time.sleep(self.stream_stabilize_delay)
+            stream.discard()
             
-            frames = []
-            num_chunks = int(self.sample_rate / chunk * seconds)
+            # Ljudet skrivs direkt in i den förallokerade resultatbufferten
+            audio = np.empty(int(self.sample_rate / chunk * seconds) * chunk, dtype=np.int16)
+            filled = 0
+            if dsp is not None:
+                dsp.reset()
             
-            for _ in range(num_chunks):
+            while filled < len(audio):
+                block = audio[filled:filled + chunk]
                 try:
-                    data = stream.read(chunk, exception_on_overflow=False)
-                    frames.append(np.frombuffer(data, dtype=np.int16))
+                    stream.readinto(block)
                 except Exception as e:
                     logging.warning(f"Fel vid läsning av ljudchunk: {e}")
-                    continue
+                    break
+                if dsp is not None:
+                    dsp.process(block, out=block)
+                filled += chunk
                     
-            if not frames:
+            if not filled:
                 raise AudioError("Ingen ljuddata inspelad")
                 
-            audio = np.concatenate(frames)
-            logging.debug(f"Inspelning klar: {len(audio)} samples")
-            return audio
+            logging.debug(f"Inspelning klar: {filled} samples")
+            return audio[:filled]
             
         except Exception as e:
             raise AudioError(f"Inspelning misslyckades: {e}")
         finally:
             if stream is not None:
                 try:
-                    stream.stop_stream()
                     stream.close()
                 except Exception as e:
                     logging.error(f"Fel vid stängning av inspelningsström: {e}")
 
+    def open_capture(self, frames_per_buffer: int = 1024) -> CaptureStream:
+        """
+        Öppna en inspelningsström som levererar ljud i self.sample_rate.
+        
+        Args:
+            frames_per_buffer: Buffertstorlek i samples (i self.sample_rate)
+            
+        Returns:
+            CaptureStream (stängs av anroparen)
+        """
+        with self._pa_lock:
+            return CaptureStream(
+                self.pa,
+                self.input_device_index,
+                device_rate=self.input_rate,
+                target_rate=self.sample_rate,
+                frames_per_buffer=frames_per_buffer,
+                channels=self.input_channels,
+                aperture_m=self.mic_aperture_m,
+                read_timeout=self.read_timeout,
+                device_buffer_frames=self.input_buffer_frames
+            )
+
+    def duplex_rate(self) -> int:
+        """
+        Samplingsfrekvens som både ingången och utgången stödjer i en duplexström.
+        
+        Raises:
+            AudioError: Om enheterna saknar gemensam takt
+        """
+        with self._pa_lock:
+            input_device = (self.input_device_index if self.input_device_index is not None
+                            else self.pa.get_default_input_device_info()["index"])
+            output_device = (self.output_device_index if self.output_device_index is not None
+                             else self.pa.get_default_output_device_info()["index"])
+            for rate in dict.fromkeys((self.input_rate, self.output_rate, 48000, 44100, 16000)):
+                try:
+                    if self.pa.is_format_supported(
+                            rate,
+                            input_device=input_device, input_channels=self.input_channels,
+                            input_format=pyaudio.paInt16,
+                            output_device=output_device, output_channels=self.input_channels,
+                            output_format=pyaudio.paInt16):
+                        return rate
+                except ValueError:
+                    continue
+        raise AudioError("Ingången och utgången har ingen gemensam samplingsfrekvens")
+
+    @contextmanager
+    def open_duplex(self, rate: int, callback: Callable, frames_per_buffer: int = 256):
+        """
+        Öppna en duplexström där in- och utgången delar sampleklocka.
+        
+        PyAudio har samma kanalantal åt båda hållen (input_channels), så
+        callbacken får och ska lämna så många kanaler. Strömmen räknas som
+        en öppen utgång, så reset_devices() väntar tills den har stängts.
+        
+        Args:
+            rate: Samplingsfrekvens (se duplex_rate())
+            callback: PyAudio stream_callback
+            frames_per_buffer: Buffertstorlek i samples
+            
+        Yields:
+            Den startade PyAudio-strömmen; stängs när blocket lämnas
+        """
+        with self._pa_lock:
+            stream = self.pa.open(
+                format=pyaudio.paInt16,
+                channels=self.input_channels,
+                rate=rate,
+                input=True,
+                output=True,
+                input_device_index=self.input_device_index,
+                output_device_index=self.output_device_index,
+                frames_per_buffer=frames_per_buffer,
+                stream_callback=callback
+            )
+            self._output_streams += 1
+        try:
+            yield stream
+        finally:
+            with self._pa_lock:
+                try:
+                    stream.stop_stream()
+                    stream.close()
+                except Exception as e:
+                    logging.error(f"Fel vid stängning av duplexström: {e}")
+                self._output_streams -= 1
+                self._output_closed.notify_all()
+
+    def _write_output(self, pcm: np.ndarray, sample_rate: int) -> None:
+        """
+        Omsampla till utgångsenhetens takt och spela upp blockerande.
+        
+        Args:
+            pcm: Mono PCM (int16)
+            sample_rate: PCM-datats samplingsfrekvens i Hz
+        """
+        pcm = resample(pcm.astype(np.int16, copy=False), sample_rate, self.output_rate)
+        if self.volume != 1.0:
+            pcm = np.clip(pcm * self.volume, -32768, 32767).astype(np.int16)
+            
+        self._stop_playback.clear()
+        # Låset hålls bara när strömmen öppnas och stängs, så att inspelning
+        # (t.ex. "stopp" mitt i ett svar) kan starta under uppspelningen
+        with self._pa_lock:
+            stream = self.pa.open(
+                format=pyaudio.paInt16,
+                channels=1,
+                rate=self.output_rate,
+                output=True,
+                output_device_index=self.output_device_index
+            )
+            self._output_streams += 1
+        try:
+            # Skriv i korta block så att uppspelningen kan avbrytas
+            block = max(1, self.output_rate // 10)
+            for start in range(0, len(pcm), block):
+                if self._stop_playback.is_set():
+                    logging.debug("Uppspelning avbruten")
+                    break
+                stream.write(pcm[start:start + block].tobytes())
+        finally:
+            with self._pa_lock:
+                try:
+                    stream.stop_stream()
+                    stream.close()
+                except Exception as e:
+                    logging.error(f"Fel vid stängning av uppspelningsström: {e}")
+                self._output_streams -= 1
+                self._output_closed.notify_all()
+
+    def stop_playback(self) -> None:
+        """Avbryt pågående uppspelning (anropas från en annan tråd)."""
+        self._stop_playback.set()
+
+    def set_volume(self, volume: float) -> float:
+        """
+        Sätt uppspelningsvolym.
+        
+        Args:
+            volume: Förstärkning (1.0 = oförändrad), begränsas till 0.0-2.0
+            
+        Returns:
+            Den nya volymen
+        """
+        self.volume = min(2.0, max(0.0, volume))
+        logging.info(f"Volym: {self.volume:.2f}")
+        return self.volume
+
     def play_wav(self, path: str) -> bool:
         """
         Spela upp WAV-fil.
@@ -155,46 +1466,28 @@ class AudioIO:
             logging.warning(f"Sökvägen är inte en fil: {path}")
             return False
             
-        stream = None
         try:
             data, sr = sf.read(path, dtype='int16')
             
-            if sr != self.sample_rate:
-                logging.debug(f"WAV sample rate {sr} != expected {self.sample_rate}, spelar ändå")
-            
             # Hantera stereo till mono
             if len(data.shape) > 1:
                 data = np.mean(data, axis=1).astype(np.int16)
                 
-            stream = self.pa.open(
-                format=pyaudio.paInt16,
-                channels=1,
-                rate=sr,
-                output=True,
-                output_device_index=self.output_device_index
-            )
-            
-            stream.write(data.tobytes())
+            self._write_output(data, sr)
             logging.debug(f"WAV uppspelning klar: {path}")
             return True
             
         except Exception as e:
             logging.error(f"Fel vid uppspelning av WAV {path}: {e}")
             return False
-        finally:
-            if stream is not None:
-                try:
-                    stream.stop_stream()
-                    stream.close()
-                except Exception as e:
-                    logging.error(f"Fel vid stängning av uppspelningsström: {e}")
 
-    def play_pcm(self, pcm: np.ndarray) -> bool:
+    def play_pcm(self, pcm: np.ndarray, sample_rate: Optional[int] = None) -> bool:
         """
         Spela upp PCM audio data.
         
         Args:
             pcm: NumPy array med PCM data
+            sample_rate: PCM-datats samplingsfrekvens (None = self.sample_rate)
             
         Returns:
             True om uppspelning lyckades
@@ -207,30 +1500,14 @@ class AudioIO:
             logging.warning("Tom PCM data, hoppar över uppspelning")
             return False
             
-        stream = None
         try:
-            stream = self.pa.open(
-                format=pyaudio.paInt16,
-                channels=1,
-                rate=self.sample_rate,
-                output=True,
-                output_device_index=self.output_device_index
-            )
-            
-            stream.write(pcm.astype(np.int16).tobytes())
+            self._write_output(pcm, sample_rate or self.sample_rate)
             logging.debug(f"PCM uppspelning klar: {len(pcm)} samples")
             return True
             
         except Exception as e:
             logging.error(f"Fel vid uppspelning av PCM: {e}")
             return False
-        finally:
-            if stream is not None:
-                try:
-                    stream.stop_stream()
-                    stream.close()
-                except Exception as e:
-                    logging.error(f"Fel vid stängning av PCM-ström: {e}")
     
     def list_devices(self) -> None:
         """Visa tillgängliga ljudenheter (för debugging)."""
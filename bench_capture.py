@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Allokeringsmätning för inspelningsvägen.
+
+Jämför den tidigare vägen (en ny array per läsning, lista och
+np.concatenate) med CaptureBuffer + readinto, för wakeword-loopen och
+för en kommandoinspelning. PortAudio-blocken genereras i förväg så att
+bara inspelningsvägens egna allokeringar mäts.
+
+För varje PortAudio-block mäter tracemalloc hur mycket minne som
+allokerades utöver det som redan fanns (toppen under blocket). Summan
+per sekund ljud och antalet block som allokerade något redovisas.
+
+Användning:
+    python bench_capture.py [--seconds 10] [--frame 512]
+"""
+import argparse
+import tracemalloc
+from typing import List, Optional
+
+import numpy as np
+
+import config
+from audio_utils import CaptureBuffer
+
+DEVICE_FRAMES = 1024
+
+def _device_blocks(seconds: float, rate: int):
+    """Syntetiska PortAudio-block (bytes) för seconds sekunder ljud."""
+    rng = np.random.default_rng(0)
+    count = int(seconds * rate) // DEVICE_FRAMES
+    return [(rng.standard_normal(DEVICE_FRAMES) * 1000).astype(np.int16).tobytes()
+            for _ in range(count)]
+
+class LegacyWake:
+    """Tidigare wakeword-loop: frombuffer + concatenate per block."""
+
+    def __init__(self, total: int, frame: int):
+        self.frame = frame
+        self.pending = np.zeros(0, dtype=np.int16)
+
+    def step(self, data: bytes) -> None:
+        self.pending = np.concatenate((self.pending, np.frombuffer(data, dtype=np.int16)))
+        while len(self.pending) >= self.frame:
+            pcm = self.pending[:self.frame]
+            self.pending = self.pending[self.frame:]
+            self.last = pcm[0]
+
+class BufferedWake:
+    """Ny wakeword-loop: push från callbacken, readinto i en återanvänd buffert."""
+
+    def __init__(self, total: int, frame: int):
+        self.buffer = CaptureBuffer(4 * DEVICE_FRAMES)
+        self.out = np.empty(frame, dtype=np.int16)
+
+    def step(self, data: bytes) -> None:
+        self.buffer.push(np.frombuffer(data, dtype=np.int16))
+        while self.buffer.available >= len(self.out):
+            self.buffer.readinto(self.out)
+            self.last = self.out[0]
+
+class LegacyRecord:
+    """Tidigare inspelning: lista med arrayer, np.concatenate på slutet."""
+
+    def __init__(self, total: int, frame: int):
+        self.total = total
+        self.frames = []
+
+    def step(self, data: bytes) -> None:
+        self.frames.append(np.frombuffer(data, dtype=np.int16))
+        if len(self.frames) * DEVICE_FRAMES == self.total:
+            self.audio = np.concatenate(self.frames)
+
+class BufferedRecord:
+    """Ny inspelning: readinto direkt i en förallokerad resultatbuffert."""
+
+    def __init__(self, total: int, frame: int):
+        self.buffer = CaptureBuffer(4 * DEVICE_FRAMES)
+        self.audio = np.empty(total, dtype=np.int16)
+        self.filled = 0
+
+    def step(self, data: bytes) -> None:
+        self.buffer.push(np.frombuffer(data, dtype=np.int16))
+        self.buffer.readinto(self.audio[self.filled:self.filled + DEVICE_FRAMES])
+        self.filled += DEVICE_FRAMES
+
+def measure(case, blocks):
+    """
+    Mata blocken genom case under tracemalloc.
+
+    Returns:
+        Tuple (allokerade bytes, antal block som allokerade)
+    """
+    allocated = 0
+    allocating = 0
+    tracemalloc.start()
+    for data in blocks:
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        case.step(data)
+        _, peak = tracemalloc.get_traced_memory()
+        if peak > current:
+            allocated += peak - current
+            allocating += 1
+    tracemalloc.stop()
+    return allocated, allocating
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Allokeringsmätning för inspelningsvägen")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Sekunder ljud")
+    parser.add_argument("--frame", type=int, default=512, help="Wakeword-ramlängd")
+    args = parser.parse_args(argv)
+
+    rate = config.SAMPLE_RATE
+    blocks = _device_blocks(args.seconds, rate)
+    total = len(blocks) * DEVICE_FRAMES
+    seconds = total / rate
+    print(f"{seconds:.1f} s ljud i {rate} Hz, {len(blocks)} block om {DEVICE_FRAMES} samples\n")
+    print(f"{'Väg':<28}{'kB/s':>10}{'block/s som allokerar':>24}")
+    for name, cls in (("wakeword, tidigare", LegacyWake),
+                      ("wakeword, CaptureBuffer", BufferedWake),
+                      ("inspelning, tidigare", LegacyRecord),
+                      ("inspelning, CaptureBuffer", BufferedRecord)):
+        allocated, allocating = measure(cls(total, args.frame), blocks)
+        print(f"{name:<28}{allocated / seconds / 1024:>10.1f}{allocating / seconds:>24.1f}")
+    print("\nFörallokerade buffertar skapas före mätningen; PortAudio-blocken räknas inte.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Last- och latenstest för MqttClient mot en fake-broker i samma process.
+
+Brokern (fake_broker.py) lyssnar på 127.0.0.1, så inget nätverk eller
+extern broker behövs. Testet har två delar:
+
+  svar:      brokern skickar --messages svar till MQTT_TOPIC_RESPONSES så
+             fort klienten tar emot dem. Blandningen innehåller giltig
+             JSON, ej escapade citattecken som _fix_unescaped_quotes_in_json
+             ska laga (även nära max_payload_size), trasig JSON, ogiltig
+             UTF-8 och för stora meddelanden. Latensen mäts från
+             publicering till callback.
+  kommandon: klienten publicerar --commands kommandon med publish_json
+             och latensen mäts fram till brokern.
+
+Med --disconnects bryts anslutningen under svarsdelen och tiden tills
+klienten är ansluten och prenumererar igen mäts; --refuse avvisar
+dessutom så många återanslutningsförsök efter varje avbrott. Utan --rate
+skickas svaren så fort som möjligt och latensen inkluderar kön; med
+--rate skickas de i jämn takt.
+
+Användning:
+    python bench_mqtt.py [--messages 5000] [--commands 2000] [--disconnects 2]
+                         [--refuse 0] [--rate 0]
+"""
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from typing import Dict, List, Optional
+
+import config
+from fake_broker import FakeBroker
+from mqtt_client import MqttClient
+
+MAX_PAYLOAD = 100000
+
+# Andel av svaren per sort, och om callbacken ska anropas för sorten
+KINDS = {
+    "giltig": (0.80, True),
+    "citattecken": (0.10, True),
+    "stor+citattecken": (0.02, True),
+    "trasig": (0.04, False),
+    "ogiltig utf-8": (0.02, False),
+    "för stor": (0.02, False),
+}
+
+def make_payload(kind: str, seq: int) -> bytes:
+    """Bygg ett svar av given sort med sekvensnummer och sändtid."""
+    head = f'{{"seq": {seq}, "kind": "{kind}", "t": {time.perf_counter()!r}, "tts_text": '
+    if kind == "giltig":
+        return (head + json.dumps(f"Svar nummer {seq}, allt är lugnt.", ensure_ascii=False)
+                + "}").encode("utf-8")
+    if kind == "citattecken":
+        return (head + f'"Jag hittade "kan mat" och "{seq}" åt dig."}}').encode("utf-8")
+    if kind == "stor+citattecken":
+        text = 'Han sa "hej" och gick. ' * ((MAX_PAYLOAD - 200) // 24)
+        return (head + f'"{text}"}}').encode("utf-8")
+    if kind == "trasig":
+        return (head + '"avbrutet svar').encode("utf-8")
+    if kind == "ogiltig utf-8":
+        return head.encode("utf-8") + b'"\xff\xfe"}'
+    return (head + json.dumps("x" * (MAX_PAYLOAD + 1)) + "}").encode("utf-8")
+
+def _percentiles(samples: List[float]) -> str:
+    """p50/p95/p99/max i ms."""
+    if not samples:
+        return f"{'-':>9}" * 4
+    ordered = sorted(samples)
+    n = len(ordered)
+    values = [ordered[min(n - 1, int(n * q))] for q in (0.5, 0.95, 0.99)] + [ordered[-1]]
+    return "".join(f"{v * 1000:>7.2f}ms" for v in values)
+
+class ResponseCollector:
+    """Callback för MqttClient som mäter latens per sort."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {kind: [] for kind in KINDS}
+        self.received = 0
+
+    def __call__(self, topic: str, data: Dict) -> None:
+        now = time.perf_counter()
+        with self.lock:
+            self.latencies.setdefault(data.get("kind", "?"), []).append(now - data["t"])
+            self.received += 1
+
+def _wait_for(predicate, timeout: float) -> bool:
+    """Vänta tills predicate() är sant; False vid timeout."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+def bench_responses(broker: FakeBroker, client: MqttClient, messages: int,
+                    disconnects: int, refuse: int, rate: float = 0.0) -> None:
+    """Skicka svar från brokern och rapportera genomströmning, latens och återanslutning."""
+    topic = config.MQTT_TOPIC_RESPONSES
+    collector = ResponseCollector()
+    client.on_message_cb = collector
+    rng = random.Random(0)
+    kinds = rng.choices(list(KINDS), weights=[w for w, _ in KINDS.values()], k=messages)
+    drop_at = {messages * (i + 1) // (disconnects + 1) for i in range(disconnects)}
+    sent = {kind: 0 for kind in KINDS}
+    reconnect_times: List[Optional[float]] = []
+
+    start = time.perf_counter()
+    for seq, kind in enumerate(kinds):
+        if seq in drop_at:
+            # Vänta in det som redan skickats, så att förlusterna bara beror på avbrottet
+            _wait_for(lambda: collector.received >= sum(
+                n for k, n in sent.items() if KINDS[k][1]), 5.0)
+            broker.refuse_connections(refuse)
+            broker.drop_clients()
+            dropped = time.perf_counter()
+            ok = _wait_for(lambda: client.is_connected and broker.is_subscribed(topic), 60.0)
+            reconnect_times.append(time.perf_counter() - dropped if ok else None)
+        if rate > 0:
+            # Jämn takt: latensen mäter då klienten och inte kön framför den
+            delay = start + sum(t or 0 for t in reconnect_times) + seq / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if broker.publish(topic, make_payload(kind, seq)):
+            sent[kind] += 1
+    expected = sum(n for kind, n in sent.items() if KINDS[kind][1])
+    _wait_for(lambda: collector.received >= expected, 10.0)
+    elapsed = time.perf_counter() - start - sum(t or 0 for t in reconnect_times)
+
+    print(f"Svar: {messages} skickade, {collector.received} callbacks, "
+          f"{collector.received / elapsed:.0f} callbacks/s (utan avbrottstid)\n")
+    print(f"{'Sort':<20}{'skickade':>9}{'callbacks':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for kind, (_, delivered) in KINDS.items():
+        latencies = collector.latencies.get(kind, [])
+        print(f"{kind:<20}{sent[kind]:>9}{len(latencies):>10}{_percentiles(latencies)}"
+              + ("" if delivered or not latencies else "  (borde ha avvisats)"))
+
+    if reconnect_times:
+        print(f"\nÅteranslutningar: {client.reconnects} (brokern avvisade {broker.refused} försök)")
+        for i, seconds in enumerate(reconnect_times, 1):
+            print(f"  avbrott {i}: " + (f"ansluten och prenumererar igen efter {seconds:.2f} s"
+                                        if seconds is not None else "återanslöt inte inom 60 s"))
+        print(f"  meddelanden utan mottagare: {broker.unrouted}")
+
+def bench_commands(broker: FakeBroker, client: MqttClient, commands: int) -> None:
+    """Publicera kommandon med publish_json och mät tiden fram till brokern."""
+    topic = config.MQTT_TOPIC_COMMANDS
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def on_publish(published_topic: str, payload: bytes) -> None:
+        if published_topic == topic:
+            now = time.perf_counter()
+            with lock:
+                latencies.append(now - json.loads(payload)["t"])
+
+    broker.on_publish = on_publish
+    start = time.perf_counter()
+    failed = 0
+    for seq in range(commands):
+        if not client.publish_json(topic, {"text": f"tänd lampan {seq}", "seq": seq,
+                                           "t": time.perf_counter()}):
+            failed += 1
+    _wait_for(lambda: len(latencies) >= commands - failed, 10.0)
+    elapsed = time.perf_counter() - start
+    broker.on_publish = None
+
+    print(f"\nKommandon: {commands} publicerade ({failed} misslyckades), "
+          f"{len(latencies)} framme, {len(latencies) / elapsed:.0f} meddelanden/s")
+    print(f"{'':<20}{'':>19}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    print(f"{'publish -> broker':<39}{_percentiles(latencies)}")
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Last- och latenstest för MqttClient")
+    parser.add_argument("--messages", type=int, default=5000, help="Antal svar från brokern")
+    parser.add_argument("--commands", type=int, default=2000, help="Antal kommandon från klienten")
+    parser.add_argument("--disconnects", type=int, default=2, help="Avbrott under svarsdelen")
+    parser.add_argument("--refuse", type=int, default=0,
+                        help="Avvisade återanslutningsförsök per avbrott")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Svar per sekund (0 = så fort klienten hinner)")
+    parser.add_argument("--verbose", action="store_true", help="Visa klientens loggning")
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        # Trasiga meddelanden loggas annars som fel, ett per meddelande
+        logging.disable(logging.CRITICAL)
+    try:
+        with FakeBroker() as broker:
+            client = MqttClient("127.0.0.1", broker.port, client_id="bench-mqtt",
+                                max_payload_size=MAX_PAYLOAD)
+            if not client.connect(retries=1, timeout=5):
+                print("Kunde inte ansluta till fake-brokern")
+                return
+            client.subscribe(config.MQTT_TOPIC_RESPONSES)
+            _wait_for(lambda: broker.is_subscribed(config.MQTT_TOPIC_RESPONSES), 5.0)
+            try:
+                bench_responses(broker, client, args.messages, args.disconnects, args.refuse,
+                                args.rate)
+                bench_commands(broker, client, args.commands)
+            finally:
+                client.disconnect()
+                client.loop_stop()
+    finally:
+        logging.disable(logging.NOTSET)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Kalibrering av ljudvägen på de konfigurerade enheterna.
+
+Mäter fördröjningen från högtalare till mikrofon med ett svep (chirp),
+den minsta inspelningsbuffert som klarar sig utan överskridningar under
+CPU-last, hur lång tid en ny inspelningsström behöver för att stabiliseras
+och rummets brusgolv. recommend() översätter mätningarna till värden för
+.env. Används av setup_wizard.py.
+"""
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pyaudio
+
+from audio_utils import AudioIO, AudioError, frame_levels
+
+BUFFER_CANDIDATES = (128, 256, 512, 1024)
+# Läsblock i måltakten, samma som wakeword-loopen och ActivityGate använder
+READ_FRAME = 512
+
+def make_chirp(sample_rate: int, duration: float = 0.1, f0: float = 500.0,
+               f1: float = 4000.0, amplitude: float = 0.5) -> np.ndarray:
+    """
+    Skapa ett exponentiellt frekvenssvep med mjuk in- och uttoning.
+
+    Returns:
+        Svepet som int16
+    """
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    k = np.log(f1 / f0)
+    phase = 2 * np.pi * f0 * duration / k * (np.exp(t * k / duration) - 1)
+    fade = max(1, len(t) // 10)
+    window = np.ones(len(t))
+    window[:fade] = np.hanning(2 * fade)[:fade]
+    window[-fade:] = np.hanning(2 * fade)[fade:]
+    return (np.sin(phase) * window * amplitude * 32767).astype(np.int16)
+
+def find_delay(recording: np.ndarray, reference: np.ndarray,
+               min_snr: float = 8.0) -> Optional[int]:
+    """
+    Hitta var reference börjar i recording med FFT-korskorrelation.
+
+    Args:
+        recording: Inspelat ljud
+        reference: Den uppspelade signalen
+        min_snr: Minsta kvot mellan korrelationstoppen och medianen
+
+    Returns:
+        Fördröjning i samples, eller None om toppen inte sticker ut
+    """
+    n = len(recording) + len(reference)
+    size = 1 << (n - 1).bit_length()
+    spectrum = (np.fft.rfft(recording.astype(np.float32), size)
+                * np.conj(np.fft.rfft(reference.astype(np.float32), size)))
+    corr = np.abs(np.fft.irfft(spectrum, size)[:len(recording)])
+    peak = int(np.argmax(corr))
+    floor = float(np.median(corr)) + 1e-9
+    if corr[peak] / floor < min_snr:
+        return None
+    return peak
+
+def measure_round_trip(audio: AudioIO, repeats: int = 3, lead: float = 0.3,
+                       tail: float = 0.7) -> Optional[float]:
+    """
+    Mät fördröjningen från uppspelning till inspelning.
+
+    Svepet spelas i en duplexström där in- och utgången delar samma
+    sampleklocka, så fördröjningen räknas från det sample där svepet
+    skrevs till det sample där det hördes. Utgångens och ingångens
+    buffertar och den akustiska vägen ingår.
+
+    Args:
+        audio: Öppnad AudioIO med de enheter som ska mätas
+        repeats: Antal mätningar; medianen används
+        lead: Tystnad före svepet i sekunder
+        tail: Inspelning efter svepet i sekunder
+
+    Returns:
+        Fördröjningen i sekunder, eller None om svepet inte hördes
+    """
+    rate = audio.duplex_rate()
+    chirp = make_chirp(rate)
+    start = int(lead * rate)
+    total = start + len(chirp) + int(tail * rate)
+    channels = audio.input_channels
+    delays: List[float] = []
+
+    for attempt in range(repeats):
+        played = np.zeros(total, dtype=np.int16)
+        played[start:start + len(chirp)] = chirp
+        recorded = np.zeros(total, dtype=np.int16)
+        position = [0]
+        done = threading.Event()
+
+        def callback(in_data, frame_count, time_info, status):
+            pos = position[0]
+            count = min(frame_count, total - pos)
+            block = np.frombuffer(in_data, dtype=np.int16)[::channels]
+            recorded[pos:pos + count] = block[:count]
+            # PyAudio har samma kanalantal åt båda hållen; svepet läggs i alla utkanaler
+            out = np.zeros((frame_count, channels), dtype=np.int16)
+            out[:count] = played[pos:pos + count, None]
+            position[0] = pos + count
+            if position[0] >= total:
+                done.set()
+                return (out.tobytes(), pyaudio.paComplete)
+            return (out.tobytes(), pyaudio.paContinue)
+
+        with audio.open_duplex(rate, callback, frames_per_buffer=256):
+            if not done.wait(total / rate + 2.0):
+                raise AudioError("Duplexströmmen levererade inget ljud")
+
+        delay = find_delay(recorded, chirp)
+        if delay is None or delay < start:
+            logging.warning(f"Svepet hördes inte i mätning {attempt + 1}")
+            continue
+        delays.append((delay - start) / rate)
+        time.sleep(0.2)
+
+    return float(np.median(delays)) if delays else None
+
+def _cpu_load(stop: threading.Event) -> None:
+    """Belasta en kärna med FFT:er tills stop sätts (numpy släpper GIL)."""
+    data = np.random.default_rng(0).standard_normal(1 << 16)
+    while not stop.is_set():
+        np.fft.irfft(np.fft.rfft(data))
+
+def measure_buffers(audio: AudioIO, candidates: Sequence[int] = BUFFER_CANDIDATES,
+                    seconds: float = 2.0, load_threads: int = 2) -> Dict[int, Optional[int]]:
+    """
+    Räkna överskridningar för varje buffertstorlek under CPU-last.
+
+    Args:
+        audio: Öppnad AudioIO
+        candidates: Buffertstorlekar i måltaktens samples
+        seconds: Mättid per storlek
+        load_threads: Antal trådar som belastar CPU:n under mätningen
+
+    Returns:
+        Dict buffertstorlek -> antal överskridningar (None = strömmen
+        gick inte att öppna eller levererade inget ljud)
+    """
+    results: Dict[int, Optional[int]] = {}
+    saved = audio.input_buffer_frames
+    stop = threading.Event()
+    workers = [threading.Thread(target=_cpu_load, args=(stop,), name="calibration-load", daemon=True)
+               for _ in range(load_threads)]
+    for worker in workers:
+        worker.start()
+    frame = np.empty(READ_FRAME, dtype=np.int16)
+    try:
+        for size in candidates:
+            audio.input_buffer_frames = size
+            try:
+                with audio.open_capture(READ_FRAME) as stream:
+                    stream.discard()
+                    for _ in range(int(seconds * audio.sample_rate) // READ_FRAME):
+                        stream.readinto(frame)
+                    results[size] = stream.input_overflows + stream.buffer.overruns
+            except (AudioError, IOError, OSError) as e:
+                logging.warning(f"Buffert {size}: {e}")
+                results[size] = None
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+        audio.input_buffer_frames = saved
+    return results
+
+def measure_stabilize(audio: AudioIO, seconds: float = 1.0, tolerance_db: float = 6.0) -> float:
+    """
+    Mät hur länge en nyöppnad inspelningsström behöver för att stabiliseras.
+
+    Tiden är den längsta av tiden till första ljudet och tiden tills
+    nivån per ram håller sig inom tolerance_db från den stabila nivån
+    (medianen av den sista fjärdedelen), så att knäppar och
+    insvängning vid öppning räknas med.
+
+    Returns:
+        Sekunder från öppning till stabilt ljud
+    """
+    frame = audio.sample_rate * 10 // 1000
+    recording = np.empty(int(seconds * audio.sample_rate), dtype=np.int16)
+    opened = time.perf_counter()
+    with audio.open_capture(frame) as stream:
+        stream.readinto(recording[:frame])
+        first_audio = time.perf_counter() - opened
+        stream.readinto(recording[frame:])
+
+    levels = frame_levels(recording, frame)
+    settled_level = float(np.median(levels[-max(1, len(levels) // 4):]))
+    unstable = np.nonzero(np.abs(levels - settled_level) > tolerance_db)[0]
+    # Sista avvikande ram i första halvan; senare avvikelser är rummets ljud
+    unstable = unstable[unstable < len(levels) // 2]
+    settle = (int(unstable[-1]) + 1) * frame / audio.sample_rate if len(unstable) else 0.0
+    return max(first_audio, settle)
+
+def measure_noise_floor(audio: AudioIO, seconds: float = 3.0) -> Dict[str, float]:
+    """
+    Mät rummets brusnivå med 32 ms ramar, samma som aktivitetsgrinden.
+
+    Returns:
+        Dict med "floor_dbfs" (20:e percentilen) och "spread_db" (90:e
+        minus 20:e percentilen, hur mycket bakgrunden varierar)
+    """
+    frame = audio.sample_rate * 32 // 1000
+    recording = np.empty(int(seconds * audio.sample_rate), dtype=np.int16)
+    with audio.open_capture(frame) as stream:
+        stream.discard()
+        stream.readinto(recording)
+    levels = frame_levels(recording, frame)
+    floor, high = np.percentile(levels, [20, 90])
+    return {"floor_dbfs": float(floor), "spread_db": float(high - floor)}
+
+def recommend(round_trip: Optional[float], buffers: Dict[int, Optional[int]],
+              stabilize: Optional[float], noise: Optional[Dict[str, float]]) -> Dict[str, str]:
+    """
+    Översätt mätningarna till .env-värden.
+
+    Mätningar som saknas (None) eller misslyckades ger inget värde, så
+    att den befintliga inställningen behålls.
+
+    Returns:
+        Dict variabelnamn -> värde som text
+    """
+    values: Dict[str, str] = {}
+    if round_trip is not None:
+        # Utgångens buffert ska ha spelats ut och ekot klingat av
+        values["AUDIO_FEEDBACK_DELAY"] = f"{min(0.5, max(0.05, round_trip + 0.05)):.2f}"
+    if stabilize is not None:
+        values["AUDIO_STREAM_STABILIZE_DELAY"] = f"{min(0.3, max(0.02, stabilize)):.2f}"
+    clean = sorted(size for size, overflows in buffers.items() if overflows == 0)
+    if clean:
+        values["AUDIO_INPUT_BUFFER"] = str(clean[0])
+    if noise is not None:
+        values["AUDIO_NOISE_FLOOR_DBFS"] = f"{noise['floor_dbfs']:.1f}"
+        # Bakgrundens variation ska inte räcka för att öppna grinden
+        values["WAKEWORD_GATE_THRESHOLD_DB"] = f"{min(15.0, max(6.0, noise['spread_db'] + 6.0)):.0f}"
+    return values
+
+def calibrate(audio: AudioIO, report=print) -> Dict[str, str]:
+    """
+    Kör alla mätningar och returnera rekommenderade .env-värden.
+
+    Args:
+        audio: Öppnad AudioIO med de enheter som ska kalibreras
+        report: Funktion som tar emot förloppstext
+
+    Returns:
+        Dict variabelnamn -> värde som text
+    """
+    report("Mäter brusgolv (var tyst i 3 sekunder)...")
+    noise = None
+    try:
+        noise = measure_noise_floor(audio)
+        report(f"  Brusgolv {noise['floor_dbfs']:.1f} dBFS, variation {noise['spread_db']:.1f} dB")
+    except (AudioError, IOError, OSError) as e:
+        report(f"  Misslyckades: {e}")
+
+    report("Mäter stabiliseringstid för inspelningsström...")
+    stabilize = None
+    try:
+        stabilize = float(np.median([measure_stabilize(audio) for _ in range(3)]))
+        report(f"  {stabilize * 1000:.0f} ms")
+    except (AudioError, IOError, OSError) as e:
+        report(f"  Misslyckades: {e}")
+
+    report("Mäter fördröjning högtalare → mikrofon (ett kort svep spelas upp)...")
+    round_trip = None
+    try:
+        round_trip = measure_round_trip(audio)
+        report(f"  {round_trip * 1000:.0f} ms" if round_trip is not None
+               else "  Svepet hördes inte; höj volymen eller flytta mikrofonen")
+    except (AudioError, IOError, OSError) as e:
+        report(f"  Misslyckades: {e}")
+
+    report("Provar buffertstorlekar under CPU-last...")
+    buffers = measure_buffers(audio)
+    for size, overflows in buffers.items():
+        report(f"  {size:>5} samples: " + ("gick inte att öppna" if overflows is None
+                                           else f"{overflows} överskridningar"))
+
+    return recommend(round_trip, buffers, stabilize, noise)
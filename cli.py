@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Kommandorad för röstassistenten.
+
+Tunga bibliotek (numpy, PyAudio, Vosk, Porcupine, Piper/ONNX Runtime)
+importeras först i det underkommando som behöver dem, så att t.ex.
+check och devices startar direkt. Med --import-times redovisas hur lång
+tid varje import tog.
+
+Användning:
+    python cli.py run                  Starta assistenten
+    python cli.py check                Kontrollera konfiguration och filer
+    python cli.py devices              Lista ljudenheter
+    python cli.py bench dsp|capture|mqtt  Prestandatester (argument skickas vidare)
+    python cli.py soak [--hours 4]     Långtidstest med simulerat ljud och broker
+    python cli.py say "text" [--out fil.wav]
+    python cli.py transcribe fil.wav [--dsp] [--json]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import importlib
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import config
+from log_utils import configure_logging
+
+_import_times: Dict[str, float] = {}
+_import_lock = threading.Lock()
+
+def timed_import(name: str):
+    """Importera en modul och spara hur lång tid den första importen tog."""
+    already = name in sys.modules
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    if not already:
+        with _import_lock:
+            _import_times.setdefault(name, time.perf_counter() - start)
+    return module
+
+def _report_imports() -> None:
+    """Skriv ut importtiderna, längst först."""
+    if not _import_times:
+        print("Inga tunga importer gjordes")
+        return
+    print(f"\n{'Modul':<24}{'import':>10}")
+    for name, seconds in sorted(_import_times.items(), key=lambda item: -item[1]):
+        print(f"{name:<24}{seconds * 1000:>8.0f}ms")
+
+def _preload(names: List[str]) -> None:
+    """Importera moduler i förväg (bakgrundstråd); fel visas när modulen används."""
+    for name in names:
+        try:
+            timed_import(name)
+        except Exception as e:
+            logging.debug(f"Förladdning av {name} misslyckades: {e}")
+
+def cmd_run(args: argparse.Namespace) -> int:
+    """Starta röstassistenten."""
+    # Biblioteken importeras i bakgrunden medan main.py och konfigurationen
+    # laddas; modellerna i processen behövs bara i trådat läge
+    heavy = ["numpy", "pyaudio", "soundfile", "paho.mqtt.client"]
+    if config.PIPELINE_MODE != "multiprocess":
+        heavy += ["pvporcupine", "vosk", "onnxruntime", "piper"]
+    threading.Thread(target=_preload, args=(heavy,), name="preload", daemon=True).start()
+
+    timed_import("main").main()
+    return 0
+
+def _check(name: str, test: Callable[[], str]) -> bool:
+    """Kör en kontroll och skriv ut resultatet."""
+    try:
+        detail = test()
+        print(f"✓ {name}: {detail}")
+        return True
+    except Exception as e:
+        print(f"✗ {name}: {e}")
+        return False
+
+def _require(value, message: str) -> str:
+    """Returnera value som text, eller fallera med message om det saknas."""
+    if not value:
+        raise ValueError(message)
+    return str(value)
+
+def _existing_dir(path: str) -> str:
+    """Kontrollera att en katalog finns."""
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"katalogen saknas: {path}")
+    return path
+
+def cmd_check(args: argparse.Namespace) -> int:
+    """Kontrollera konfiguration och modellfiler utan att ladda modellerna."""
+    from models import load_wakewords, find_piper_model
+
+    def wakewords() -> str:
+        registry = load_wakewords()
+        registry.validate()
+        return registry.describe()
+
+    def piper() -> str:
+        model = find_piper_model(config.PIPER_MODEL_PATH)
+        if not os.path.isfile(f"{model}.json"):
+            raise FileNotFoundError(f"konfigurationen saknas: {model}.json")
+        return model
+
+    def intents() -> str:
+        if not config.INTENTS_PATH:
+            return "av"
+        from intents import IntentTable
+        return f"{len(IntentTable.load(config.INTENTS_PATH).intents)} intents"
+
+    def feedback() -> str:
+        for name in ("start_listen.wav", "end_listen.wav"):
+            path = os.path.join("audio_feedback", name)
+            if not os.path.isfile(path):
+                raise FileNotFoundError(path)
+        return "audio_feedback/"
+
+    def pipeline_mode() -> str:
+        if config.PIPELINE_MODE not in ("threaded", "multiprocess"):
+            raise ValueError(f"ogiltigt värde: {config.PIPELINE_MODE}")
+        return config.PIPELINE_MODE
+
+    checks: List[Tuple[str, Callable[[], str]]] = [
+        ("MQTT", lambda: _require(config.MQTT_HOST and f"{config.MQTT_HOST}:{config.MQTT_PORT}",
+                                  "MQTT_HOST saknas")),
+        ("Porcupine-nyckel", lambda: _require(config.PORCUPINE_ACCESS_KEY and "satt",
+                                              "PORCUPINE_ACCESS_KEY saknas")),
+        ("Wakewords", wakewords),
+        ("Vosk", lambda: _existing_dir(config.VOSK_MODEL_PATH)),
+        ("Vosk (snabb)", lambda: _existing_dir(config.VOSK_FAST_MODEL_PATH)
+            if config.VOSK_FAST_MODEL_PATH else "av"),
+        ("Piper", piper),
+        ("Intents", intents),
+        ("Feedback-ljud", feedback),
+        ("Pipeline", pipeline_mode),
+    ]
+    failed = [name for name, test in checks if not _check(name, test)]
+    if failed:
+        print(f"\n{len(failed)} kontroll(er) misslyckades")
+        return 1
+    print("\nAllt ser bra ut")
+    return 0
+
+def cmd_devices(args: argparse.Namespace) -> int:
+    """Lista ljudenheter och visa vilken ingång konfigurationen väljer."""
+    pyaudio = timed_import("pyaudio")
+
+    pa = pyaudio.PyAudio()
+    try:
+        default_in = default_out = None
+        try:
+            default_in = pa.get_default_input_device_info()["index"]
+            default_out = pa.get_default_output_device_info()["index"]
+        except (IOError, OSError):
+            pass
+        print(f"{'#':>3}  {'Namn':<44}{'in':>4}{'ut':>4}{'Hz':>8}")
+        for index in range(pa.get_device_count()):
+            info = pa.get_device_info_by_index(index)
+            marks = "".join(("*" if index == default_in else "", "+" if index == default_out else ""))
+            print(f"{index:>3}{marks:<2}{str(info['name'])[:44]:<44}{info['maxInputChannels']:>4}"
+                  f"{info['maxOutputChannels']:>4}{int(info['defaultSampleRate']):>8}")
+        print("\n* = standardingång, + = standardutgång")
+
+        if config.INPUT_DEVICE_NAME:
+            from audio_utils import find_input_device
+            index = find_input_device(pa, config.INPUT_DEVICE_NAME)
+            print(f"INPUT_DEVICE_NAME '{config.INPUT_DEVICE_NAME}' -> "
+                  f"{index if index is not None else 'ingen träff'}")
+        elif config.INPUT_DEVICE_INDEX is not None:
+            print(f"INPUT_DEVICE_INDEX = {config.INPUT_DEVICE_INDEX}")
+    finally:
+        pa.terminate()
+    return 0
+
+def cmd_bench(args: argparse.Namespace) -> int:
+    """Kör ett av prestandatesten med resterande argument."""
+    timed_import(f"bench_{args.target}").main(args.rest)
+    return 0
+
+def cmd_soak(args: argparse.Namespace) -> int:
+    """Kör långtidstestet med resterande argument."""
+    return timed_import("soak").main(args.rest)
+
+def cmd_say(args: argparse.Namespace) -> int:
+    """Syntetisera text med Piper och spela upp eller spara den."""
+    timed_import("numpy")
+    timed_import("onnxruntime")
+    timed_import("piper")
+    from models import load_piper_voice, piper_options_from_config
+    from tts_utils import synthesize_pcm
+
+    start = time.perf_counter()
+    voice = load_piper_voice(config.PIPER_MODEL_PATH, **piper_options_from_config())
+    loaded = time.perf_counter()
+    pcm, sample_rate = synthesize_pcm(voice, args.text, config.PIPER_SPEAKER)
+    done = time.perf_counter()
+    print(f"Laddning {(loaded - start) * 1000:.0f} ms, syntes {(done - loaded) * 1000:.0f} ms "
+          f"för {len(pcm) / sample_rate:.1f} s tal")
+
+    if args.out:
+        timed_import("soundfile").write(args.out, pcm, sample_rate)
+        print(f"Sparat: {args.out}")
+        return 0
+
+    from audio_utils import AudioIO
+    with AudioIO(sample_rate=config.SAMPLE_RATE,
+                 output_device_index=config.OUTPUT_DEVICE_INDEX,
+                 output_rate=config.OUTPUT_SAMPLE_RATE) as audio:
+        return 0 if audio.play_pcm(pcm, sample_rate=sample_rate) else 1
+
+def cmd_transcribe(args: argparse.Namespace) -> int:
+    """Transkribera en ljudfil med Vosk."""
+    np = timed_import("numpy")
+    sf = timed_import("soundfile")
+    timed_import("vosk")
+    from audio_utils import resample
+    from models import create_speech_recognizer, create_capture_dsp
+
+    audio, sample_rate = sf.read(args.file, dtype="int16")
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1).astype(np.int16)
+    audio = resample(audio, sample_rate, config.SAMPLE_RATE)
+    if args.dsp:
+        dsp = create_capture_dsp()
+        if dsp is not None:
+            audio = dsp.process(audio)
+
+    start = time.perf_counter()
+    recognizer = create_speech_recognizer()
+    loaded = time.perf_counter()
+    result = recognizer.transcribe(audio)
+    done = time.perf_counter()
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print(result.get("text", ""))
+    print(f"Laddning {(loaded - start) * 1000:.0f} ms, avkodning {(done - loaded) * 1000:.0f} ms "
+          f"för {len(audio) / config.SAMPLE_RATE:.1f} s ljud ({result.get('tier', 'full')})",
+          file=sys.stderr)
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    """Bygg argumenttolken med alla underkommandon."""
+    parser = argparse.ArgumentParser(description="RPI-N8N Voice Assistant")
+    parser.add_argument("--import-times", action="store_true",
+                        help="Visa hur lång tid de tunga importerna tog")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("run", help="Starta assistenten").set_defaults(func=cmd_run)
+    commands.add_parser("check", help="Kontrollera konfiguration och filer").set_defaults(func=cmd_check)
+    commands.add_parser("devices", help="Lista ljudenheter").set_defaults(func=cmd_devices)
+
+    bench = commands.add_parser("bench", help="Prestandatester")
+    bench.add_argument("target", choices=("dsp", "capture", "mqtt"))
+    bench.add_argument("rest", nargs=argparse.REMAINDER, help="Argument till testet")
+    bench.set_defaults(func=cmd_bench)
+
+    soak = commands.add_parser("soak", help="Långtidstest för minnes- och latensdrift")
+    soak.add_argument("rest", nargs=argparse.REMAINDER, help="Argument till soak.py")
+    soak.set_defaults(func=cmd_soak)
+
+    say = commands.add_parser("say", help="Läs upp text med Piper")
+    say.add_argument("text")
+    say.add_argument("--out", help="Spara som WAV i stället för att spela upp")
+    say.set_defaults(func=cmd_say)
+
+    transcribe = commands.add_parser("transcribe", help="Transkribera en ljudfil med Vosk")
+    transcribe.add_argument("file")
+    transcribe.add_argument("--dsp", action="store_true", help="Kör ljudförbehandlingen först")
+    transcribe.add_argument("--json", action="store_true", help="Skriv hela Vosk-resultatet")
+    transcribe.set_defaults(func=cmd_transcribe)
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Tolka argumenten och kör underkommandot."""
+    args = build_parser().parse_args(argv)
+    configure_logging()
+    try:
+        return args.func(args)
+    finally:
+        if args.import_times:
+            _report_imports()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,63 +3,212 @@ Grundkonfiguration för rpi-n8n-voice-assistant.
 Stödjer både .env-filer och miljövariabler för bättre säkerhet.
 """
 import os
+from typing import Any, Dict, Mapping, Optional
+
 from dotenv import load_dotenv
 
 # Ladda .env-fil om den finns
 load_dotenv()
 
-def get_env_bool(key: str, default: bool = False) -> bool:
+def get_env_bool(key: str, default: bool = False, environ: Optional[Mapping[str, str]] = None) -> bool:
     """Konvertera strängvärde från miljövariabel till boolean."""
-    val = os.getenv(key, str(default))
+    val = (os.environ if environ is None else environ).get(key, str(default))
     return val.lower() in ('true', '1', 'yes', 'on')
 
-def get_env_int(key: str, default: int) -> int:
+def get_env_int(key: str, default: int, environ: Optional[Mapping[str, str]] = None) -> int:
     """Hämta integer från miljövariabel med fallback till default."""
     try:
-        return int(os.getenv(key, default))
+        return int((os.environ if environ is None else environ).get(key, default))
     except (ValueError, TypeError):
         return default
 
-# MQTT Configuration
-# Using HiveMQ Cloud - no local MQTT broker needed
-# Get credentials from https://console.hivemq.cloud/
-MQTT_HOST = os.getenv("MQTT_HOST", "")  # No default - must be configured
-MQTT_PORT = get_env_int("MQTT_PORT", 8883)  # HiveMQ Cloud TLS port
-MQTT_USERNAME = os.getenv("MQTT_USERNAME", "")
-MQTT_PASSWORD = os.getenv("MQTT_PASSWORD", "")
-MQTT_TLS = get_env_bool("MQTT_TLS", True)  # HiveMQ Cloud requires TLS
-
-MQTT_TOPIC_COMMANDS = os.getenv("MQTT_TOPIC_COMMANDS", "rpi/commands/text")
-MQTT_TOPIC_RESPONSES = os.getenv("MQTT_TOPIC_RESPONSES", "rpi/responses/text")
-CLIENT_ID = os.getenv("CLIENT_ID", "rpi-n8n-voice-assistant")
-
-# Picovoice Porcupine (wakeword)
-PORCUPINE_ACCESS_KEY = os.getenv("PORCUPINE_ACCESS_KEY", "")
-WAKEWORD_PATH = os.getenv("WAKEWORD_PATH", "models/wakewords/sv/assistans.ppn")
-
-# Vosk (STT)
-VOSK_MODEL_PATH = os.getenv("VOSK_MODEL_PATH", "models/vosk-model-sv")
-
-# Piper (TTS)
-PIPER_MODEL_PATH = os.getenv("PIPER_MODEL_PATH", "models/piper-sv")
-_speaker = os.getenv("PIPER_SPEAKER", "")
-PIPER_SPEAKER = None if _speaker == "" else _speaker
-
-# Ljud
-_input_dev = os.getenv("INPUT_DEVICE_INDEX", "")
-_output_dev = os.getenv("OUTPUT_DEVICE_INDEX", "")
-INPUT_DEVICE_INDEX = None if _input_dev == "" else int(_input_dev)
-OUTPUT_DEVICE_INDEX = None if _output_dev == "" else int(_output_dev)
-
-SAMPLE_RATE = get_env_int("SAMPLE_RATE", 16000)
-RECORD_SECONDS_AFTER_WAKE = get_env_int("RECORD_SECONDS_AFTER_WAKE", 6)
-LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
-
-# Audio delays for better recognition (in seconds)
-AUDIO_FEEDBACK_DELAY = float(os.getenv("AUDIO_FEEDBACK_DELAY", "0.3"))  # Delay after feedback sound
-AUDIO_STREAM_STABILIZE_DELAY = float(os.getenv("AUDIO_STREAM_STABILIZE_DELAY", "0.1"))  # Delay after opening stream
-
-# Timeout och säkerhet
-MQTT_CONNECT_TIMEOUT = get_env_int("MQTT_CONNECT_TIMEOUT", 10)
-MQTT_MAX_RETRIES = get_env_int("MQTT_MAX_RETRIES", 5)
-MAX_TEXT_LENGTH = get_env_int("MAX_TEXT_LENGTH", 1000)  # Begränsa input-längd
+def load(environ: Mapping[str, str]) -> Dict[str, Any]:
+    """
+    Beräkna alla inställningar från en uppsättning miljövariabler.
+
+    Modulens egna värden kommer från os.environ (efter .env); hot_reload
+    anropar funktionen med en kopia av miljön för att läsa om .env utan
+    att ändra något förrän de nya värdena valideras och byts in.
+
+    Args:
+        environ: Miljövariabler
+
+    Returns:
+        Dict namn -> värde för alla inställningar (namn med versaler)
+    """
+    # MQTT Configuration
+    # Using HiveMQ Cloud - no local MQTT broker needed
+    # Get credentials from https://console.hivemq.cloud/
+    MQTT_HOST = environ.get("MQTT_HOST", "")  # No default - must be configured
+    MQTT_PORT = get_env_int("MQTT_PORT", 8883, environ)  # HiveMQ Cloud TLS port
+    MQTT_USERNAME = environ.get("MQTT_USERNAME", "")
+    MQTT_PASSWORD = environ.get("MQTT_PASSWORD", "")
+    MQTT_TLS = get_env_bool("MQTT_TLS", True, environ)  # HiveMQ Cloud requires TLS
+
+    MQTT_TOPIC_COMMANDS = environ.get("MQTT_TOPIC_COMMANDS", "rpi/commands/text")
+    MQTT_TOPIC_RESPONSES = environ.get("MQTT_TOPIC_RESPONSES", "rpi/responses/text")
+    # Styrmeddelanden till assistenten (t.ex. {"command": "reload"}) och dess statushändelser
+    MQTT_TOPIC_CONTROL = environ.get("MQTT_TOPIC_CONTROL", "rpi/control")
+    MQTT_TOPIC_STATUS = environ.get("MQTT_TOPIC_STATUS", "rpi/status")
+    CLIENT_ID = environ.get("CLIENT_ID", "rpi-n8n-voice-assistant")
+
+    # Picovoice Porcupine (wakeword)
+    PORCUPINE_ACCESS_KEY = environ.get("PORCUPINE_ACCESS_KEY", "")
+    WAKEWORD_PATH = environ.get("WAKEWORD_PATH", "models/wakewords/sv/assistans.ppn")
+    WAKEWORD_SENSITIVITY = float(environ.get("WAKEWORD_SENSITIVITY", "0.6"))
+    # Flera wakewords med egen känslighet och routing (tom = bara WAKEWORD_PATH).
+    # Se wakewords.example.json för format.
+    WAKEWORDS_PATH = environ.get("WAKEWORDS_PATH", "")
+    WAKEWORD_PHRASE = environ.get("WAKEWORD_PHRASE", "")  # Det som sägs (tom = filnamnet)
+
+    # Vosk (STT)
+    VOSK_MODEL_PATH = environ.get("VOSK_MODEL_PATH", "models/vosk-model-sv")
+    # Tvånivå-STT: liten modell först, VOSK_MODEL_PATH bara vid låg konfidens (tom = av)
+    VOSK_FAST_MODEL_PATH = environ.get("VOSK_FAST_MODEL_PATH", "")
+    STT_CONFIDENCE_THRESHOLD = float(environ.get("STT_CONFIDENCE_THRESHOLD", "0.8"))
+
+    # Piper (TTS)
+    PIPER_MODEL_PATH = environ.get("PIPER_MODEL_PATH", "models/piper-sv")
+    _speaker = environ.get("PIPER_SPEAKER", "")
+    PIPER_SPEAKER = None if _speaker == "" else _speaker
+
+    # Ljud
+    _input_dev = environ.get("INPUT_DEVICE_INDEX", "")
+    _output_dev = environ.get("OUTPUT_DEVICE_INDEX", "")
+    INPUT_DEVICE_INDEX = None if _input_dev == "" else int(_input_dev)
+    OUTPUT_DEVICE_INDEX = None if _output_dev == "" else int(_output_dev)
+    # Ingångsenhet efter namn (del av namnet); har företräde framför index och
+    # överlever att USB-enheter byter index när de kopplas in igen
+    INPUT_DEVICE_NAME = environ.get("INPUT_DEVICE_NAME", "").strip()
+    # Watchdog: sekunder utan ljud respektive antal läsfel i följd innan
+    # ljudenheten återställs, och längsta väntetid mellan återställningsförsök
+    AUDIO_STALL_TIMEOUT = float(environ.get("AUDIO_STALL_TIMEOUT", "3"))
+    AUDIO_MAX_ERRORS = get_env_int("AUDIO_MAX_ERRORS", 5, environ)
+    AUDIO_RECOVERY_MAX_BACKOFF = float(environ.get("AUDIO_RECOVERY_MAX_BACKOFF", "30"))
+
+    SAMPLE_RATE = get_env_int("SAMPLE_RATE", 16000, environ)
+    # Enheternas hårdvarutakt (tom = autodetektera); ljudet omsamplas i mjukvara
+    _input_rate = environ.get("INPUT_SAMPLE_RATE", "")
+    _output_rate = environ.get("OUTPUT_SAMPLE_RATE", "")
+    INPUT_SAMPLE_RATE = None if _input_rate == "" else int(_input_rate)
+    OUTPUT_SAMPLE_RATE = None if _output_rate == "" else int(_output_rate)
+    # Mikrofonarray: fler än 1 kanal formas till mono med beamforming
+    INPUT_CHANNELS = get_env_int("INPUT_CHANNELS", 1, environ)
+    MIC_ARRAY_APERTURE_M = float(environ.get("MIC_ARRAY_APERTURE_M", "0.1"))  # Största mikrofonavstånd
+    RECORD_SECONDS_AFTER_WAKE = get_env_int("RECORD_SECONDS_AFTER_WAKE", 6, environ)
+    LOG_LEVEL = environ.get("LOG_LEVEL", "INFO")
+    # Loggning går via en begränsad kö till en egen utskriftstråd
+    LOG_FORMAT = environ.get("LOG_FORMAT", "text").strip().lower()  # text eller json
+    LOG_QUEUE_SIZE = get_env_int("LOG_QUEUE_SIZE", 1000, environ)
+    # Högst BURST poster per INTERVAL sekunder från samma kodrad (0 = ingen gräns)
+    LOG_RATE_LIMIT_BURST = get_env_int("LOG_RATE_LIMIT_BURST", 5, environ)
+    LOG_RATE_LIMIT_INTERVAL = float(environ.get("LOG_RATE_LIMIT_INTERVAL", "10"))
+
+    # Audio delays for better recognition (in seconds)
+    AUDIO_FEEDBACK_DELAY = float(environ.get("AUDIO_FEEDBACK_DELAY", "0.3"))  # Delay after feedback sound
+    AUDIO_STREAM_STABILIZE_DELAY = float(environ.get("AUDIO_STREAM_STABILIZE_DELAY", "0.1"))  # Delay after opening stream
+    # Inställt av setup_wizard.py --calibrate
+    AUDIO_INPUT_BUFFER = get_env_int("AUDIO_INPUT_BUFFER", 0, environ)  # PortAudio-buffert i samples, 0 = läsblocket
+    _noise_floor = environ.get("AUDIO_NOISE_FLOOR_DBFS", "")
+    AUDIO_NOISE_FLOOR_DBFS = None if _noise_floor == "" else float(_noise_floor)  # Uppmätt brusgolv
+
+    # Pipeline: "threaded" (allt i en process) eller "multiprocess"
+    # (capture/wakeword, STT och TTS i egna processer med delade ljudringar)
+    PIPELINE_MODE = environ.get("PIPELINE_MODE", "threaded").lower()
+    PIPELINE_CAPTURE_RING_SECONDS = get_env_int("PIPELINE_CAPTURE_RING_SECONDS", 30, environ)
+    PIPELINE_TTS_RING_SECONDS = get_env_int("PIPELINE_TTS_RING_SECONDS", 30, environ)
+
+    # CPU-layout (Linux). CPU-listor i taskset-format, t.ex. "0" eller "1-3"; tom = alla kärnor
+    WAKEWORD_CPUS = environ.get("WAKEWORD_CPUS", "")
+    STT_CPUS = environ.get("STT_CPUS", "")
+    TTS_CPUS = environ.get("TTS_CPUS", "")
+    WAKEWORD_RT_PRIORITY = get_env_int("WAKEWORD_RT_PRIORITY", 0, environ)  # 1-99 = SCHED_FIFO, 0 = av
+    _wakeword_nice = environ.get("WAKEWORD_NICE", "")
+    WAKEWORD_NICE = None if _wakeword_nice == "" else int(_wakeword_nice)
+    ORT_INTRA_OP_THREADS = get_env_int("ORT_INTRA_OP_THREADS", 0, environ)  # 0 = ONNX Runtime standard
+
+    # ONNX Runtime-session för Piper
+    ORT_INTER_OP_THREADS = get_env_int("ORT_INTER_OP_THREADS", 0, environ)
+    ORT_GRAPH_OPTIMIZATION = environ.get("ORT_GRAPH_OPTIMIZATION", "all").lower()  # disabled/basic/extended/all
+    ORT_ENABLE_CPU_MEM_ARENA = get_env_bool("ORT_ENABLE_CPU_MEM_ARENA", True, environ)
+    ORT_ENABLE_MEM_PATTERN = get_env_bool("ORT_ENABLE_MEM_PATTERN", True, environ)
+    PIPER_CACHE_DIR = environ.get("PIPER_CACHE_DIR", "models/.piper-cache")  # tom = ingen cache
+    PIPER_WARMUP = get_env_bool("PIPER_WARMUP", True, environ)  # Kör en kort syntes vid start
+
+    # Aktivitetsgrind framför Porcupine: wakeword-detektorn körs bara vid ljud
+    WAKEWORD_GATE = get_env_bool("WAKEWORD_GATE", True, environ)
+    WAKEWORD_GATE_THRESHOLD_DB = float(environ.get("WAKEWORD_GATE_THRESHOLD_DB", "9"))  # Över brusgolvet
+    WAKEWORD_GATE_LOOKBACK_MS = get_env_int("WAKEWORD_GATE_LOOKBACK_MS", 400, environ)
+    WAKEWORD_GATE_HANGOVER_MS = get_env_int("WAKEWORD_GATE_HANGOVER_MS", 1000, environ)
+    WAKEWORD_STATS_INTERVAL = get_env_int("WAKEWORD_STATS_INTERVAL", 60, environ)  # Sekunder mellan CPU-/grindstatistik
+
+    # Andra stegets kontroll av wakeword-träffar (energi + Vosk-grammatik med bara ordet)
+    WAKEWORD_VERIFY = get_env_bool("WAKEWORD_VERIFY", False, environ)
+    WAKEWORD_VERIFY_SECONDS = float(environ.get("WAKEWORD_VERIFY_SECONDS", "1.5"))  # Ljud före träffen
+    WAKEWORD_VERIFY_MIN_CONFIDENCE = float(environ.get("WAKEWORD_VERIFY_MIN_CONFIDENCE", "0.5"))
+    WAKEWORD_VERIFY_MARGIN_DB = float(environ.get("WAKEWORD_VERIFY_MARGIN_DB", "10"))  # Topp över brusgolvet
+    WAKEWORD_VERIFY_MIN_ACTIVE_MS = float(environ.get("WAKEWORD_VERIFY_MIN_ACTIVE_MS", "150"))
+
+    # Följdfrågor: när n8n svarar med expect_reply lyssnar assistenten efter
+    # svar utan wakeword (0 = av)
+    FOLLOWUP_TIMEOUT = float(environ.get("FOLLOWUP_TIMEOUT", "5"))  # Sekunder att vänta på tal
+    FOLLOWUP_SILENCE_MS = get_env_int("FOLLOWUP_SILENCE_MS", 700, environ)  # Tystnad som avslutar yttrandet
+
+    # Förbehandling av inspelat ljud före STT (per steg)
+    # Alla steg är av som standard (förslag: högpass 80 Hz och AGC)
+    DSP_HIGHPASS_HZ = float(environ.get("DSP_HIGHPASS_HZ", "0"))  # 0 = av
+    DSP_AGC = get_env_bool("DSP_AGC", False, environ)
+    DSP_AGC_TARGET_DBFS = float(environ.get("DSP_AGC_TARGET_DBFS", "-20"))
+    DSP_AGC_MAX_GAIN_DB = float(environ.get("DSP_AGC_MAX_GAIN_DB", "24"))
+    DSP_NOISE_SUPPRESSION = get_env_bool("DSP_NOISE_SUPPRESSION", False, environ)
+    DSP_NOISE_FLOOR_DB = float(environ.get("DSP_NOISE_FLOOR_DB", "-15"))
+
+    # Lokala intents (tom = av). Se intents.example.json för format.
+    INTENTS_PATH = environ.get("INTENTS_PATH", "")
+    INTENT_MIN_CONFIDENCE = float(environ.get("INTENT_MIN_CONFIDENCE", "0.6"))
+    VOLUME_STEP = float(environ.get("VOLUME_STEP", "0.25"))
+    TTS_CACHE_SIZE = get_env_int("TTS_CACHE_SIZE", 32, environ)  # Antal cachade svar för lokala intents
+
+    # Meningsparallell syntes av långa svar (1 = av)
+    TTS_PARALLEL_WORKERS = get_env_int("TTS_PARALLEL_WORKERS", 1, environ)
+    TTS_PARALLEL_MODE = environ.get("TTS_PARALLEL_MODE", "thread").lower()  # thread/process
+    TTS_CROSSFADE_MS = float(environ.get("TTS_CROSSFADE_MS", "10"))
+
+    # Intervall för loggning av mätvärden i sekunder (0 = av)
+    METRICS_LOG_INTERVAL = get_env_int("METRICS_LOG_INTERVAL", 300, environ)
+
+    # Adaptiv kvalitet: snabbare STT/TTS när CPU:n är hårt belastad
+    GOVERNOR_ENABLED = get_env_bool("GOVERNOR_ENABLED", False, environ)
+    GOVERNOR_STT_RTF = float(environ.get("GOVERNOR_STT_RTF", "0.5"))  # Mål: avkodningstid / ljudlängd
+    GOVERNOR_TTS_RTF = float(environ.get("GOVERNOR_TTS_RTF", "0.6"))  # Mål: syntestid / ljudlängd
+    GOVERNOR_LOAD_HIGH = float(environ.get("GOVERNOR_LOAD_HIGH", "40"))  # CPU-tryck i % som sänker kvaliteten
+    GOVERNOR_LOAD_LOW = float(environ.get("GOVERNOR_LOAD_LOW", "15"))  # Under detta får kvaliteten höjas
+    GOVERNOR_INTERVAL = float(environ.get("GOVERNOR_INTERVAL", "2"))
+    GOVERNOR_HOLD = float(environ.get("GOVERNOR_HOLD", "30"))  # Sekunder av lugn före varje höjning
+    GOVERNOR_LENGTH_SCALE = float(environ.get("GOVERNOR_LENGTH_SCALE", "0.85"))
+    GOVERNOR_PIPER_MODEL_PATH = environ.get("GOVERNOR_PIPER_MODEL_PATH", "")  # Snabb röst (tom = ingen)
+
+    # Profilering på begäran (styrkommandot "profile" eller SIGUSR1)
+    PROFILE_SECONDS = float(environ.get("PROFILE_SECONDS", "30"))
+    PROFILE_INTERVAL_MS = float(environ.get("PROFILE_INTERVAL_MS", "5"))
+    PROFILE_DIR = environ.get("PROFILE_DIR", "profiles")
+    PROFILE_TRACEMALLOC = get_env_bool("PROFILE_TRACEMALLOC", True, environ)
+    PROFILE_TOP = get_env_int("PROFILE_TOP", 15, environ)
+
+    # Arkivering av inspelade kommandon för utvärdering (av som standard)
+    ARCHIVE_ENABLED = get_env_bool("ARCHIVE_ENABLED", False, environ)
+    ARCHIVE_DIR = environ.get("ARCHIVE_DIR", "archive")
+    ARCHIVE_FORMAT = environ.get("ARCHIVE_FORMAT", "flac").lower()  # flac/opus
+    ARCHIVE_FRACTION = float(environ.get("ARCHIVE_FRACTION", "1.0"))  # Andel av yttrandena som sparas
+    ARCHIVE_QUEUE_SIZE = get_env_int("ARCHIVE_QUEUE_SIZE", 8, environ)
+    ARCHIVE_MAX_MB = float(environ.get("ARCHIVE_MAX_MB", "500"))  # 0 = obegränsat
+    ARCHIVE_MAX_AGE_DAYS = float(environ.get("ARCHIVE_MAX_AGE_DAYS", "30"))  # 0 = obegränsat
+
+    # Timeout och säkerhet
+    MQTT_CONNECT_TIMEOUT = get_env_int("MQTT_CONNECT_TIMEOUT", 10, environ)
+    MQTT_MAX_RETRIES = get_env_int("MQTT_MAX_RETRIES", 5, environ)
+    MAX_TEXT_LENGTH = get_env_int("MAX_TEXT_LENGTH", 1000, environ)  # Begränsa input-längd
+
+    return {name: value for name, value in locals().items() if name.isupper()}
+
+globals().update(load(os.environ))
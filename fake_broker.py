@@ -0,0 +1,320 @@
+"""
+Minimal MQTT 3.1.1-broker för lasttester utan nätverk.
+
+Lyssnar på 127.0.0.1 (ledig port som standard) och hanterar det som
+MqttClient använder: CONNECT, PUBLISH (QoS 0 och 1 in, QoS 0 ut),
+SUBSCRIBE/UNSUBSCRIBE med + och #, PINGREQ och DISCONNECT. Retained
+meddelanden, will och sessioner som överlever en frånkoppling stöds inte.
+
+Testkoden kan publicera direkt från brokern med publish(), bryta alla
+anslutningar med drop_clients() och avvisa kommande anslutningar med
+refuse_connections(), för att provocera fram återanslutningar.
+"""
+import socket
+import struct
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+PUBREC, PUBREL, PUBCOMP = 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """Avgör om topic matchar ett filter med + och #."""
+    filter_parts = topic_filter.split("/")
+    topic_parts = topic.split("/")
+    for i, part in enumerate(filter_parts):
+        if part == "#":
+            return True
+        if i >= len(topic_parts):
+            return False
+        if part != "+" and part != topic_parts[i]:
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+def _encode_length(length: int) -> bytes:
+    """Kodera återstående längd som MQTT-varint."""
+    out = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        out.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(out)
+
+def _packet(packet_type: int, body: bytes, flags: int = 0) -> bytes:
+    """Bygg ett paket med fast huvud."""
+    return bytes((packet_type << 4 | flags,)) + _encode_length(len(body)) + body
+
+def _string(data: bytes, pos: int) -> Tuple[str, int]:
+    """Läs en längdprefixad UTF-8-sträng."""
+    (length,) = struct.unpack_from("!H", data, pos)
+    return data[pos + 2:pos + 2 + length].decode("utf-8"), pos + 2 + length
+
+class _Session:
+    """En ansluten klient."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.client_id = ""
+        self.subscriptions: Dict[str, int] = {}
+        self.send_lock = threading.Lock()
+
+    def send(self, data: bytes) -> None:
+        """Skicka ett paket (trådsäkert)."""
+        with self.send_lock:
+            self.sock.sendall(data)
+
+    def read_packet(self) -> Optional[Tuple[int, int, bytes]]:
+        """
+        Läs nästa paket.
+
+        Returns:
+            (typ, flaggor, innehåll), eller None när anslutningen stängts
+        """
+        header = self._read_exact(1)
+        if header is None:
+            return None
+        length, shift = 0, 0
+        while True:
+            byte = self._read_exact(1)
+            if byte is None:
+                return None
+            length |= (byte[0] & 0x7F) << shift
+            shift += 7
+            if not byte[0] & 0x80:
+                break
+        body = self._read_exact(length) if length else b""
+        if body is None:
+            return None
+        return header[0] >> 4, header[0] & 0x0F, body
+
+    def _read_exact(self, count: int) -> Optional[bytes]:
+        """Läs exakt count byte, eller None vid stängd anslutning."""
+        chunks = []
+        while count:
+            try:
+                chunk = self.sock.recv(count)
+            except OSError:
+                return None
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            count -= len(chunk)
+        return b"".join(chunks)
+
+class FakeBroker:
+    """
+    MQTT-broker i samma process, för tester och lastmätningar.
+
+    Användning:
+        with FakeBroker() as broker:
+            client = MqttClient("127.0.0.1", broker.port)
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            host: Adress att lyssna på
+            port: Port (0 = välj en ledig)
+        """
+        self._server = socket.create_server((host, port))
+        self.host = host
+        self.port = self._server.getsockname()[1]
+        self._lock = threading.Lock()
+        self._sessions: List[_Session] = []
+        self._refuse = 0
+        self._refuse_code = 3
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self.on_publish: Optional[Callable[[str, bytes], None]] = None
+        # Räknare; uppdateras under _lock eftersom varje klient har en egen tråd
+        self.connects = 0
+        self.refused = 0
+        self.received = 0
+        self.delivered = 0
+        self.unrouted = 0
+
+    def __enter__(self):
+        """Starta brokern."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Stoppa brokern."""
+        self.stop()
+
+    def start(self) -> None:
+        """Börja ta emot anslutningar i en bakgrundstråd."""
+        self._running = True
+        self._thread = threading.Thread(target=self._accept_loop, name="fake-broker", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stäng alla anslutningar och sluta lyssna."""
+        self._running = False
+        try:
+            self._server.close()
+        except OSError:
+            pass
+        self.drop_clients()
+
+    def _accept_loop(self) -> None:
+        """Acceptera anslutningar och starta en tråd per klient."""
+        while self._running:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(_Session(sock),),
+                             name="fake-broker-client", daemon=True).start()
+
+    @property
+    def clients(self) -> int:
+        """Antal anslutna klienter."""
+        with self._lock:
+            return len(self._sessions)
+
+    def is_subscribed(self, topic: str) -> bool:
+        """Avgör om någon ansluten klient prenumererar på topic."""
+        with self._lock:
+            return any(topic_matches(f, topic) for s in self._sessions for f in s.subscriptions)
+
+    def drop_clients(self) -> int:
+        """
+        Bryt alla anslutningar utan DISCONNECT, som ett nätverksavbrott.
+
+        Returns:
+            Antal brutna anslutningar
+        """
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            try:
+                session.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            session.sock.close()
+        return len(sessions)
+
+    def refuse_connections(self, count: int, return_code: int = 3) -> None:
+        """
+        Avvisa de nästa count anslutningsförsöken.
+
+        Args:
+            count: Antal försök att avvisa
+            return_code: CONNACK-kod (3 = servern otillgänglig)
+        """
+        with self._lock:
+            self._refuse = count
+            self._refuse_code = return_code
+
+    def publish(self, topic: str, payload: bytes) -> int:
+        """
+        Skicka ett meddelande till alla prenumeranter (QoS 0).
+
+        Returns:
+            Antal klienter som fick meddelandet
+        """
+        with self._lock:
+            targets = [s for s in self._sessions
+                       if any(topic_matches(f, topic) for f in s.subscriptions)]
+            if not targets:
+                self.unrouted += 1
+                return 0
+        topic_bytes = topic.encode("utf-8")
+        packet = _packet(PUBLISH, struct.pack("!H", len(topic_bytes)) + topic_bytes + payload)
+        sent = 0
+        for session in targets:
+            try:
+                session.send(packet)
+                sent += 1
+            except OSError:
+                pass
+        with self._lock:
+            self.delivered += sent
+        return sent
+
+    def _serve(self, session: _Session) -> None:
+        """Hantera en klients paket tills anslutningen stängs."""
+        try:
+            first = session.read_packet()
+            if first is None or first[0] != CONNECT or not self._accept(session, first[2]):
+                return
+            while self._running:
+                packet = session.read_packet()
+                if packet is None or not self._handle(session, *packet):
+                    return
+        except (OSError, ValueError, struct.error, UnicodeDecodeError) as e:
+            logging.debug(f"Fake-broker: klient {session.client_id or '?'} stängd: {e}")
+        finally:
+            with self._lock:
+                if session in self._sessions:
+                    self._sessions.remove(session)
+            session.sock.close()
+
+    def _accept(self, session: _Session, body: bytes) -> bool:
+        """Svara på CONNECT; returnerar False om anslutningen avvisas."""
+        protocol, pos = _string(body, 0)
+        level = body[pos]
+        pos += 4  # nivå, flaggor, keepalive
+        session.client_id, _ = _string(body, pos)
+        with self._lock:
+            refuse = self._refuse > 0
+            if refuse:
+                self._refuse -= 1
+                code = self._refuse_code
+            elif protocol != "MQTT" or level != 4:
+                refuse, code = True, 1  # protokollversionen stöds inte
+            if refuse:
+                self.refused += 1
+        if refuse:
+            session.send(_packet(CONNACK, bytes((0, code))))
+            return False
+        with self._lock:
+            self._sessions.append(session)
+            self.connects += 1
+        session.send(_packet(CONNACK, bytes((0, 0))))
+        return True
+
+    def _handle(self, session: _Session, packet_type: int, flags: int, body: bytes) -> bool:
+        """Hantera ett paket; returnerar False när klienten kopplar från."""
+        if packet_type == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            topic, pos = _string(body, 0)
+            if qos:
+                packet_id = body[pos:pos + 2]
+                pos += 2
+                session.send(_packet(PUBACK if qos == 1 else PUBREC, packet_id))
+            with self._lock:
+                self.received += 1
+            payload = body[pos:]
+            if self.on_publish is not None:
+                self.on_publish(topic, payload)
+            self.publish(topic, payload)
+        elif packet_type == PUBREL:
+            session.send(_packet(PUBCOMP, body[:2]))
+        elif packet_type == SUBSCRIBE:
+            packet_id, pos, granted = body[:2], 2, bytearray()
+            while pos < len(body):
+                topic_filter, pos = _string(body, pos)
+                qos = min(body[pos], 1)
+                pos += 1
+                with self._lock:
+                    session.subscriptions[topic_filter] = qos
+                granted.append(qos)
+            session.send(_packet(SUBACK, packet_id + bytes(granted)))
+        elif packet_type == UNSUBSCRIBE:
+            pos = 2
+            while pos < len(body):
+                topic_filter, pos = _string(body, pos)
+                with self._lock:
+                    session.subscriptions.pop(topic_filter, None)
+            session.send(_packet(UNSUBACK, body[:2]))
+        elif packet_type == PINGREQ:
+            session.send(_packet(PINGRESP, b""))
+        elif packet_type == DISCONNECT:
+            return False
+        return True
@@ -0,0 +1,211 @@
+"""
+Adaptiv kvalitet vid CPU-brist.
+
+På delade kort ökar svarstiden när andra tjänster belastar processorn,
+eftersom samma modeller och synteslägen alltid används. Guvernören följer
+systemets CPU-tryck och realtidsfaktorn (bearbetningstid / ljudets längd)
+för STT och TTS, och sänker kvaliteten stegvis när något ligger över sitt
+mål:
+
+  full:    normala modeller och inställningar
+  reduced: bara den snabba Vosk-modellen (ingen omavkodning med den stora)
+           och kortare length_scale i Piper
+  minimal: dessutom den snabba Piper-rösten, om en sådan är konfigurerad
+
+Kvaliteten höjs ett steg i taget när trycket och realtidsfaktorerna har
+legat klart under gränserna i hold sekunder. Varje övergång loggas,
+räknas i mätvärdena och skickas till on_change.
+
+CPU-trycket läses från /proc/pressure/cpu (andel av tiden som någon tråd
+väntat på CPU, senaste 10 s) och annars från load average per kärna.
+"""
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import metrics
+
+LEVELS = ("full", "reduced", "minimal")
+
+# Realtidsfaktorer äldre än så här räknas inte (ingen interaktion på länge)
+STALE_SECONDS = 300.0
+
+def cpu_pressure() -> Optional[float]:
+    """
+    CPU-tryck i procent enligt PSI ("some avg10").
+
+    Returns:
+        Procent 0–100, eller None om kärnan saknar PSI
+    """
+    try:
+        with open("/proc/pressure/cpu", "r") as f:
+            for line in f:
+                if line.startswith("some"):
+                    for field in line.split():
+                        if field.startswith("avg10="):
+                            return float(field[6:])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def load_percent() -> float:
+    """CPU-tryck i procent: PSI om det finns, annars load average per kärna."""
+    pressure = cpu_pressure()
+    if pressure is not None:
+        return pressure
+    try:
+        return min(100.0, os.getloadavg()[0] / (os.cpu_count() or 1) * 100)
+    except OSError:
+        return 0.0
+
+class QualityGovernor:
+    """
+    Väljer kvalitetsnivå utifrån CPU-tryck och stegens realtidsfaktor.
+
+    Användning:
+        governor = QualityGovernor(on_change=publish)
+        governor.start()
+        governor.observe("stt", elapsed, len(audio) / sample_rate)
+        if governor.level >= 1: ...
+    """
+
+    def __init__(self, stt_rtf: float = 0.5, tts_rtf: float = 0.6, load_high: float = 40.0,
+                 load_low: float = 15.0, interval: float = 2.0, hold: float = 30.0,
+                 max_level: int = len(LEVELS) - 1,
+                 on_change: Optional[Callable[[int, str, str], None]] = None,
+                 load_source: Callable[[], float] = load_percent):
+        """
+        Args:
+            stt_rtf: Mål för STT:s realtidsfaktor
+            tts_rtf: Mål för TTS:s realtidsfaktor
+            load_high: CPU-tryck i procent som sänker kvaliteten
+            load_low: CPU-tryck i procent under vilket kvaliteten får höjas
+            interval: Sekunder mellan kontrollerna
+            hold: Sekunder av lugn innan kvaliteten höjs ett steg
+            max_level: Lägsta tillåtna nivå (index i LEVELS)
+            on_change: Anropas med (nivå, namn, orsak) vid varje övergång
+            load_source: Funktion som returnerar CPU-trycket i procent
+        """
+        self.targets = {"stt": stt_rtf, "tts": tts_rtf}
+        self.load_high = load_high
+        self.load_low = load_low
+        self.interval = interval
+        self.hold = hold
+        self.max_level = min(max_level, len(LEVELS) - 1)
+        self.on_change = on_change
+        self.load_source = load_source
+        self._lock = threading.Lock()
+        self._level = 0
+        self._rtf: Dict[str, Tuple[float, float]] = {}  # steg -> (medel, tidpunkt)
+        self._changed = time.monotonic()
+        self._calm_since: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def level(self) -> int:
+        """Aktuell nivå (index i LEVELS)."""
+        return self._level
+
+    @property
+    def level_name(self) -> str:
+        """Aktuell nivås namn."""
+        return LEVELS[self._level]
+
+    def start(self) -> None:
+        """Starta kontrolltråden."""
+        if self._thread is not None:
+            return
+        metrics.gauge("governor.level", self._level)
+        self._thread = threading.Thread(target=self._run, name="governor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stoppa kontrolltråden."""
+        self._stop.set()
+
+    def observe(self, stage: str, seconds: float, audio_seconds: float) -> None:
+        """
+        Registrera en bearbetning.
+
+        Args:
+            stage: "stt" eller "tts"
+            seconds: Bearbetningstid
+            audio_seconds: Ljudets längd
+        """
+        if audio_seconds <= 0 or stage not in self.targets:
+            return
+        rtf = seconds / audio_seconds
+        metrics.gauge(f"governor.{stage}_rtf", rtf)
+        now = time.monotonic()
+        with self._lock:
+            previous = self._rtf.get(stage)
+            if previous is not None and now - previous[1] < STALE_SECONDS:
+                rtf = 0.5 * previous[0] + 0.5 * rtf
+            self._rtf[stage] = (rtf, now)
+
+    def _run(self) -> None:
+        """Kontrollera trycket tills stop() anropas."""
+        while not self._stop.wait(self.interval):
+            try:
+                self.evaluate()
+            except Exception as e:
+                logging.error(f"Fel i kvalitetsguvernören: {e}")
+
+    def evaluate(self, now: Optional[float] = None) -> Optional[int]:
+        """
+        Jämför trycket mot gränserna och byt nivå vid behov.
+
+        Args:
+            now: Tidpunkt (time.monotonic(); None = nu)
+
+        Returns:
+            Ny nivå om den ändrades, annars None
+        """
+        now = time.monotonic() if now is None else now
+        load = self.load_source()
+        metrics.gauge("governor.cpu_pressure", load)
+        with self._lock:
+            rtfs = {stage: value for stage, (value, t) in self._rtf.items()
+                    if now - t < STALE_SECONDS}
+            over: List[str] = []
+            if load >= self.load_high:
+                over.append(f"CPU-tryck {load:.0f} %")
+            over += [f"{stage.upper()} {rtf:.2f}× realtid" for stage, rtf in rtfs.items()
+                     if rtf > self.targets[stage]]
+            calm = load < self.load_low and all(rtf < self.targets[stage] * 0.7
+                                                for stage, rtf in rtfs.items())
+
+            if over:
+                self._calm_since = None
+                # Sänk snabbt, men låt förra steget hinna verka först
+                if self._level >= self.max_level or now - self._changed < 2 * self.interval:
+                    return None
+                level, reason = self._level + 1, ", ".join(over)
+            elif calm and self._level > 0:
+                if self._calm_since is None:
+                    self._calm_since = now
+                if now - self._calm_since < self.hold or now - self._changed < self.hold:
+                    return None
+                level, reason = self._level - 1, f"CPU-tryck {load:.0f} %"
+            else:
+                self._calm_since = None
+                return None
+
+            self._level = level
+            self._changed = now
+            self._calm_since = None
+            # Mätningarna gjordes på förra nivån
+            self._rtf.clear()
+
+        metrics.gauge("governor.level", level)
+        metrics.incr("governor.transitions")
+        if over:
+            logging.warning(f"↓ Sänker kvaliteten till {LEVELS[level]} ({reason})")
+        else:
+            logging.info(f"↑ Höjer kvaliteten till {LEVELS[level]} ({reason})")
+        if self.on_change is not None:
+            self.on_change(level, LEVELS[level], reason)
+        return level
@@ -0,0 +1,173 @@
+"""
+Omladdning av konfigurationen under drift.
+
+.env läses om och config.load() beräknar de nya värdena från en kopia av
+miljön, så att de hamnar i en separat uppsättning inställningar
+(load_config). Den skickas uttryckligen till validering och laddning av
+komponenterna; varken config eller os.environ ändras förrän apply()
+anropas, vilket görs i ett svep när de nya komponenterna byts in.
+
+Vilka komponenter som måste laddas om avgörs av en signatur per
+komponent: de config-värden den byggs av plus ändringstiden för dess
+filer, så en utbytt modell- eller wakeword-fil upptäcks även om sökvägen
+är densamma. Inställningar som bara kan ändras med omstart behåller sina
+gamla värden.
+"""
+import os
+import glob
+import logging
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, Set, Tuple
+
+from dotenv import dotenv_values, find_dotenv
+
+import config
+
+# Config-värden som varje omladdningsbar komponent byggs av
+COMPONENT_KEYS: Dict[str, Tuple[str, ...]] = {
+    "wakewords": ("PORCUPINE_ACCESS_KEY", "WAKEWORD_PATH", "WAKEWORDS_PATH",
+                  "WAKEWORD_SENSITIVITY", "WAKEWORD_PHRASE"),
+    "stt": ("VOSK_MODEL_PATH", "VOSK_FAST_MODEL_PATH", "STT_CONFIDENCE_THRESHOLD"),
+    "dsp": ("DSP_HIGHPASS_HZ", "DSP_AGC", "DSP_AGC_TARGET_DBFS", "DSP_AGC_MAX_GAIN_DB",
+            "DSP_NOISE_SUPPRESSION", "DSP_NOISE_FLOOR_DB"),
+    "tts": ("PIPER_MODEL_PATH", "PIPER_SPEAKER", "ORT_INTRA_OP_THREADS", "ORT_INTER_OP_THREADS",
+            "ORT_GRAPH_OPTIMIZATION", "ORT_ENABLE_CPU_MEM_ARENA", "ORT_ENABLE_MEM_PATTERN",
+            "PIPER_CACHE_DIR", "TTS_PARALLEL_WORKERS", "TTS_PARALLEL_MODE", "TTS_CROSSFADE_MS"),
+    "intents": ("INTENTS_PATH",),
+    "mqtt_topics": ("MQTT_TOPIC_RESPONSES", "MQTT_TOPIC_CONTROL"),
+}
+
+# Inställningar som bara läses vid start (anslutningar, ljudenheter, trådar)
+RESTART_KEYS = frozenset((
+    "MQTT_HOST", "MQTT_PORT", "MQTT_USERNAME", "MQTT_PASSWORD", "MQTT_TLS", "CLIENT_ID",
+    "INPUT_DEVICE_INDEX", "OUTPUT_DEVICE_INDEX", "INPUT_DEVICE_NAME", "SAMPLE_RATE",
+    "INPUT_SAMPLE_RATE", "OUTPUT_SAMPLE_RATE", "INPUT_CHANNELS", "MIC_ARRAY_APERTURE_M",
+    "AUDIO_STALL_TIMEOUT", "AUDIO_INPUT_BUFFER", "LOG_LEVEL", "LOG_FORMAT", "LOG_QUEUE_SIZE",
+    "LOG_RATE_LIMIT_BURST", "LOG_RATE_LIMIT_INTERVAL", "PIPELINE_MODE",
+    "PIPELINE_CAPTURE_RING_SECONDS", "PIPELINE_TTS_RING_SECONDS", "WAKEWORD_CPUS",
+    "STT_CPUS", "TTS_CPUS", "WAKEWORD_RT_PRIORITY", "WAKEWORD_NICE", "METRICS_LOG_INTERVAL",
+    "ARCHIVE_ENABLED", "ARCHIVE_DIR", "ARCHIVE_FORMAT", "ARCHIVE_FRACTION", "ARCHIVE_QUEUE_SIZE",
+    "ARCHIVE_MAX_MB", "ARCHIVE_MAX_AGE_DAYS", "GOVERNOR_ENABLED", "GOVERNOR_STT_RTF",
+    "GOVERNOR_TTS_RTF", "GOVERNOR_LOAD_HIGH", "GOVERNOR_LOAD_LOW", "GOVERNOR_INTERVAL",
+    "GOVERNOR_HOLD", "GOVERNOR_LENGTH_SCALE", "GOVERNOR_PIPER_MODEL_PATH",
+))
+
+# Samma .env som config laddar (sökt från denna katalog och uppåt)
+_DOTENV_PATH = find_dotenv()
+# Variabler som sattes i miljön (t.ex. av systemd) har företräde framför
+# .env, precis som vid start, och skrivs inte över vid omladdning
+_DOTENV_AT_START = dotenv_values(_DOTENV_PATH) if _DOTENV_PATH else {}
+_PINNED = frozenset(key for key, value in os.environ.items()
+                    if key not in _DOTENV_AT_START or _DOTENV_AT_START[key] != value)
+# Miljövariabler som för närvarande kommer från .env
+_dotenv_keys = {key for key, value in _DOTENV_AT_START.items()
+                if value is not None and key not in _PINNED}
+
+def snapshot() -> Dict[str, Any]:
+    """Alla nuvarande config-värden (namn med versaler)."""
+    return {key: value for key, value in vars(config).items() if key.isupper()}
+
+def load_config() -> Tuple[SimpleNamespace, Dict[str, str]]:
+    """
+    Läs om .env och beräkna config-värdena utan att ändra något.
+
+    Värdena beräknas med config.load() från en kopia av miljön där
+    .env-variablerna ersatts med filens nuvarande innehåll; variabler
+    som tagits bort ur .env finns inte med.
+
+    Returns:
+        Tuple (nya inställningar med samma attribut som config,
+        miljövariabler från .env) att ge till apply()
+
+    Raises:
+        Exception: Om .env eller config inte kan läsas
+    """
+    dotenv = {}
+    if _DOTENV_PATH:
+        dotenv = {key: value for key, value in dotenv_values(_DOTENV_PATH).items()
+                  if value is not None and key not in _PINNED}
+    environ = {key: value for key, value in os.environ.items() if key not in _dotenv_keys}
+    environ.update(dotenv)
+    return SimpleNamespace(**config.load(environ)), dotenv
+
+def apply(settings: SimpleNamespace, dotenv: Dict[str, str]) -> None:
+    """
+    Gör nya inställningar från load_config() gällande.
+
+    config uppdateras i ett enda dict-anrop, så andra trådar ser antingen
+    alla gamla eller alla nya värden. Miljövariabler som tagits bort ur
+    .env tas bort ur os.environ.
+    """
+    global _dotenv_keys
+    vars(config).update(vars(settings))
+    for key in _dotenv_keys - set(dotenv):
+        os.environ.pop(key, None)
+    os.environ.update(dotenv)
+    _dotenv_keys = set(dotenv)
+
+def changed_keys(old: Dict[str, Any], new: Dict[str, Any]) -> Set[str]:
+    """Namn på config-värden som skiljer sig mellan två ögonblicksbilder."""
+    return {key for key in set(old) | set(new) if old.get(key) != new.get(key)}
+
+def _mtime(path: str) -> float:
+    """Ändringstid för en fil eller katalog (0 om den saknas)."""
+    try:
+        return os.stat(path).st_mtime
+    except (OSError, ValueError):
+        return 0.0
+
+def _paths(component: str, wakeword_paths: Iterable[str], settings=config) -> Tuple[str, ...]:
+    """Filer och kataloger som en komponent laddas från."""
+    if component == "wakewords":
+        return (settings.WAKEWORDS_PATH or settings.WAKEWORD_PATH,) + tuple(wakeword_paths)
+    if component == "stt":
+        return tuple(p for p in (settings.VOSK_MODEL_PATH, settings.VOSK_FAST_MODEL_PATH) if p)
+    if component == "tts":
+        path = settings.PIPER_MODEL_PATH
+        if os.path.isdir(path):
+            return (path,) + tuple(sorted(glob.glob(os.path.join(path, "*.onnx*"))))
+        return (path, f"{path}.json")
+    if component == "intents":
+        return (settings.INTENTS_PATH,) if settings.INTENTS_PATH else ()
+    return ()
+
+def signatures(wakeword_paths: Iterable[str] = (), settings=config) -> Dict[str, tuple]:
+    """
+    Signatur per komponent för givna inställningar och nuvarande filer.
+
+    Args:
+        wakeword_paths: .ppn-filerna i det laddade wakeword-registret
+        settings: config eller inställningar från load_config()
+
+    Returns:
+        Dict komponent -> signatur; en ändrad signatur betyder att
+        komponenten måste laddas om
+    """
+    wakeword_paths = tuple(wakeword_paths)
+    result = {}
+    for component, keys in COMPONENT_KEYS.items():
+        values = tuple(getattr(settings, key, None) for key in keys)
+        files = tuple((path, _mtime(path)) for path in _paths(component, wakeword_paths, settings))
+        result[component] = (values, files)
+    return result
+
+def changed_components(old: Dict[str, tuple], new: Dict[str, tuple]) -> Set[str]:
+    """Komponenter vars signatur har ändrats."""
+    return {component for component in new if old.get(component) != new[component]}
+
+def pin_restart_keys(previous: Dict[str, Any], settings: SimpleNamespace) -> Set[str]:
+    """
+    Behåll de gamla värdena för inställningar som kräver omstart och logga dem.
+
+    Args:
+        previous: Nuvarande värden
+        settings: Nya inställningar från load_config() (ändras på plats)
+
+    Returns:
+        Namnen på ändrade inställningar som ignorerades
+    """
+    ignored = {key for key in RESTART_KEYS if previous.get(key) != getattr(settings, key, None)}
+    for key in sorted(ignored):
+        logging.warning(f"{key} ändras först vid omstart")
+        setattr(settings, key, previous.get(key))
+    return ignored
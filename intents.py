@@ -0,0 +1,126 @@
+"""
+Lokala intents för vanliga kommandon.
+
+Intent-tabellen laddas från en JSON-fil och används för att bygga en
+Vosk-grammatik med bara de kända fraserna. Grammatikavkodning är mycket
+snabbare än fri avkodning, och träffar hanteras lokalt utan att gå via
+n8n. Allt annat faller igenom till den vanliga MQTT-vägen.
+
+Filformat:
+    {
+      "intents": [
+        {"name": "stop", "phrases": ["stopp", "sluta"], "action": "stop"},
+        {"name": "time", "phrases": ["vad är klockan"], "action": "time"},
+        {"name": "thanks", "phrases": ["tack"], "action": "say", "response": "Varsågod!"}
+      ]
+    }
+"""
+import json
+import logging
+from typing import Dict, List, Optional
+
+class IntentError(Exception):
+    """Bas exception för intent-relaterade fel."""
+    pass
+
+class Intent:
+    """En lokal intent med fraser, åtgärd och valfritt talat svar."""
+
+    def __init__(self, name: str, phrases: List[str], action: str,
+                 response: Optional[str] = None):
+        """
+        Args:
+            name: Intentens namn
+            phrases: Fraser som utlöser intenten (gemener)
+            action: Namn på lokal åtgärd (t.ex. stop, volume_up, time, say)
+            response: Text att läsa upp efter åtgärden (None = ingen)
+        """
+        self.name = name
+        self.phrases = phrases
+        self.action = action
+        self.response = response
+
+class IntentTable:
+    """Tabell över lokala intents, indexerad på fras."""
+
+    def __init__(self, intents: List[Intent]):
+        """
+        Args:
+            intents: Lista med intents
+        """
+        self.intents = intents
+        self._by_phrase: Dict[str, Intent] = {}
+        for intent in intents:
+            for phrase in intent.phrases:
+                self._by_phrase[self.normalize(phrase)] = intent
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Normalisera text för jämförelse (gemener, enkla mellanslag)."""
+        return " ".join(text.lower().split())
+
+    @classmethod
+    def load(cls, path: str) -> "IntentTable":
+        """
+        Ladda intent-tabell från JSON-fil.
+
+        Args:
+            path: Sökväg till JSON-filen
+
+        Raises:
+            IntentError: Om filen saknas eller är ogiltig
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise IntentError(f"Kunde inte läsa intent-fil {path}: {e}")
+
+        intents = []
+        for entry in data.get("intents", []):
+            try:
+                phrases = [p for p in entry["phrases"] if p.strip()]
+                if not phrases:
+                    raise ValueError("inga fraser")
+                intents.append(Intent(
+                    name=entry["name"],
+                    phrases=phrases,
+                    action=entry.get("action", "say"),
+                    response=entry.get("response")
+                ))
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                raise IntentError(f"Ogiltig intent i {path}: {entry!r} ({e})")
+
+        if not intents:
+            raise IntentError(f"Inga intents definierade i {path}")
+        logging.info(f"Laddade {len(intents)} lokala intents från {path}")
+        return cls(intents)
+
+    def grammar(self) -> str:
+        """
+        Vosk-grammatik (JSON-lista) med alla fraser plus "[unk]".
+
+        "[unk]" låter avkodaren markera tal som inte matchar någon fras
+        i stället för att tvinga fram närmaste fras.
+        """
+        return json.dumps(sorted(self._by_phrase) + ["[unk]"], ensure_ascii=False)
+
+    def match(self, stt_result: dict, min_confidence: float = 0.0) -> Optional[Intent]:
+        """
+        Matcha ett Vosk-resultat från grammatikavkodning mot tabellen.
+
+        Args:
+            stt_result: Vosk-resultat (med ordnivå-detaljer om tillgängligt)
+            min_confidence: Lägsta tillåtna ordkonfidens
+
+        Returns:
+            Matchande intent eller None
+        """
+        text = self.normalize(stt_result.get("text", ""))
+        if not text or "[unk]" in text:
+            return None
+
+        words = stt_result.get("result", [])
+        if words and min(w.get("conf", 1.0) for w in words) < min_confidence:
+            return None
+        return self._by_phrase.get(text)
@@ -0,0 +1,183 @@
+"""
+Icke-blockerande loggning för realtidsslingorna.
+
+Alla loggposter läggs i en begränsad kö via en QueueHandler och skrivs
+ut av en QueueListener i en egen tråd, så att ett långsamt journald- eller
+SD-kort aldrig blockerar wakeword-, MQTT- eller TTS-trådarna. Upprepade
+meddelanden från samma rad begränsas innan de når kön, och utdata kan
+vara text eller JSON (en post per rad).
+"""
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from typing import Dict, Optional, Tuple
+
+import config
+
+class RateLimitFilter(logging.Filter):
+    """
+    Begränsa upprepade meddelanden per anropsplats.
+
+    Högst burst poster per interval sekunder släpps igenom från varje
+    kodrad och nivå. Antalet undertryckta poster läggs till i nästa post
+    som släpps igenom från samma rad.
+    """
+
+    def __init__(self, burst: int = 5, interval: float = 10.0):
+        """
+        Args:
+            burst: Antal poster per fönster och anropsplats (0 = ingen gräns)
+            interval: Fönstrets längd i sekunder
+        """
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._lock = threading.Lock()
+        # (fil, rad, nivå) -> [fönstrets start, släppta, undertryckta]
+        self._sites: Dict[Tuple[str, int, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Släpp igenom posten om anropsplatsen inte har nått sin gräns."""
+        if self.burst <= 0:
+            return True
+        key = (record.pathname, record.lineno, record.levelno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                self._sites[key] = [now, 1, 0]
+                return True
+            if now - site[0] >= self.interval:
+                site[0], site[1] = now, 0
+            if site[1] >= self.burst:
+                site[2] += 1
+                return False
+            site[1] += 1
+            suppressed, site[2] = site[2], 0
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler som aldrig blockerar.
+
+    Poster som inte får plats i kön kastas och räknas i dropped; antalet
+    rapporteras med nästa post som får plats.
+    """
+
+    def __init__(self, log_queue: "queue.Queue"):
+        """
+        Args:
+            log_queue: Begränsad kö som lyssnaren läser från
+        """
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Slå ihop meddelandet med dess argument, men lämna formateringen
+        (tid, undantag) till lyssnartråden.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if self.dropped:
+            record.dropped, self.dropped = self.dropped, 0
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Lägg posten i kön utan att vänta."""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class TextFormatter(logging.Formatter):
+    """Textformat som också visar undertryckta och kastade poster."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Formatera posten med eventuella räknare sist."""
+        text = super().format(record)
+        notes = []
+        if getattr(record, "suppressed", 0):
+            notes.append(f"{record.suppressed} liknande undertryckta")
+        if getattr(record, "dropped", 0):
+            notes.append(f"{record.dropped} poster kastade, loggkön full")
+        return f"{text} ({', '.join(notes)})" if notes else text
+
+class JsonFormatter(logging.Formatter):
+    """En JSON-post per rad, för journald eller logginsamling."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Formatera posten som JSON."""
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.processName,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        for key in ("suppressed", "dropped"):
+            if getattr(record, key, 0):
+                entry[key] = getattr(record, key)
+        return json.dumps(entry, ensure_ascii=False)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def configure_logging(process_name: Optional[str] = None) -> logging.handlers.QueueListener:
+    """
+    Koppla rotloggern till en kö och starta utskriftstråden enligt config.
+
+    Befintliga hanterare på rotloggern ersätts, så funktionen kan anropas
+    igen i en arbetsprocess.
+
+    Args:
+        process_name: Processnamn att visa i textformatet (None = inget)
+
+    Returns:
+        Den startade QueueListener (stoppas automatiskt vid avslut)
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    if config.LOG_FORMAT == "json":
+        formatter: logging.Formatter = JsonFormatter()
+    else:
+        prefix = f"[{process_name}] " if process_name else ""
+        formatter = TextFormatter(f"%(asctime)s [%(levelname)s] {prefix}%(message)s")
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(formatter)
+
+    log_queue: "queue.Queue" = queue.Queue(max(1, config.LOG_QUEUE_SIZE))
+    handler = BoundedQueueHandler(log_queue)
+    handler.addFilter(RateLimitFilter(config.LOG_RATE_LIMIT_BURST, config.LOG_RATE_LIMIT_INTERVAL))
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, config.LOG_LEVEL.upper(), logging.INFO))
+
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    return _listener
+
+def stop_logging() -> None:
+    """Skriv ut det som ligger kvar i kön och stoppa utskriftstråden."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
@@ -4,35 +4,47 @@ Huvudapplikation för rpi-n8n-voice-assistant.
 En röstassistent för Raspberry Pi med wakeword-detektering,
 lokal STT/TTS och MQTT-kommunikation till n8n.
 """
-import os
 import sys
-import json
-import glob
 import time
 import signal
 import logging
 import threading
-from typing import Optional
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
 
 import numpy as np
-from vosk import Model, KaldiRecognizer
-import pvporcupine
-from piper import PiperVoice
-from piper.config import SynthesisConfig
-import pyaudio
 
 import config
+import hot_reload
 from mqtt_client import MqttClient
-from audio_utils import AudioIO
+from audio_utils import AudioIO, CaptureDSP, CaptureWatchdog
+from models import (create_porcupine, create_speech_recognizer, create_capture_dsp,
+                    create_activity_gate, create_endpoint_gate, create_wakeword_verifier,
+                    load_wakewords, load_piper_voice, load_fallback_piper_voice,
+                    piper_options_from_config)
+from tts_utils import synthesize_pcm, warm_up, ResponseAssembler, SpeechQueue, ParallelSynthesizer
+from pipeline import MultiprocessPipeline
+from scheduling import CpuLayout, apply_policy
+from intents import Intent, IntentTable
+from profiling import ProfilingSession
+from archive import UtteranceArchiver
+from wake_verify import PrerollBuffer, WakewordVerifier
+from governor import QualityGovernor
+from wakewords import WakewordRegistry
+from metrics import metrics, MetricsReporter, WakewordStats, process_uptime
+from log_utils import configure_logging
 
-# Konfigurera logging
-logging.basicConfig(
-    level=getattr(logging, config.LOG_LEVEL.upper(), logging.INFO),
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+if TYPE_CHECKING:
+    # Porcupine, Piper och Vosk importeras först när modellerna laddas
+    import pvporcupine
+    from piper import PiperVoice
+    from stt import SpeechRecognizer
+
+# Konfigurera logging (köad, så att loggning aldrig blockerar ljudtrådarna)
+configure_logging()
 
 class VoiceAssistant:
     """
@@ -45,10 +57,41 @@ class VoiceAssistant:
         """Initialisera röstassistenten med alla nödvändiga komponenter."""
         self.running = False
         self.audio: Optional[AudioIO] = None
-        self.porcupine: Optional[pvporcupine.Porcupine] = None
-        self.vosk_model: Optional[Model] = None
-        self.piper: Optional[PiperVoice] = None
+        self.porcupine: Optional["pvporcupine.Porcupine"] = None
+        self.wakewords: Optional[WakewordRegistry] = None
+        self.stt: Optional["SpeechRecognizer"] = None
+        self.dsp: Optional[CaptureDSP] = None
+        self.piper: Optional["PiperVoice"] = None
+        self.parallel_tts: Optional[ParallelSynthesizer] = None
         self.mqtt: Optional[MqttClient] = None
+        self.pipeline: Optional[MultiprocessPipeline] = None
+        self.cpu_layout = CpuLayout()
+        self.intents: Optional[IntentTable] = None
+        self.speech: Optional[SpeechQueue] = None
+        self.archiver: Optional[UtteranceArchiver] = None
+        self.governor: Optional[QualityGovernor] = None
+        self.piper_fallback: Optional["PiperVoice"] = None
+        self._assembler = ResponseAssembler(max_length=config.MAX_TEXT_LENGTH)
+        self.metrics_reporter = MetricsReporter(metrics, config.METRICS_LOG_INTERVAL)
+        self._tts_cache: "OrderedDict[str, Tuple[np.ndarray, int]]" = OrderedDict()
+        self._tts_cache_lock = threading.Lock()
+        self._followup = threading.Event()
+        self._followup_session: Optional[str] = None
+        self._reply_sessions: Dict[str, str] = {}
+        self._last_command: Tuple[Optional[str], Optional[str]] = (None, None)
+        # Omladdning: hålls från begäran tills komponenterna har bytts in
+        self._reload_lock = threading.Lock()
+        self._pending_reload: Optional[dict] = None
+        self._signatures: Dict[str, tuple] = {}
+        self._profile: Optional[ProfilingSession] = None
+        self._profile_lock = threading.Lock()
+        self._intent_actions = {
+            "stop": self._intent_stop,
+            "volume_up": self._intent_volume_up,
+            "volume_down": self._intent_volume_down,
+            "time": self._intent_time,
+            "say": lambda intent: None,
+        }
         
         try:
             self._initialize()
@@ -64,75 +107,56 @@ class VoiceAssistant:
         # Validera konfiguration
         self._validate_config()
         
+        # CPU-layout: trådar som skapas härefter (ONNX Runtime, MQTT) ärver
+        # STT/TTS-kärnorna; wakeword-tråden flyttas i listen_for_wake
+        self.cpu_layout.report()
+        if self.cpu_layout.enabled:
+            apply_policy(self.cpu_layout.workers)
+        
         # Ljud
         try:
             self.audio = AudioIO(
                 sample_rate=config.SAMPLE_RATE,
                 input_device_index=config.INPUT_DEVICE_INDEX,
                 output_device_index=config.OUTPUT_DEVICE_INDEX,
-                stream_stabilize_delay=config.AUDIO_STREAM_STABILIZE_DELAY
+                stream_stabilize_delay=config.AUDIO_STREAM_STABILIZE_DELAY,
+                input_rate=config.INPUT_SAMPLE_RATE,
+                output_rate=config.OUTPUT_SAMPLE_RATE,
+                input_channels=config.INPUT_CHANNELS,
+                mic_aperture_m=config.MIC_ARRAY_APERTURE_M,
+                input_device_name=config.INPUT_DEVICE_NAME,
+                read_timeout=config.AUDIO_STALL_TIMEOUT,
+                input_buffer_frames=config.AUDIO_INPUT_BUFFER
             )
             logging.info("✓ Ljudhantering initialiserad")
         except Exception as e:
             raise RuntimeError(f"Kunde inte initialisera ljudhantering: {e}")
 
-        # Wakeword (Porcupine)
+        # Wakewords och deras routing
         try:
-            if not config.PORCUPINE_ACCESS_KEY:
-                raise ValueError("PORCUPINE_ACCESS_KEY saknas (kör setup_wizard.py eller sätt .env)")
-            if not os.path.exists(config.WAKEWORD_PATH):
-                raise FileNotFoundError(f"Wakeword-fil saknas: {config.WAKEWORD_PATH}")
-                
-            self.porcupine = pvporcupine.create(
-                access_key=config.PORCUPINE_ACCESS_KEY,
-                keyword_paths=[config.WAKEWORD_PATH],
-                sensitivities=[0.6]
-            )
-            logging.info(f"✓ Wakeword-detektering initialiserad: {config.WAKEWORD_PATH}")
+            self.wakewords = self._load_wakewords()
         except Exception as e:
-            raise RuntimeError(f"Kunde inte initialisera Porcupine: {e}")
+            raise RuntimeError(f"Kunde inte ladda wakewords: {e}")
 
-        # STT (Vosk)
-        try:
-            if not os.path.isdir(config.VOSK_MODEL_PATH):
-                raise FileNotFoundError(f"Vosk-modellen hittas inte: {config.VOSK_MODEL_PATH}")
-                
-            logging.info("Laddar Vosk-modell (kan ta några sekunder)...")
-            self.vosk_model = Model(config.VOSK_MODEL_PATH)
-            logging.info("✓ Speech-to-Text (Vosk) initialiserad")
-        except Exception as e:
-            raise RuntimeError(f"Kunde inte initialisera Vosk: {e}")
+        # Modeller: i egna processer eller i denna process
+        if config.PIPELINE_MODE == "multiprocess":
+            self._initialize_pipeline()
+        else:
+            self._initialize_models()
 
-        # TTS (Piper)
-        try:
-            # Support both directory and file paths for PIPER_MODEL_PATH
-            piper_model_file = None
-            
-            if os.path.isfile(config.PIPER_MODEL_PATH):
-                # Direct path to .onnx file
-                piper_model_file = config.PIPER_MODEL_PATH
-            elif os.path.isdir(config.PIPER_MODEL_PATH):
-                # Directory path - find the .onnx file
-                onnx_files = sorted(glob.glob(os.path.join(config.PIPER_MODEL_PATH, "*.onnx")))
-                if onnx_files:
-                    piper_model_file = onnx_files[0]
-                    logging.info(f"Hittade Piper-modell: {os.path.basename(piper_model_file)}")
-                else:
-                    raise FileNotFoundError(
-                        f"Ingen .onnx-fil hittades i katalogen: {config.PIPER_MODEL_PATH}\n"
-                        f"Ladda ner en Piper-modell från https://github.com/rhasspy/piper#voices"
-                    )
-            else:
-                raise FileNotFoundError(
-                    f"Piper-modellen hittas inte: {config.PIPER_MODEL_PATH}\n"
-                    f"Ange antingen en sökväg till en .onnx-fil eller en katalog som innehåller en."
-                )
-                
-            logging.info("Laddar Piper-modell (kan ta några sekunder)...")
-            self.piper = PiperVoice.load(piper_model_file)
-            logging.info("✓ Text-to-Speech (Piper) initialiserad")
-        except Exception as e:
-            raise RuntimeError(f"Kunde inte initialisera Piper: {e}")
+        # Uppläsningskö: syntes och uppspelning utanför MQTT-tråden
+        self.speech = SpeechQueue(
+            self._synthesize,
+            lambda pcm, sample_rate: self.audio.play_pcm(pcm, sample_rate=sample_rate)
+        )
+
+        # Lokala intents (valfritt)
+        if config.INTENTS_PATH:
+            try:
+                self.intents = self._load_intents()
+                logging.info("✓ Lokala intents initialiserade")
+            except Exception as e:
+                raise RuntimeError(f"Kunde inte ladda lokala intents: {e}")
 
         # MQTT
         try:
@@ -153,34 +177,364 @@ class VoiceAssistant:
                 raise ConnectionError("Kunde inte ansluta till MQTT-broker")
                 
             self.mqtt.subscribe(config.MQTT_TOPIC_RESPONSES)
+            self.mqtt.subscribe(config.MQTT_TOPIC_CONTROL)
             logging.info("✓ MQTT-kommunikation initialiserad")
         except Exception as e:
             raise RuntimeError(f"Kunde inte initialisera MQTT: {e}")
 
+        if config.ARCHIVE_ENABLED:
+            self.archiver = UtteranceArchiver(
+                config.ARCHIVE_DIR, config.SAMPLE_RATE,
+                audio_format=config.ARCHIVE_FORMAT,
+                fraction=config.ARCHIVE_FRACTION,
+                queue_size=config.ARCHIVE_QUEUE_SIZE,
+                max_mb=config.ARCHIVE_MAX_MB,
+                max_age_days=config.ARCHIVE_MAX_AGE_DAYS
+            )
+            self.archiver.start()
+            logging.info(f"✓ Arkiverar {config.ARCHIVE_FRACTION:.0%} av kommandona i {config.ARCHIVE_DIR} "
+                         f"({config.ARCHIVE_FORMAT})")
+
+        if config.GOVERNOR_ENABLED:
+            self.governor = QualityGovernor(
+                stt_rtf=config.GOVERNOR_STT_RTF,
+                tts_rtf=config.GOVERNOR_TTS_RTF,
+                load_high=config.GOVERNOR_LOAD_HIGH,
+                load_low=config.GOVERNOR_LOAD_LOW,
+                interval=config.GOVERNOR_INTERVAL,
+                hold=config.GOVERNOR_HOLD,
+                on_change=lambda level, name, reason: self._publish_status(
+                    {"event": "quality", "level": name, "reason": reason})
+            )
+            self.governor.start()
+            logging.info(f"✓ Adaptiv kvalitet: CPU-tryck {config.GOVERNOR_LOAD_HIGH:.0f} %, "
+                         f"realtidsfaktor STT {config.GOVERNOR_STT_RTF}, TTS {config.GOVERNOR_TTS_RTF}")
+
+        self._signatures = hot_reload.signatures(self.wakewords.paths)
+        self.metrics_reporter.start()
         self.running = True
         logging.info("✓ Initialisering klar!")
 
-    def _validate_config(self) -> None:
+    def _initialize_pipeline(self) -> None:
+        """Starta wakeword, STT och TTS i separata processer."""
+        try:
+            logging.info("Startar flerprocess-pipeline (kan ta några sekunder)...")
+            self.pipeline = MultiprocessPipeline(
+                capture_seconds=config.PIPELINE_CAPTURE_RING_SECONDS,
+                tts_seconds=config.PIPELINE_TTS_RING_SECONDS
+            )
+            self.pipeline.start()
+            logging.info("✓ Flerprocess-pipeline initialiserad (capture/wakeword, STT, TTS)")
+        except Exception as e:
+            raise RuntimeError(f"Kunde inte starta flerprocess-pipeline: {e}")
+
+    def _initialize_models(self) -> None:
+        """
+        Ladda wakeword-, STT- och TTS-modeller i denna process.
+        
+        Piper laddas i en egen tråd samtidigt som Porcupine och Vosk; båda
+        laddarna arbetar mest i native-kod utan GIL, så starttiden blir
+        ungefär den längsta laddningen i stället för summan.
+        """
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="load-tts") as loader:
+            logging.info("Laddar Piper-modell (kan ta några sekunder)...")
+            tts = loader.submit(self._load_tts, config.PIPER_WARMUP)
+            fallback = loader.submit(load_fallback_piper_voice)
+
+            # Wakeword (Porcupine)
+            try:
+                self.porcupine = create_porcupine(self.wakewords)
+                logging.info(f"✓ Wakeword-detektering initialiserad ({len(self.wakewords)} ord)")
+            except Exception as e:
+                raise RuntimeError(f"Kunde inte initialisera Porcupine: {e}")
+
+            # STT (Vosk)
+            try:
+                logging.info("Laddar Vosk-modell (kan ta några sekunder)...")
+                self.stt = create_speech_recognizer()
+                self.dsp = create_capture_dsp()
+                logging.info(f"Ljudförbehandling: {self.dsp.describe() if self.dsp else 'av'}")
+                logging.info("✓ Speech-to-Text (Vosk) initialiserad")
+            except Exception as e:
+                raise RuntimeError(f"Kunde inte initialisera Vosk: {e}")
+
+            # TTS (Piper)
+            try:
+                self.piper, self.parallel_tts = tts.result()
+                self.piper_fallback = fallback.result()
+                logging.info("✓ Text-to-Speech (Piper) initialiserad")
+            except Exception as e:
+                raise RuntimeError(f"Kunde inte initialisera Piper: {e}")
+
+    def _load_wakewords(self, settings=config) -> WakewordRegistry:
+        """Ladda wakeword-registret och kontrollera ordens åtgärder."""
+        wakewords = load_wakewords(settings)
+        for keyword in wakewords.keywords:
+            if keyword.action not in ("command", "event") and keyword.action not in self._intent_actions:
+                raise ValueError(f"Okänd åtgärd '{keyword.action}' för wakeword '{keyword.name}'")
+            if keyword.action == "event" and not keyword.topic:
+                raise ValueError(f"Wakeword '{keyword.name}' med åtgärden event saknar topic")
+        logging.info(f"Wakewords: {wakewords.describe()}")
+        return wakewords
+
+    def _load_intents(self, settings=config) -> Optional[IntentTable]:
+        """Ladda intent-tabellen (None om INTENTS_PATH är tom) och kontrollera åtgärderna."""
+        if not settings.INTENTS_PATH:
+            return None
+        intents = IntentTable.load(settings.INTENTS_PATH)
+        for intent in intents.intents:
+            if intent.action not in self._intent_actions:
+                raise ValueError(f"Okänd åtgärd '{intent.action}' för intent '{intent.name}'")
+        return intents
+
+    def _load_tts(self, warm: bool, settings=config) -> Tuple["PiperVoice", Optional[ParallelSynthesizer]]:
+        """Ladda Piper-rösten och, med TTS_PARALLEL_WORKERS > 1, den parallella syntesen."""
+        piper = load_piper_voice(settings.PIPER_MODEL_PATH, **piper_options_from_config(settings))
+        if warm:
+            warm_up(piper, settings.PIPER_SPEAKER)
+        parallel = None
+        if settings.TTS_PARALLEL_WORKERS > 1:
+            parallel = ParallelSynthesizer(
+                piper,
+                settings.TTS_PARALLEL_WORKERS,
+                mode=settings.TTS_PARALLEL_MODE,
+                model_path=settings.PIPER_MODEL_PATH,
+                load_options=piper_options_from_config(settings),
+                crossfade_ms=settings.TTS_CROSSFADE_MS
+            )
+            logging.info(f"Parallell TTS: {settings.TTS_PARALLEL_WORKERS} arbetare ({settings.TTS_PARALLEL_MODE})")
+        return piper, parallel
+
+    def request_reload(self, reason: str, force: bool = False) -> bool:
+        """
+        Ladda om .env, modeller, wakewords och intents utan omstart.
+        
+        Ändrade komponenter laddas och provkörs i en bakgrundstråd medan
+        wakeword-loopen fortsätter, och byts in av loopen mellan två
+        interaktioner. Misslyckas något behålls allt som det var.
+        
+        Args:
+            reason: Vad som utlöste omladdningen (för loggning)
+            force: Ladda om alla komponenter, även oförändrade
+            
+        Returns:
+            False om en omladdning redan pågår
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            logging.warning("Omladdning pågår redan, ignorerar begäran")
+            return False
+        logging.info(f"🔄 Laddar om konfigurationen ({reason})...")
+        threading.Thread(target=self._reload, args=(force,), name="reload", daemon=True).start()
+        return True
+
+    def _reload(self, force: bool) -> None:
+        """Bakgrundstråd: läs om config och ladda de komponenter som ändrats."""
+        loaded: dict = {}
+        previous = hot_reload.snapshot()
+        try:
+            try:
+                settings, dotenv = hot_reload.load_config()
+            except Exception as e:
+                raise RuntimeError(f"Kunde inte läsa konfigurationen: {e}")
+            hot_reload.pin_restart_keys(previous, settings)
+            # config ändras inte förrän _apply_reload; allt här läser settings
+            self._validate_config(settings)
+            signatures = hot_reload.signatures(self.wakewords.paths, settings)
+            components = (set(signatures) if force
+                          else hot_reload.changed_components(self._signatures, signatures))
+            if self.pipeline:
+                in_workers = components & {"wakewords", "stt", "dsp", "tts"}
+                if in_workers:
+                    logging.warning(f"Flerprocessläge: {', '.join(sorted(in_workers))} "
+                                    f"laddas om först vid omstart")
+                    components -= in_workers
+            self._load_components(components, loaded, settings)
+            if "wakewords" in loaded:
+                signatures["wakewords"] = hot_reload.signatures(
+                    loaded["wakewords"][0].paths, settings)["wakewords"]
+        except Exception as e:
+            self._discard_components(loaded)
+            self._reload_lock.release()
+            metrics.incr("reload.failed")
+            logging.error(f"✗ Omladdning misslyckades, behåller nuvarande konfiguration: {e}")
+            self._publish_status({"event": "reload", "ok": False, "error": str(e)})
+            return
+
+        changed = sorted(hot_reload.changed_keys(previous, vars(settings)))
+        logging.info(f"Ändrade inställningar: {', '.join(changed) if changed else 'inga'}; "
+                     f"komponenter att byta: {', '.join(sorted(components)) if components else 'inga'}")
+        self._pending_reload = {
+            "components": components,
+            "loaded": loaded,
+            "signatures": signatures,
+            "settings": settings,
+            "dotenv": dotenv,
+        }
+
+    def _load_components(self, components: set, loaded: dict, settings) -> None:
+        """
+        Ladda och provkör nya komponenter (körs i omladdningstråden).
+        
+        Args:
+            components: Komponenter att ladda
+            loaded: Fylls med de nya objekten, så att de kan kastas om
+                ett senare steg misslyckas
+            settings: Inställningar från hot_reload.load_config()
+        """
+        if "wakewords" in components:
+            wakewords = self._load_wakewords(settings)
+            porcupine = create_porcupine(wakewords, settings)
+            loaded["wakewords"] = (wakewords, porcupine)
+            porcupine.process(np.zeros(porcupine.frame_length, dtype=np.int16))
+        if "stt" in components:
+            logging.info("Laddar Vosk-modell i bakgrunden...")
+            loaded["stt"] = create_speech_recognizer(settings)
+            loaded["stt"].transcribe(np.zeros(settings.SAMPLE_RATE // 2, dtype=np.int16))
+        if "dsp" in components:
+            loaded["dsp"] = create_capture_dsp(settings)
+        if "tts" in components:
+            logging.info("Laddar Piper-modell i bakgrunden...")
+            # Uppvärmningen är också provkörningen av den nya rösten
+            loaded["tts"] = self._load_tts(True, settings)
+        if "intents" in components:
+            loaded["intents"] = self._load_intents(settings)
+
+    def _discard_components(self, loaded: dict) -> None:
+        """Frigör komponenter som laddats men inte bytts in (eller har bytts ut)."""
+        if "wakewords" in loaded:
+            loaded["wakewords"][1].delete()
+        if "tts" in loaded and loaded["tts"][1] is not None:
+            # Väntande synteser i den gamla poolen får köra klart
+            threading.Thread(target=loaded["tts"][1].shutdown, kwargs={"wait": True},
+                             name="tts-retire", daemon=True).start()
+
+    def _apply_reload(self) -> None:
+        """
+        Byt in omladdade komponenter.
+        
+        Anropas från wakeword-loopen mellan interaktioner, så Porcupine och
+        Vosk byts aldrig mitt i en detektion eller transkribering, och de
+        nya inställningarna börjar gälla samtidigt som komponenterna byts.
+        Pågående uppläsning gör klart med den gamla rösten.
+        """
+        pending, self._pending_reload = self._pending_reload, None
+        loaded = pending["loaded"]
+        settings = pending["settings"]
+        retired: dict = {}
+        try:
+            topics = {}
+            if "mqtt_topics" in pending["components"]:
+                # Prenumerera på nya topics innan config pekar på dem, och
+                # avsluta de gamla först efteråt, så att inga svar tappas
+                topics = {name: getattr(config, name)
+                          for name in ("MQTT_TOPIC_RESPONSES", "MQTT_TOPIC_CONTROL")
+                          if getattr(config, name) != getattr(settings, name)}
+                for name in topics:
+                    self.mqtt.subscribe(getattr(settings, name))
+            hot_reload.apply(settings, pending["dotenv"])
+            for old_topic in topics.values():
+                self.mqtt.unsubscribe(old_topic)
+            if "wakewords" in loaded:
+                retired["wakewords"] = (self.wakewords, self.porcupine)
+                self.wakewords, self.porcupine = loaded["wakewords"]
+            if "stt" in loaded:
+                self.stt = loaded["stt"]
+            if "dsp" in loaded:
+                self.dsp = loaded["dsp"]
+                logging.info(f"Ljudförbehandling: {self.dsp.describe() if self.dsp else 'av'}")
+            if "tts" in loaded:
+                retired["tts"] = (self.piper, self.parallel_tts)
+                with self._tts_cache_lock:
+                    self.piper, self.parallel_tts = loaded["tts"]
+                    self._tts_cache.clear()
+            if "intents" in loaded:
+                self.intents = loaded["intents"]
+            for component in pending["components"]:
+                self._signatures[component] = pending["signatures"][component]
+        finally:
+            self._reload_lock.release()
+        self._discard_components(retired)
+
+        metrics.incr("reload.ok")
+        components = sorted(pending["components"])
+        logging.info(f"✓ Omladdning klar ({', '.join(components) if components else 'bara inställningar'})")
+        self._publish_status({"event": "reload", "ok": True, "components": components})
+
+    def request_profile(self, reason: str, seconds: Optional[float] = None) -> bool:
+        """
+        Profilera processen under en begränsad tid.
+        
+        Stackarna i alla trådar samplas i en bakgrundstråd och resultatet
+        sparas i PROFILE_DIR; sammanfattningen publiceras som statushändelse.
+        I flerprocessläge profileras bara huvudprocessen.
+        
+        Args:
+            reason: Vad som utlöste profileringen (för loggning)
+            seconds: Sessionens längd (None = PROFILE_SECONDS)
+            
+        Returns:
+            False om en profilering redan pågår
+        """
+        with self._profile_lock:
+            if self._profile is not None and self._profile.running:
+                logging.warning("Profilering pågår redan, ignorerar begäran")
+                return False
+            seconds = min(max(float(seconds or config.PROFILE_SECONDS), 1.0), 600.0)
+            self._profile = ProfilingSession(
+                seconds, config.PROFILE_DIR,
+                interval=config.PROFILE_INTERVAL_MS / 1000,
+                trace_memory=config.PROFILE_TRACEMALLOC,
+                top=config.PROFILE_TOP,
+                on_done=lambda summary: self._publish_status({"event": "profile", **summary})
+            )
+            self._profile.start()
+        logging.info(f"🔬 Profilerar i {seconds:.0f} s ({reason})...")
+        return True
+
+    def _publish_status(self, event: dict) -> None:
+        """Publicera en statushändelse på MQTT_TOPIC_STATUS."""
+        if self.mqtt:
+            self.mqtt.publish_json(config.MQTT_TOPIC_STATUS, {**event, "timestamp": time.time()})
+
+    def _validate_config(self, settings=config) -> None:
         """Validera kritiska konfigurationsinställningar."""
-        if not config.MQTT_HOST:
+        if not settings.MQTT_HOST:
             raise ValueError("MQTT_HOST måste anges")
-        if not 1 <= config.MQTT_PORT <= 65535:
-            raise ValueError(f"Ogiltig MQTT_PORT: {config.MQTT_PORT}")
-        if config.SAMPLE_RATE <= 0:
-            raise ValueError(f"Ogiltig SAMPLE_RATE: {config.SAMPLE_RATE}")
-        if config.RECORD_SECONDS_AFTER_WAKE <= 0:
-            raise ValueError(f"Ogiltig RECORD_SECONDS_AFTER_WAKE: {config.RECORD_SECONDS_AFTER_WAKE}")
+        if not 1 <= settings.MQTT_PORT <= 65535:
+            raise ValueError(f"Ogiltig MQTT_PORT: {settings.MQTT_PORT}")
+        if settings.SAMPLE_RATE <= 0:
+            raise ValueError(f"Ogiltig SAMPLE_RATE: {settings.SAMPLE_RATE}")
+        if settings.RECORD_SECONDS_AFTER_WAKE <= 0:
+            raise ValueError(f"Ogiltig RECORD_SECONDS_AFTER_WAKE: {settings.RECORD_SECONDS_AFTER_WAKE}")
+        if settings.PIPELINE_MODE not in ("threaded", "multiprocess"):
+            raise ValueError(f"Ogiltig PIPELINE_MODE: {settings.PIPELINE_MODE}")
+        if settings.AUDIO_STALL_TIMEOUT <= 0:
+            raise ValueError(f"Ogiltig AUDIO_STALL_TIMEOUT: {settings.AUDIO_STALL_TIMEOUT}")
 
     def on_mqtt_message(self, topic: str, data: dict) -> None:
         """
         Hantera inkommande MQTT-meddelanden från n8n.
         
+        Svar är antingen ett komplett meddelande ({"tts_text": ...}) eller
+        strömmade fragment ({"response_id", "seq", "tts_text", "final"}).
+        Uppläsningen köas, så MQTT-tråden blockeras inte. Med
+        "expect_reply": true (och valfritt "session_id") lyssnar assistenten
+        efter en följdfråga när svaret har spelats upp.
+        
         Args:
             topic: MQTT topic
             data: JSON data som dict
         """
         try:
+            self._purge_reply_sessions()
+            if topic == config.MQTT_TOPIC_CONTROL:
+                self._handle_control(data)
+                return
             if topic == config.MQTT_TOPIC_RESPONSES:
+                if isinstance(data, dict) and "response_id" in data:
+                    self._handle_response_fragment(data)
+                    return
+                    
                 tts_text = data.get("tts_text") if isinstance(data, dict) else None
                 
                 if not tts_text:
@@ -193,29 +547,141 @@ class VoiceAssistant:
                     tts_text = tts_text[:config.MAX_TEXT_LENGTH]
                 
                 logging.info(f"TTS-svar mottaget ({len(tts_text)} tecken). Läser upp...")
-                
-                try:
-                    # Create synthesis configuration
-                    syn_config = SynthesisConfig(
-                        speaker_id=config.PIPER_SPEAKER,
-                        length_scale=1.0,
-                        volume=1.0
-                    )
-                    
-                    # Synthesize returns an iterable of AudioChunk objects
-                    # Collect all audio chunks and concatenate them
-                    audio_bytes = b''
-                    for audio_chunk in self.piper.synthesize(tts_text, syn_config):
-                        audio_bytes += audio_chunk.audio_int16_bytes
-                    
-                    # Convert bytes to numpy array and play
-                    pcm = np.frombuffer(audio_bytes, dtype=np.int16)
-                    self.audio.play_pcm(pcm)
-                except Exception as e:
-                    logging.error(f"TTS-syntes misslyckades: {e}")
+                self.speech.say(tts_text)
+                if data.get("expect_reply"):
+                    self._expect_reply(str(data.get("session_id") or uuid.uuid4().hex[:12]))
         except Exception as e:
             logging.exception(f"Fel vid hantering av MQTT-meddelande: {e}")
 
+    def _handle_control(self, data: dict) -> None:
+        """
+        Hantera styrmeddelanden.
+        
+        {"command": "reload"} laddar om konfigurationen, och med
+        "force": true alla komponenter även om inget har ändrats.
+        {"command": "profile"} profilerar processen, valfritt med
+        "seconds": N.
+        """
+        command = data.get("command") if isinstance(data, dict) else None
+        if command == "reload":
+            self.request_reload("MQTT", force=bool(data.get("force", False)))
+        elif command == "profile":
+            try:
+                seconds = float(data["seconds"]) if data.get("seconds") is not None else None
+            except (TypeError, ValueError):
+                logging.warning(f"Ogiltig profileringstid: {data.get('seconds')!r}")
+                return
+            self.request_profile("MQTT", seconds)
+        else:
+            logging.warning(f"Okänt styrkommando: {command!r}")
+
+    def _handle_response_fragment(self, data: dict) -> None:
+        """
+        Hantera ett fragment av ett strömmat svar.
+        
+        Kompletta meningar köas för uppläsning direkt, så talet kan börja
+        innan hela svaret har genererats.
+        
+        Args:
+            data: {"response_id": str, "seq": int, "tts_text": str, "final": bool}
+        """
+        try:
+            response_id = str(data["response_id"])
+            seq = int(data.get("seq", 0))
+        except (TypeError, ValueError) as e:
+            logging.warning(f"Ogiltigt fragment i strömmat svar: {e}")
+            return
+            
+        text = data.get("tts_text") or ""
+        if not isinstance(text, str):
+            logging.warning(f"Fragment {seq} i svar {response_id} har ogiltig 'tts_text'")
+            return
+            
+        if data.get("expect_reply"):
+            self._reply_sessions[response_id] = str(data.get("session_id") or response_id)
+
+        sentences = self._assembler.add(response_id, seq, text, bool(data.get("final", False)))
+        for sentence in sentences:
+            logging.info(f"Läser upp mening ur svar {response_id} ({len(sentence)} tecken)")
+            self.speech.say(sentence)
+
+        if response_id in self._reply_sessions and not self._assembler.is_active(response_id):
+            self._expect_reply(self._reply_sessions.pop(response_id))
+
+    def _purge_reply_sessions(self) -> None:
+        """
+        Glöm strömmade svar som aldrig avslutades.
+
+        Anropas för varje inkommande meddelande, så att ett svar vars
+        slutfragment aldrig kom inte ligger kvar i väntan på en följdfråga.
+        """
+        for response_id in self._assembler.purge():
+            self._reply_sessions.pop(response_id, None)
+        # Sessioner utan påbörjat svar (t.ex. om fragmentet inte kunde läggas till)
+        for response_id in [rid for rid in self._reply_sessions
+                            if not self._assembler.is_active(rid)]:
+            del self._reply_sessions[response_id]
+
+    def _expect_reply(self, session_id: str) -> None:
+        """Öppna ett följdfrågefönster när allt köat tal har spelats upp."""
+        if config.FOLLOWUP_TIMEOUT <= 0:
+            return
+        self.speech.call_when_done(lambda: self._request_followup(session_id))
+
+    def _speak(self, text: str, cache: bool = False) -> None:
+        """
+        Läs upp text (omsamplad till utgångsenhetens takt).
+        
+        Args:
+            text: Text att läsa upp
+            cache: Återanvänd/spara syntesen i TTS-cachen (för återkommande svar)
+        """
+        cached = None
+        if cache:
+            with self._tts_cache_lock:
+                cached = self._tts_cache.get(text)
+                if cached is not None:
+                    self._tts_cache.move_to_end(text)
+                    
+        if cached is None:
+            cached = self._synthesize(text)
+            # Syntes med sänkt kvalitet cachas inte
+            if cache and not (self.governor and self.governor.level):
+                with self._tts_cache_lock:
+                    self._tts_cache[text] = cached
+                    while len(self._tts_cache) > config.TTS_CACHE_SIZE:
+                        self._tts_cache.popitem(last=False)
+                        
+        pcm, sample_rate = cached
+        self.audio.play_pcm(pcm, sample_rate=sample_rate)
+
+    def _synthesize(self, text: str) -> Tuple[np.ndarray, int]:
+        """
+        Syntetisera text, lokalt eller i TTS-processen.
+        
+        Returns:
+            Tuple (PCM som int16-array, samplingsfrekvens i Hz)
+        """
+        level = self.governor.level if self.governor else 0
+        length_scale = config.GOVERNOR_LENGTH_SCALE if level >= 1 else 1.0
+        fallback = level >= 2
+        start = time.perf_counter()
+        if self.pipeline:
+            result = self.pipeline.synthesize(text, config.PIPER_SPEAKER,
+                                              length_scale=length_scale, fallback=fallback)
+        else:
+            with self.cpu_layout.pinned(self.cpu_layout.tts):
+                if fallback and self.piper_fallback is not None:
+                    result = synthesize_pcm(self.piper_fallback, text, None, length_scale)
+                elif self.parallel_tts:
+                    result = self.parallel_tts.synthesize(text, config.PIPER_SPEAKER, length_scale)
+                else:
+                    result = synthesize_pcm(self.piper, text, config.PIPER_SPEAKER, length_scale)
+        if self.governor:
+            pcm, sample_rate = result
+            self.governor.observe("tts", time.perf_counter() - start, len(pcm) / sample_rate)
+        return result
+
     def listen_for_wake(self) -> None:
         """
         Huvudloop: Lyssna efter wakeword och hantera röstkommandon.
@@ -227,33 +693,79 @@ class VoiceAssistant:
         4. Skicka till n8n via MQTT
         5. Spela feedback-ljud
         """
+        if self.pipeline:
+            self._listen_pipeline()
+            return
+            
         stream = None
         
         try:
-            pa = self.audio.pa
-            stream = pa.open(
-                format=pyaudio.paInt16,
-                channels=1,
-                rate=config.SAMPLE_RATE,
-                input=True,
-                frames_per_buffer=512
-            )
+            # Wakeword-tråden får sin egen kärna och prioritet
+            if self.cpu_layout.enabled:
+                applied = apply_policy(self.cpu_layout.wakeword)
+                logging.info(f"Wakeword-tråd: {applied or 'oförändrad'}")
             
-            logging.info("Lyssnar efter wakeword... (Tryck Ctrl+C för att avsluta)")
+            # Enheten öppnas i sin egen takt, ljudet omsamplas till SAMPLE_RATE
+            frame_length = self.porcupine.frame_length
+            stream = self.audio.open_capture(frames_per_buffer=frame_length)
+            gate = create_activity_gate(frame_length)
+            stats = WakewordStats(metrics, config.WAKEWORD_STATS_INTERVAL, gate)
+            verifier, preroll = self._create_verifier()
+            watchdog = CaptureWatchdog(config.AUDIO_MAX_ERRORS)
+            
+            self._report_listening()
 
             while self.running:
                 try:
-                    data = stream.read(512, exception_on_overflow=False)
-                    pcm = np.frombuffer(data, dtype=np.int16)
-                    result = self.porcupine.process(pcm)
-                    
-                    if result >= 0:
-                        logging.info("🎤 Wakeword detekterat!")
-                        self._handle_voice_command()
+                    if self._pending_reload is not None:
+                        self._apply_reload()
+                        # Grindens inställningar kan också ha ändrats
+                        frame_length = self.porcupine.frame_length
+                        gate = create_activity_gate(frame_length)
+                        stats = WakewordStats(metrics, config.WAKEWORD_STATS_INTERVAL, gate)
+                        verifier, preroll = self._create_verifier()
+                        
+                    if self._followup.is_set():
+                        self._handle_followup(stream, gate.noise_floor_dbfs if gate else None)
+                        stream.discard()
+                        if preroll is not None:
+                            preroll.clear()
+                        continue
+            
+                    pcm = stream.read(frame_length)
+                    watchdog.progress()
+                    stats.tick()
+                    if preroll is not None:
+                        preroll.write(pcm)
+                    # Porcupine körs bara på ramar med akustisk aktivitet
+                    for frame in (gate.process(pcm) if gate else (pcm,)):
+                        index = self.porcupine.process(frame)
+                        if index >= 0:
+                            if stream.beamformer is not None:
+                                logging.debug(f"Mikrofonarray: {stream.beamformer.describe()}")
+                            if preroll is not None:
+                                accepted = self._verify_wakeword(
+                                    verifier, index, preroll.latest(), None,
+                                    gate.noise_floor_dbfs if gate else None)
+                                preroll.clear()
+                                if not accepted:
+                                    break
+                            self._on_wakeword(index)
+                            # Släng det som buffrats medan kommandot hanterades
+                            stream.discard()
+                            break
                         
                 except Exception as e:
                     logging.error(f"Fel i wakeword-loop: {e}")
-                    time.sleep(0.1)  # Undvik tight loop vid fel
+                    metrics.incr("audio.errors")
+                    if not watchdog.failed(e):
+                        time.sleep(0.1)  # Undvik tight loop vid fel
+                        continue
+                    # Modeller och MQTT behålls; bara ljudenheten öppnas på nytt
+                    stream = self._recover_capture(stream, frame_length)
+                    if stream is None:
+                        break
+                    watchdog.progress()
                     
         except KeyboardInterrupt:
             logging.info("Avbruten av användare")
@@ -262,13 +774,215 @@ class VoiceAssistant:
         finally:
             if stream is not None:
                 try:
-                    stream.stop_stream()
                     stream.close()
                 except Exception as e:
                     logging.error(f"Fel vid stängning av wakeword-ström: {e}")
 
-    def _handle_voice_command(self) -> None:
-        """Hantera detekterat röstkommando."""
+    def _report_listening(self) -> None:
+        """Logga att loopen lyssnar och hur lång tid det tog från processstart."""
+        uptime = process_uptime()
+        if uptime is None:
+            logging.info("Lyssnar efter wakeword... (Tryck Ctrl+C för att avsluta)")
+            return
+        metrics.gauge("startup.seconds", uptime)
+        logging.info(f"Lyssnar efter wakeword, {uptime:.1f} s efter start... (Tryck Ctrl+C för att avsluta)")
+
+    def _recover_capture(self, stream, frame_length: int):
+        """
+        Stäng en hängd wakeword-ström och öppna ljudenheten på nytt.
+        
+        Returns:
+            Ny CaptureStream, eller None om applikationen stoppas under tiden
+        """
+        logging.warning("⚠ Ljudinspelningen svarar inte, återställer ljudenheten...")
+        metrics.incr("audio.recoveries")
+        try:
+            stream.close()
+        except Exception as e:
+            logging.debug(f"Fel vid stängning av hängd ström: {e}")
+        return self.audio.recover_capture(
+            frame_length, lambda: self.running, config.AUDIO_RECOVERY_MAX_BACKOFF)
+
+    def _listen_pipeline(self) -> None:
+        """Huvudloop i flerprocessläge: vänta på wakeword-händelser från capture-processen."""
+        self._report_listening()
+        verifier = create_wakeword_verifier()
+        try:
+            while self.running:
+                try:
+                    if self._pending_reload is not None:
+                        self._apply_reload()
+                        verifier = create_wakeword_verifier()
+                    if self._followup.is_set():
+                        self._handle_followup()
+                        self._discard_wake_events()
+                        continue
+                    event = self.pipeline.next_event(timeout=0.1)
+                    if event is None:
+                        continue
+                    if event[0] == "wake":
+                        if verifier is not None:
+                            # Ljudet före träffen finns kvar i capture-ringen
+                            start = max(0, event[2] - verifier.samples)
+                            count = event[2] - start
+                            audio = self.pipeline.capture_ring.read(start, count)
+                            if not self._verify_wakeword(verifier, event[1], audio, (start, count)):
+                                continue
+                        self._on_wakeword(event[1])
+                        # Träffar under kommandot (t.ex. i eget svar) gäller inte längre
+                        self._discard_wake_events()
+                    elif event[0] == "error":
+                        logging.error(f"Fel i {event[1]}-processen: {event[2]}")
+                except Exception as e:
+                    logging.error(f"Fel i wakeword-loop: {e}")
+                    metrics.incr("audio.errors")
+                    time.sleep(0.1)  # Undvik tight loop vid fel
+        except KeyboardInterrupt:
+            logging.info("Avbruten av användare")
+
+    def _discard_wake_events(self) -> None:
+        """Släng wakeword-händelser som köats medan ett kommando hanterades."""
+        discarded = self.pipeline.discard_wake_events()
+        if discarded:
+            logging.debug(f"Slängde {discarded} gamla wakeword-händelser")
+            metrics.incr("wakeword.stale", discarded)
+
+    def _create_verifier(self) -> Tuple[Optional[WakewordVerifier], Optional[PrerollBuffer]]:
+        """Verifierare och buffert för ljudet före träffen (trådat läge), eller (None, None)."""
+        verifier = create_wakeword_verifier()
+        if verifier is None:
+            return None, None
+        return verifier, PrerollBuffer(verifier.seconds, config.SAMPLE_RATE)
+
+    def _verify_wakeword(self, verifier: WakewordVerifier, index: int, audio: np.ndarray,
+                         segment: Optional[Tuple[int, int]],
+                         noise_floor_dbfs: Optional[float] = None) -> bool:
+        """
+        Kontrollera en wakeword-träff innan kommandot startas.
+        
+        Args:
+            verifier: Andra stegets kontroll
+            index: Ordets index i registret
+            audio: Ljudet före träffen
+            segment: (start, antal) i capture-ringen eller None
+            noise_floor_dbfs: Brusgolv skattat av wakeword-grinden (None = okänt)
+            
+        Returns:
+            True om träffen godkändes
+        """
+        keyword = self.wakewords[index]
+        accepted, reason = verifier.verify(
+            audio, keyword.phrase,
+            lambda grammar: self._transcribe(audio, segment, grammar=grammar),
+            noise_floor_dbfs)
+        if accepted:
+            return True
+        logging.info(f"🚫 Wakeword '{keyword.name}' underkänt: {reason}")
+        metrics.incr(f"wakeword.{keyword.name}.rejected")
+        self._archive(audio, {"wakeword": keyword.name, "rejected": reason}, {})
+        return False
+
+    def _on_wakeword(self, index: int) -> None:
+        """Routa ett detekterat wakeword till dess åtgärd."""
+        keyword = self.wakewords[index]
+        logging.info(f"🎤 Wakeword '{keyword.name}' detekterat!")
+        metrics.incr(f"wakeword.{keyword.name}")
+        
+        if keyword.action == "command":
+            self._handle_voice_command(keyword.topic or config.MQTT_TOPIC_COMMANDS, keyword.name)
+        elif keyword.action == "event":
+            self.mqtt.publish_json(keyword.topic, {"wakeword": keyword.name, "timestamp": time.time()})
+        else:
+            self._run_local_intent(Intent(keyword.name, [], keyword.action, keyword.response))
+
+    def _record_command(self) -> Tuple[np.ndarray, Optional[Tuple[int, int]]]:
+        """
+        Spela in användarens kommando.
+        
+        Returns:
+            Tuple (ljud, segment i capture-ringen eller None i trådat läge)
+        """
+        if self.pipeline:
+            return self.pipeline.record(config.RECORD_SECONDS_AFTER_WAKE)
+        return self.audio.record(config.RECORD_SECONDS_AFTER_WAKE, dsp=self.dsp), None
+
+    def _transcribe(self, audio: np.ndarray, segment: Optional[Tuple[int, int]] = None,
+                    grammar: Optional[str] = None) -> dict:
+        """
+        Transkribera inspelat ljud med Vosk.
+        
+        Args:
+            audio: Inspelat ljud
+            segment: (start, antal) i capture-ringen; avkodas då i STT-processen
+            grammar: Vosk-grammatik (JSON-lista med fraser) för begränsad avkodning
+            
+        Returns:
+            Vosk-resultat som dict
+        """
+        # Under CPU-brist hoppar guvernören över omavkodningen med stora modellen
+        fast_only = bool(self.governor and self.governor.level)
+        if self.pipeline and segment is not None:
+            return self.pipeline.transcribe(*segment, grammar=grammar, fast_only=fast_only)
+            
+        # Avkodningen körs i wakeword-tråden men på STT-kärnorna
+        with self.cpu_layout.pinned(self.cpu_layout.stt):
+            return self.stt.transcribe(audio, grammar=grammar, fast_only=fast_only)
+
+    def _match_local_intent(self, audio: np.ndarray,
+                            segment: Optional[Tuple[int, int]]) -> Optional[Intent]:
+        """Avkoda med intent-grammatiken och returnera matchande intent."""
+        start = time.perf_counter()
+        result = self._transcribe(audio, segment, grammar=self.intents.grammar())
+        intent = self.intents.match(result, min_confidence=config.INTENT_MIN_CONFIDENCE)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if intent:
+            logging.info(f"⚡ Lokal intent '{intent.name}' ({elapsed_ms:.0f} ms): '{result.get('text', '')}'")
+        else:
+            logging.debug(f"Ingen lokal intent ({elapsed_ms:.0f} ms): '{result.get('text', '')}'")
+        return intent
+
+    def _run_local_intent(self, intent: Intent) -> None:
+        """Kör en lokal intents åtgärd och läs upp svaret."""
+        response = self._intent_actions[intent.action](intent)
+        if response is None:
+            response = intent.response
+            
+        if response:
+            self._speak(response, cache=True)
+        else:
+            self.audio.play_wav("audio_feedback/end_listen.wav")
+
+    def _intent_stop(self, intent: Intent) -> None:
+        """Avbryt pågående uppläsning och töm kön."""
+        if self.speech:
+            self.speech.clear()
+        self._followup.clear()
+        self.audio.stop_playback()
+
+    def _intent_volume_up(self, intent: Intent) -> None:
+        """Höj uppspelningsvolymen ett steg."""
+        self.audio.set_volume(self.audio.volume + config.VOLUME_STEP)
+
+    def _intent_volume_down(self, intent: Intent) -> None:
+        """Sänk uppspelningsvolymen ett steg."""
+        self.audio.set_volume(self.audio.volume - config.VOLUME_STEP)
+
+    def _intent_time(self, intent: Intent) -> str:
+        """Svara med aktuell tid."""
+        now = datetime.now()
+        if now.minute == 0:
+            return f"Klockan är {now.hour}."
+        return f"Klockan är {now.hour} och {now.minute} minuter."
+
+    def _handle_voice_command(self, topic: Optional[str] = None,
+                              wakeword: Optional[str] = None) -> None:
+        """
+        Hantera detekterat röstkommando.
+        
+        Args:
+            topic: MQTT-topic för texten (None = MQTT_TOPIC_COMMANDS)
+            wakeword: Namnet på ordet som startade kommandot
+        """
         try:
             # Ljudsignal: start
             self.audio.play_wav("audio_feedback/start_listen.wav")
@@ -279,48 +993,145 @@ class VoiceAssistant:
 
             # Spela in tal
             logging.info("Spelar in...")
-            audio = self.audio.record(config.RECORD_SECONDS_AFTER_WAKE)
-
-            # STT med Vosk
-            logging.info("Transkriberar...")
-            rec = KaldiRecognizer(self.vosk_model, config.SAMPLE_RATE)
-            rec.SetWords(True)  # Aktivera ordnivå-detaljer för bättre precision
-            rec.AcceptWaveform(audio.tobytes())
-            stt_json = json.loads(rec.Result())
-            text = stt_json.get("text", "").strip()
+            start = time.perf_counter()
+            audio, segment = self._record_command()
+            timings = {"record_ms": round((time.perf_counter() - start) * 1000, 1)}
+            self._last_command = (topic, wakeword)
+            self._process_command(audio, segment, topic, {"wakeword": wakeword} if wakeword else {},
+                                  timings)
             
-            logging.info(f"📝 Transkriberat: '{text}'")
+        except Exception as e:
+            logging.exception(f"Fel vid hantering av röstkommando: {e}")
 
-            # Skicka till n8n via MQTT
-            if text:
-                # Säkerhet: Validera textstorlek
-                if len(text) > config.MAX_TEXT_LENGTH:
-                    logging.warning(f"Text för lång ({len(text)} tecken), klipper av")
-                    text = text[:config.MAX_TEXT_LENGTH]
-                    
-                success = self.mqtt.publish_json(
-                    config.MQTT_TOPIC_COMMANDS,
-                    {"text": text, "timestamp": time.time()}
-                )
-                
-                if success:
-                    logging.info("✓ Kommando skickat till n8n")
-                else:
-                    logging.error("✗ Kunde inte skicka kommando till n8n")
+    def _request_followup(self, session_id: str) -> None:
+        """Begär ett följdfrågefönster (anropas när svaret har spelats upp)."""
+        self._followup_session = session_id
+        self._followup.set()
+
+    def _handle_followup(self, stream=None, noise_floor_dbfs: Optional[float] = None) -> None:
+        """
+        Lyssna efter en följdfråga utan wakeword.
+        
+        Inspelningen startar direkt när tal börjar och slutar när det
+        tystnar (VAD), utan ljudsignal eller fördröjning. Kommandot märks
+        med sessionens ID.
+        
+        Args:
+            stream: Öppen wakeword-ström att läsa från (trådat läge)
+            noise_floor_dbfs: Brusgolv skattat av wakeword-grinden (None = okänt)
+        """
+        self._followup.clear()
+        session_id = self._followup_session
+        try:
+            logging.info(f"💬 Lyssnar efter följdfråga (session {session_id})...")
+            gate = create_endpoint_gate(noise_floor_dbfs)
+            start = time.perf_counter()
+            if self.pipeline:
+                result = self.pipeline.record_utterance(
+                    gate, config.RECORD_SECONDS_AFTER_WAKE, config.FOLLOWUP_TIMEOUT)
+                audio, segment = result if result else (None, None)
             else:
-                logging.info("Ingen text detekterad")
+                audio = stream.record_utterance(
+                    gate, config.RECORD_SECONDS_AFTER_WAKE, config.FOLLOWUP_TIMEOUT)
+                segment = None
+                if audio is not None and self.dsp:
+                    self.dsp.reset()
+                    self.dsp.process(audio, out=audio)
+        
+            if audio is None:
+                logging.info("Ingen följdfråga, sessionen avslutas")
+                return
+            timings = {"record_ms": round((time.perf_counter() - start) * 1000, 1)}
+            metrics.incr("session.followups")
+            topic, wakeword = self._last_command
+            extra = {"session_id": session_id}
+            if wakeword:
+                extra["wakeword"] = wakeword
+            self._process_command(audio, segment, topic, extra, timings)
 
-            # Ljudsignal: slut
-            self.audio.play_wav("audio_feedback/end_listen.wav")
-            
         except Exception as e:
-            logging.exception(f"Fel vid hantering av röstkommando: {e}")
+            logging.exception(f"Fel vid hantering av följdfråga: {e}")
+
+    def _process_command(self, audio: np.ndarray, segment: Optional[Tuple[int, int]],
+                         topic: Optional[str], extra: dict,
+                         timings: Optional[Dict[str, float]] = None) -> None:
+        """
+        Kör lokala intents eller STT på ett inspelat kommando och publicera texten.
+        
+        Args:
+            audio: Inspelat ljud
+            segment: (start, antal) i capture-ringen eller None
+            topic: MQTT-topic för texten (None = MQTT_TOPIC_COMMANDS)
+            extra: Ytterligare fält i det publicerade meddelandet
+            timings: Tidsmätningar hittills (för arkivet)
+        """
+        timings = dict(timings or {})
+        # Snabbväg: vanliga kommandon hanteras lokalt utan n8n
+        if self.intents:
+            start = time.perf_counter()
+            intent = self._match_local_intent(audio, segment)
+            timings["intent_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            if intent:
+                self._archive(audio, {"intent": intent.name, **extra}, timings)
+                self._run_local_intent(intent)
+                return
+
+        # STT med Vosk
+        logging.info("Transkriberar...")
+        start = time.perf_counter()
+        with metrics.timer("stt.total"):
+            stt_json = self._transcribe(audio, segment)
+        timings["stt_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        if self.governor:
+            self.governor.observe("stt", timings["stt_ms"] / 1000, len(audio) / config.SAMPLE_RATE)
+        text = stt_json.get("text", "").strip()
+        self._archive(audio, {"text": text, "stt": stt_json, **extra}, timings)
+        
+        confidence = stt_json.get("confidence")
+        confidence_info = f", konfidens {confidence:.2f}" if confidence is not None else ""
+        logging.info(f"📝 Transkriberat ({stt_json.get('tier', 'full')}{confidence_info}): '{text}'")
+
+        # Skicka till n8n via MQTT
+        if text:
+            # Säkerhet: Validera textstorlek
+            if len(text) > config.MAX_TEXT_LENGTH:
+                logging.warning(f"Text för lång ({len(text)} tecken), klipper av")
+                text = text[:config.MAX_TEXT_LENGTH]
+    
+            payload = {"text": text, "timestamp": time.time(), **extra}
+            success = self.mqtt.publish_json(topic or config.MQTT_TOPIC_COMMANDS, payload)
+
+            if success:
+                logging.info("✓ Kommando skickat till n8n")
+            else:
+                logging.error("✗ Kunde inte skicka kommando till n8n")
+        else:
+            logging.info("Ingen text detekterad")
+
+        # Ljudsignal: slut
+        self.audio.play_wav("audio_feedback/end_listen.wav")
+
+    def _archive(self, audio: np.ndarray, record: dict, timings: Dict[str, float]) -> None:
+        """Köa ett yttrande för arkivering om ARCHIVE_ENABLED (blockerar aldrig)."""
+        if self.archiver:
+            self.archiver.submit(audio, {"timestamp": time.time(), **record, "timings": timings})
 
     def cleanup(self) -> None:
         """Frigör alla resurser på ett säkert sätt."""
         logging.info("Rensar upp resurser...")
         
         self.running = False
+        self.metrics_reporter.stop()
+        
+        # Stäng uppläsningskön
+        if self.speech:
+            self.speech.stop()
+        if self.parallel_tts:
+            self.parallel_tts.shutdown()
+        if self.archiver:
+            self.archiver.stop()
+        if self.governor:
+            self.governor.stop()
         
         # Stäng MQTT
         if self.mqtt:
@@ -330,6 +1141,13 @@ class VoiceAssistant:
             except Exception as e:
                 logging.error(f"Fel vid stängning av MQTT: {e}")
         
+        # Stäng arbetsprocesser
+        if self.pipeline:
+            try:
+                self.pipeline.stop()
+            except Exception as e:
+                logging.error(f"Fel vid stängning av pipeline: {e}")
+        
         # Stäng Porcupine
         if self.porcupine:
             try:
@@ -356,15 +1174,31 @@ def main():
     
     def handle_signal(sig, frame):
         """Hantera signal för graceful shutdown."""
-        logging.info("\n🛑 Avslutar...")
+        # Ingen loggning här: signalhanteraren kan ha avbrutit en tråd som
+        # håller loggkön. Loopen avslutas och main() städar i finally.
         if va:
             va.stop()
-            va.cleanup()
-        sys.exit(0)
+        else:
+            raise KeyboardInterrupt
+
+    def handle_reload(sig, frame):
+        """Ladda om konfigurationen vid SIGHUP."""
+        if va:
+            # Egen tråd: signalhanteraren kan ha avbrutit en tråd som håller loggkön
+            threading.Thread(target=va.request_reload, args=("SIGHUP",), daemon=True).start()
+
+    def handle_profile(sig, frame):
+        """Profilera processen vid SIGUSR1."""
+        if va:
+            threading.Thread(target=va.request_profile, args=("SIGUSR1",), daemon=True).start()
 
     # Registrera signal handlers
     signal.signal(signal.SIGINT, handle_signal)
     signal.signal(signal.SIGTERM, handle_signal)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, handle_reload)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, handle_profile)
     
     try:
         # Starta röstassistent
@@ -374,6 +1208,7 @@ def main():
         
         va = VoiceAssistant()
         va.listen_for_wake()
+        logging.info("🛑 Avslutar...")
         
     except KeyboardInterrupt:
         logging.info("\nAvbruten av användare")
@@ -0,0 +1,230 @@
+"""
+Enkla mätvärden för röstassistenten.
+
+Räknare, mätare (senaste värde) och latensmätningar samlas i ett
+trådsäkert register och loggas periodiskt som en sammanfattning.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Deque, Optional
+
+class Metrics:
+    """Trådsäkert register för räknare och tidsmätningar."""
+
+    def __init__(self, window: int = 500):
+        """
+        Args:
+            window: Antal senaste mätningar per namn som sparas för percentiler
+        """
+        self._window = window
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, float] = {}
+        self._timings: Dict[str, Deque[float]] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        """Öka en räknare."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float) -> None:
+        """Sätt en mätare till ett nytt värde."""
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Registrera en tidsmätning i sekunder."""
+        with self._lock:
+            samples = self._timings.get(name)
+            if samples is None:
+                samples = self._timings[name] = deque(maxlen=self._window)
+            samples.append(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Mät tiden för ett block och registrera den under name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def counter(self, name: str) -> int:
+        """Aktuellt värde för en räknare."""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict:
+        """
+        Ögonblicksbild av alla värden.
+
+        Returns:
+            Dict med "counters", "gauges" och "timings" (antal, medel, p50,
+            p95, max i ms)
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            timings = {name: sorted(samples) for name, samples in self._timings.items() if samples}
+
+        summary = {}
+        for name, ordered in timings.items():
+            n = len(ordered)
+            summary[name] = {
+                "count": n,
+                "mean_ms": round(sum(ordered) / n * 1000, 1),
+                "p50_ms": round(ordered[n // 2] * 1000, 1),
+                "p95_ms": round(ordered[min(n - 1, int(n * 0.95))] * 1000, 1),
+                "max_ms": round(ordered[-1] * 1000, 1),
+            }
+        return {"counters": counters, "gauges": gauges, "timings": summary}
+
+    def summary(self) -> str:
+        """Kompakt textsammanfattning för loggning."""
+        snap = self.snapshot()
+        parts = [f"{name}={value}" for name, value in sorted(snap["counters"].items())]
+        parts += [f"{name}={value:.1f}" for name, value in sorted(snap["gauges"].items())]
+        parts += [f"{name}: p50 {t['p50_ms']:.0f} ms, p95 {t['p95_ms']:.0f} ms (n={t['count']})"
+                  for name, t in sorted(snap["timings"].items())]
+        return "; ".join(parts) if parts else "inga mätvärden"
+
+class ThreadCpuMeter:
+    """Mäter den anropande trådens CPU-andel mellan två anrop."""
+
+    def __init__(self):
+        """Starta mätningen."""
+        self._cpu = time.thread_time()
+        self._wall = time.monotonic()
+
+    def sample(self) -> float:
+        """
+        CPU-andel sedan förra anropet (eller skapandet).
+
+        Returns:
+            Andel av en kärna i procent
+        """
+        cpu, wall = time.thread_time(), time.monotonic()
+        elapsed = wall - self._wall
+        percent = (cpu - self._cpu) / elapsed * 100 if elapsed > 0 else 0.0
+        self._cpu, self._wall = cpu, wall
+        return percent
+
+class WakewordStats:
+    """
+    Periodisk statistik för wakeword-loopen.
+
+    Registrerar trådens CPU-andel och, med aktivitetsgrind, hur stor del
+    av ramarna som aldrig nådde detektorn.
+    """
+
+    def __init__(self, registry: Metrics, interval: float, gate=None):
+        """
+        Args:
+            registry: Register att skriva till
+            interval: Sekunder mellan registreringar (0 = av)
+            gate: audio_utils.ActivityGate eller None
+        """
+        self.registry = registry
+        self.interval = interval
+        self.gate = gate
+        self._cpu = ThreadCpuMeter()
+        self._next = time.monotonic() + interval
+
+    def tick(self) -> None:
+        """Anropas en gång per ram; registrerar när intervallet har gått."""
+        if self.interval <= 0:
+            return
+        now = time.monotonic()
+        if now < self._next:
+            return
+        self._next = now + self.interval
+
+        cpu = self._cpu.sample()
+        self.registry.gauge("wakeword.cpu_percent", cpu)
+        if self.gate is None:
+            logging.debug(f"Wakeword-tråd: {cpu:.1f} % CPU")
+            return
+        frames, skipped = self.gate.take_stats()
+        self.registry.incr("wakeword.frames", frames)
+        self.registry.incr("wakeword.skipped", skipped)
+        skipped_percent = skipped / frames * 100 if frames else 0.0
+        self.registry.gauge("wakeword.skipped_percent", skipped_percent)
+        logging.debug(f"Wakeword-tråd: {cpu:.1f} % CPU, {skipped_percent:.0f} % av ramarna hoppades över")
+
+def process_uptime() -> Optional[float]:
+    """
+    Sekunder sedan processen startade, inklusive interpretatorns uppstart.
+
+    Returns:
+        Tiden i sekunder (10 ms upplösning), eller None utan /proc
+    """
+    try:
+        with open("/proc/self/stat", "r") as f:
+            # Fälten efter processnamnet; starttime är fält 22 i proc(5)
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def process_resources() -> Dict[str, Optional[float]]:
+    """
+    Processens minne, öppna filer och trådar enligt /proc.
+
+    Returns:
+        Dict med "rss_mb", "fds" och "threads" (None utan /proc)
+    """
+    result: Dict[str, Optional[float]] = {"rss_mb": None, "fds": None, "threads": None}
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    result["rss_mb"] = int(line.split()[1]) / 1024
+                elif line.startswith("Threads:"):
+                    result["threads"] = int(line.split()[1])
+        result["fds"] = len(os.listdir("/proc/self/fd"))
+    except (OSError, ValueError, IndexError):
+        pass
+    return result
+
+class MetricsReporter:
+    """Bakgrundstråd som loggar en sammanfattning med jämna mellanrum."""
+
+    def __init__(self, registry: Metrics, interval: float):
+        """
+        Args:
+            registry: Register att rapportera
+            interval: Intervall i sekunder
+        """
+        self.registry = registry
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Starta rapporteringstråden."""
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stoppa rapporteringstråden."""
+        self._stop.set()
+
+    def _run(self) -> None:
+        """Logga sammanfattningen tills stop() anropas."""
+        last = None
+        while not self._stop.wait(self.interval):
+            summary = self.registry.summary()
+            if summary != last:
+                logging.info(f"📊 Mätvärden: {summary}")
+                last = summary
+
+# Processgemensamt register
+metrics = Metrics()
@@ -0,0 +1,386 @@
+"""
+Laddning av modeller för wakeword, STT och TTS samt ljudförbehandlingen
+framför dem.
+
+Tunga bibliotek importeras först i respektive laddningsfunktion, så att
+processer som bara behöver en av modellerna slipper importera de andra.
+"""
+import os
+import glob
+import json
+import time
+import hashlib
+import logging
+import platform
+from typing import Optional
+
+import config
+
+def load_wakewords(settings=config):
+    """
+    Ladda wakeword-registret enligt konfigurationen.
+
+    Med WAKEWORDS_PATH läses registret från JSON-fil, annars används
+    WAKEWORD_PATH som enda ord.
+
+    Args:
+        settings: config eller inställningar från hot_reload.load_config()
+
+    Returns:
+        wakewords.WakewordRegistry
+    """
+    from wakewords import Wakeword, WakewordRegistry
+
+    if settings.WAKEWORDS_PATH:
+        return WakewordRegistry.load(settings.WAKEWORDS_PATH)
+    name = os.path.splitext(os.path.basename(settings.WAKEWORD_PATH))[0]
+    return WakewordRegistry([Wakeword(name, settings.WAKEWORD_PATH, settings.WAKEWORD_SENSITIVITY,
+                                      phrase=settings.WAKEWORD_PHRASE)])
+
+def create_porcupine(wakewords=None, settings=config):
+    """
+    Skapa Porcupine-instans för wakeword-detektering.
+
+    Alla ord i registret delar instansen; process() returnerar ordets
+    index i registret.
+
+    Args:
+        wakewords: WakewordRegistry (None = ladda enligt konfigurationen)
+        settings: config eller inställningar från hot_reload.load_config()
+
+    Returns:
+        pvporcupine.Porcupine
+
+    Raises:
+        ValueError: Om access key saknas
+        FileNotFoundError: Om en wakeword-fil saknas
+    """
+    import pvporcupine
+
+    if not settings.PORCUPINE_ACCESS_KEY:
+        raise ValueError("PORCUPINE_ACCESS_KEY saknas (kör setup_wizard.py eller sätt .env)")
+    if wakewords is None:
+        wakewords = load_wakewords(settings)
+    wakewords.validate()
+
+    return pvporcupine.create(
+        access_key=settings.PORCUPINE_ACCESS_KEY,
+        keyword_paths=wakewords.paths,
+        sensitivities=wakewords.sensitivities
+    )
+
+def load_vosk_model(path: str):
+    """
+    Ladda Vosk-modell från katalog.
+
+    Args:
+        path: Sökväg till Vosk-modellkatalog
+
+    Returns:
+        vosk.Model
+
+    Raises:
+        FileNotFoundError: Om katalogen inte finns
+    """
+    from vosk import Model
+
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"Vosk-modellen hittas inte: {path}")
+    return Model(path)
+
+def create_speech_recognizer(settings=config):
+    """
+    Skapa taligenkännare enligt konfigurationen.
+
+    Med VOSK_FAST_MODEL_PATH laddas även en liten modell som provas först
+    (tvånivå-STT).
+
+    Args:
+        settings: config eller inställningar från hot_reload.load_config()
+
+    Returns:
+        stt.SpeechRecognizer
+    """
+    from stt import SpeechRecognizer
+
+    model = load_vosk_model(settings.VOSK_MODEL_PATH)
+    fast_model = None
+    if settings.VOSK_FAST_MODEL_PATH:
+        fast_model = load_vosk_model(settings.VOSK_FAST_MODEL_PATH)
+        logging.info(f"Tvånivå-STT: {settings.VOSK_FAST_MODEL_PATH} först, "
+                     f"{settings.VOSK_MODEL_PATH} under konfidens {settings.STT_CONFIDENCE_THRESHOLD}")
+    return SpeechRecognizer(
+        model,
+        settings.SAMPLE_RATE,
+        fast_model=fast_model,
+        confidence_threshold=settings.STT_CONFIDENCE_THRESHOLD
+    )
+
+def create_capture_dsp(settings=config):
+    """
+    Skapa DSP-kedjan för inspelat ljud enligt konfigurationen.
+
+    Args:
+        settings: config eller inställningar från hot_reload.load_config()
+
+    Returns:
+        audio_utils.CaptureDSP, eller None om alla steg är avslagna
+    """
+    from audio_utils import CaptureDSP
+
+    dsp = CaptureDSP(
+        settings.SAMPLE_RATE,
+        highpass_hz=settings.DSP_HIGHPASS_HZ,
+        agc=settings.DSP_AGC,
+        agc_target_dbfs=settings.DSP_AGC_TARGET_DBFS,
+        agc_max_gain_db=settings.DSP_AGC_MAX_GAIN_DB,
+        noise_suppression=settings.DSP_NOISE_SUPPRESSION,
+        noise_floor_db=settings.DSP_NOISE_FLOOR_DB
+    )
+    return dsp if dsp.enabled else None
+
+def create_activity_gate(frame_length: int):
+    """
+    Skapa aktivitetsgrinden framför wakeword-detektorn enligt konfigurationen.
+
+    Args:
+        frame_length: Detektorns ramlängd i samples
+
+    Returns:
+        audio_utils.ActivityGate, eller None om grinden är avslagen
+    """
+    from audio_utils import ActivityGate
+
+    if not config.WAKEWORD_GATE:
+        return None
+    return ActivityGate(
+        config.SAMPLE_RATE,
+        frame_length,
+        threshold_db=config.WAKEWORD_GATE_THRESHOLD_DB,
+        lookback_ms=config.WAKEWORD_GATE_LOOKBACK_MS,
+        hangover_ms=config.WAKEWORD_GATE_HANGOVER_MS,
+        noise_floor_dbfs=config.AUDIO_NOISE_FLOOR_DBFS
+    )
+
+def create_wakeword_verifier():
+    """
+    Skapa andra stegets kontroll av wakeword-träffar enligt konfigurationen.
+
+    Kontrollen kräver den snabba Vosk-modellen: stora modeller har statisk
+    graf och ignorerar grammatiken, så varje träff skulle ge en fri
+    avkodning i wakeword-loopen.
+
+    Returns:
+        wake_verify.WakewordVerifier, eller None om kontrollen är avslagen
+    """
+    from wake_verify import WakewordVerifier
+
+    if not config.WAKEWORD_VERIFY:
+        return None
+    if not config.VOSK_FAST_MODEL_PATH:
+        logging.warning("WAKEWORD_VERIFY kräver VOSK_FAST_MODEL_PATH (en liten modell med "
+                        "grammatikstöd), wakeword-verifieringen är avslagen")
+        return None
+    return WakewordVerifier(
+        config.SAMPLE_RATE,
+        seconds=config.WAKEWORD_VERIFY_SECONDS,
+        min_confidence=config.WAKEWORD_VERIFY_MIN_CONFIDENCE,
+        margin_db=config.WAKEWORD_VERIFY_MARGIN_DB,
+        min_active_ms=config.WAKEWORD_VERIFY_MIN_ACTIVE_MS
+    )
+
+def create_endpoint_gate(noise_floor_dbfs: Optional[float] = None):
+    """
+    Skapa en aktivitetsgrind för VAD-slutpunkt i följdfrågor.
+
+    Args:
+        noise_floor_dbfs: Startvärde för brusgolvet (None = AUDIO_NOISE_FLOOR_DBFS
+            eller första ramens nivå)
+
+    Returns:
+        audio_utils.ActivityGate med 32 ms ramar
+    """
+    from audio_utils import ActivityGate
+
+    return ActivityGate(
+        config.SAMPLE_RATE,
+        config.SAMPLE_RATE * 32 // 1000,
+        threshold_db=config.WAKEWORD_GATE_THRESHOLD_DB,
+        lookback_ms=300,
+        hangover_ms=config.FOLLOWUP_SILENCE_MS,
+        noise_floor_dbfs=noise_floor_dbfs if noise_floor_dbfs is not None else config.AUDIO_NOISE_FLOOR_DBFS
+    )
+
+def find_piper_model(path: str) -> str:
+    """
+    Hitta Piper .onnx-fil från fil- eller katalogsökväg.
+
+    Args:
+        path: Sökväg till .onnx-fil eller katalog som innehåller en
+
+    Returns:
+        Sökväg till .onnx-filen
+
+    Raises:
+        FileNotFoundError: Om ingen modell hittas
+    """
+    if os.path.isfile(path):
+        # Direct path to .onnx file
+        return path
+
+    if os.path.isdir(path):
+        # Directory path - find the .onnx file
+        onnx_files = sorted(glob.glob(os.path.join(path, "*.onnx")))
+        if onnx_files:
+            logging.info(f"Hittade Piper-modell: {os.path.basename(onnx_files[0])}")
+            return onnx_files[0]
+        raise FileNotFoundError(
+            f"Ingen .onnx-fil hittades i katalogen: {path}\n"
+            f"Ladda ner en Piper-modell från https://github.com/rhasspy/piper#voices"
+        )
+
+    raise FileNotFoundError(
+        f"Piper-modellen hittas inte: {path}\n"
+        f"Ange antingen en sökväg till en .onnx-fil eller en katalog som innehåller en."
+    )
+
+_GRAPH_OPTIMIZATION_LEVELS = {
+    "disabled": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+def _file_digest(path: str) -> str:
+    """Beräkna SHA-256 för en fil i block."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def piper_options_from_config(settings=config) -> dict:
+    """Samla ONNX Runtime-inställningar för Piper från settings."""
+    return {
+        "intra_op_threads": settings.ORT_INTRA_OP_THREADS,
+        "inter_op_threads": settings.ORT_INTER_OP_THREADS,
+        "optimization_level": settings.ORT_GRAPH_OPTIMIZATION,
+        "enable_mem_arena": settings.ORT_ENABLE_CPU_MEM_ARENA,
+        "enable_mem_pattern": settings.ORT_ENABLE_MEM_PATTERN,
+        "cache_dir": settings.PIPER_CACHE_DIR or None,
+    }
+
+def load_fallback_piper_voice():
+    """
+    Ladda den snabba Piper-röst som kvalitetsguvernören byter till under CPU-brist.
+
+    Returns:
+        piper.PiperVoice, eller None om GOVERNOR_PIPER_MODEL_PATH inte är satt
+    """
+    if not (config.GOVERNOR_ENABLED and config.GOVERNOR_PIPER_MODEL_PATH):
+        return None
+    voice = load_piper_voice(config.GOVERNOR_PIPER_MODEL_PATH, **piper_options_from_config())
+    logging.info(f"Snabb röst för CPU-brist: {config.GOVERNOR_PIPER_MODEL_PATH}")
+    return voice
+
+def load_piper_voice(path: str, intra_op_threads: int = 0, inter_op_threads: int = 0,
+                     optimization_level: str = "all", enable_mem_arena: bool = True,
+                     enable_mem_pattern: bool = True, cache_dir: Optional[str] = None):
+    """
+    Ladda Piper-röst med egen ONNX Runtime-session.
+
+    Med cache_dir sparas den optimerade grafen första gången, nycklad på
+    modellfilens hash, ONNX Runtime-version och optimeringsnivå. Senare
+    starter laddar den färdiga grafen och hoppar över optimeringen.
+
+    Args:
+        path: Sökväg till .onnx-fil eller katalog som innehåller en
+        intra_op_threads: Max antal intra-op-trådar (0 = ONNX Runtime standard)
+        inter_op_threads: Max antal inter-op-trådar (0 = ONNX Runtime standard)
+        optimization_level: Grafoptimering: disabled, basic, extended eller all
+        enable_mem_arena: Använd ONNX Runtimes minnesarena för CPU
+        enable_mem_pattern: Förplanera minnesallokeringar per körning
+        cache_dir: Katalog för optimerade grafer (None = ingen cache)
+
+    Returns:
+        piper.PiperVoice
+
+    Raises:
+        ValueError: Om optimeringsnivån är okänd
+    """
+    import onnxruntime
+    from piper import PiperVoice
+    from piper.config import PiperConfig
+
+    if optimization_level not in _GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"Okänd grafoptimering: {optimization_level}")
+
+    start = time.perf_counter()
+    model_file = find_piper_model(path)
+    with open(f"{model_file}.json", "r", encoding="utf-8") as f:
+        piper_config = PiperConfig.from_dict(json.load(f))
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = getattr(
+        onnxruntime.GraphOptimizationLevel, _GRAPH_OPTIMIZATION_LEVELS[optimization_level])
+    if intra_op_threads > 0:
+        options.intra_op_num_threads = intra_op_threads
+    if inter_op_threads > 0:
+        options.inter_op_num_threads = inter_op_threads
+    options.enable_cpu_mem_arena = enable_mem_arena
+    options.enable_mem_pattern = enable_mem_pattern
+
+    session_file = model_file
+    cached_file = None
+    stats_file = None
+    cache_hit = False
+    if cache_dir and optimization_level != "disabled":
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            key = hashlib.sha256("|".join((
+                _file_digest(model_file), onnxruntime.__version__,
+                optimization_level, platform.machine()
+            )).encode()).hexdigest()[:16]
+            stem = os.path.splitext(os.path.basename(model_file))[0]
+            cached_file = os.path.join(cache_dir, f"{stem}-{key}.onnx")
+            stats_file = f"{cached_file}.stats.json"
+            if os.path.isfile(cached_file):
+                # Grafen är redan optimerad; kör inte optimeringen igen
+                session_file = cached_file
+                options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+                cache_hit = True
+            else:
+                options.optimized_model_filepath = f"{cached_file}.tmp"
+        except OSError as e:
+            logging.warning(f"Piper-cache otillgänglig ({cache_dir}): {e}")
+            cached_file = None
+
+    session = onnxruntime.InferenceSession(
+        session_file,
+        sess_options=options,
+        providers=["CPUExecutionProvider"]
+    )
+    load_ms = (time.perf_counter() - start) * 1000
+
+    if cached_file and not cache_hit:
+        try:
+            os.replace(f"{cached_file}.tmp", cached_file)
+            with open(stats_file, "w", encoding="utf-8") as f:
+                json.dump({"uncached_load_ms": round(load_ms, 1)}, f)
+            logging.info(f"Optimerad Piper-graf sparad: {cached_file}")
+        except OSError as e:
+            logging.warning(f"Kunde inte spara optimerad Piper-graf: {e}")
+
+    if cache_hit:
+        try:
+            with open(stats_file, "r", encoding="utf-8") as f:
+                uncached = json.load(f).get("uncached_load_ms")
+            logging.info(f"Piper-session skapad på {load_ms:.0f} ms från cache "
+                         f"(utan cache: {uncached:.0f} ms)")
+        except (OSError, ValueError, TypeError):
+            logging.info(f"Piper-session skapad på {load_ms:.0f} ms från cache")
+    else:
+        logging.info(f"Piper-session skapad på {load_ms:.0f} ms "
+                     f"(optimering: {optimization_level}, cache: {'ny' if cached_file else 'av'})")
+
+    return PiperVoice(session=session, config=piper_config)
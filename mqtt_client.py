@@ -51,6 +51,10 @@ class MqttClient:
         self.max_payload_size = max_payload_size
         self._connected = False
         self._loop_started = False
+        # Prenumerationer läggs upp igen efter återanslutning (clean session)
+        self._subscriptions: Dict[str, int] = {}
+        self._has_connected = False
+        self.reconnects = 0
 
         self._client = mqtt.Client(client_id=self.client_id, clean_session=True, 
                                    userdata=None, protocol=mqtt.MQTTv311)
@@ -68,6 +72,11 @@ class MqttClient:
         if rc == 0:
             self._connected = True
             logging.info("MQTT ansluten")
+            if self._has_connected:
+                self.reconnects += 1
+            self._has_connected = True
+            for topic, qos in list(self._subscriptions.items()):
+                client.subscribe(topic, qos=qos)
         else:
             logging.error(f"MQTT anslutning misslyckades med kod: {rc}")
 
@@ -301,6 +310,8 @@ class MqttClient:
         """
         Prenumerera på MQTT topic.
         
+        Prenumerationen läggs upp igen automatiskt efter återanslutning.
+        
         Args:
             topic: MQTT topic att prenumerera på
             qos: Quality of Service (0-2)
@@ -308,6 +319,7 @@ class MqttClient:
         Returns:
             True om prenumeration lyckades
         """
+        self._subscriptions[topic] = qos
         try:
             result, mid = self._client.subscribe(topic, qos=qos)
             if result == mqtt.MQTT_ERR_SUCCESS:
@@ -320,6 +332,28 @@ class MqttClient:
             logging.exception(f"Fel vid MQTT prenumeration: {e}")
             return False
     
+    def unsubscribe(self, topic: str) -> bool:
+        """
+        Avsluta prenumeration på MQTT topic.
+        
+        Args:
+            topic: MQTT topic
+            
+        Returns:
+            True om begäran skickades
+        """
+        self._subscriptions.pop(topic, None)
+        try:
+            result, mid = self._client.unsubscribe(topic)
+            if result == mqtt.MQTT_ERR_SUCCESS:
+                logging.info(f"Avslutar prenumeration på MQTT topic: {topic}")
+                return True
+            logging.error(f"MQTT avprenumeration misslyckades: rc={result}")
+            return False
+        except Exception as e:
+            logging.exception(f"Fel vid MQTT avprenumeration: {e}")
+            return False
+    
     @property
     def is_connected(self) -> bool:
         """Returnera om klienten är ansluten."""
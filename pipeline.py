@@ -0,0 +1,624 @@
+"""
+Flerprocess-pipeline för röstassistenten.
+
+Wakeword-detektering, STT och TTS körs i separata processer så att tung
+syntes eller avkodning inte kan svälta wakeword-loopen (GIL). Ljud delas
+via ringbuffertar i delat minne (int16-vyer utan kopiering) och
+styrmeddelanden skickas via köer.
+"""
+import time
+import queue
+import logging
+import itertools
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from typing import Optional, Tuple, Any
+
+import numpy as np
+
+import config
+
+class PipelineError(Exception):
+    """Bas exception för pipeline-relaterade fel."""
+    pass
+
+class SharedAudioRing:
+    """
+    Ringbuffert för int16-ljud i delat minne.
+
+    En skrivare och valfritt antal läsare. Positioner är absoluta
+    sampleräknare, så läsare kan adressera ljud som skrevs tidigare så
+    länge det inte hunnit skrivas över. Med blockerande skrivning väntar
+    skrivaren på att läsaren flyttat fram läspositionen (flödeskontroll).
+    """
+
+    _HEADER = 2  # [skrivposition, läsposition] som int64
+
+    def __init__(self, shm: shared_memory.SharedMemory, capacity: int, owner: bool):
+        self._shm = shm
+        self._owner = owner
+        self.capacity = capacity
+        self._header = np.ndarray((self._HEADER,), dtype=np.int64, buffer=shm.buf)
+        self._data = np.ndarray((capacity,), dtype=np.int16, buffer=shm.buf,
+                                offset=self._HEADER * 8)
+
+    @classmethod
+    def create(cls, capacity: int) -> "SharedAudioRing":
+        """
+        Skapa en ny ringbuffert.
+
+        Args:
+            capacity: Kapacitet i samples
+        """
+        if capacity <= 0:
+            raise ValueError(f"Ogiltig kapacitet: {capacity}")
+        shm = shared_memory.SharedMemory(create=True, size=cls._HEADER * 8 + capacity * 2)
+        ring = cls(shm, capacity, owner=True)
+        ring._header[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name: str, capacity: int) -> "SharedAudioRing":
+        """
+        Anslut till en befintlig ringbuffert (från en annan process).
+
+        Args:
+            name: Namn på det delade minnesblocket
+            capacity: Kapacitet i samples
+        """
+        return cls(shared_memory.SharedMemory(name=name), capacity, owner=False)
+
+    @property
+    def name(self) -> str:
+        """Namn på det delade minnesblocket."""
+        return self._shm.name
+
+    @property
+    def write_pos(self) -> int:
+        """Totalt antal skrivna samples."""
+        return int(self._header[0])
+
+    @property
+    def read_pos(self) -> int:
+        """Läsposition för flödeskontrollerad läsning."""
+        return int(self._header[1])
+
+    def advance_read(self, pos: int) -> None:
+        """Flytta fram läspositionen (frigör utrymme för skrivaren)."""
+        self._header[1] = pos
+
+    def write(self, samples: np.ndarray, block: bool = False,
+              timeout: Optional[float] = None) -> int:
+        """
+        Skriv samples till ringen.
+
+        Args:
+            samples: int16-samples
+            block: Vänta på ledigt utrymme i stället för att skriva över
+            timeout: Max väntetid vid blockerande skrivning (None = oändligt)
+
+        Returns:
+            Absolut startposition för de skrivna samplen
+
+        Raises:
+            PipelineError: Om blockerande skrivning får timeout
+        """
+        samples = np.asarray(samples, dtype=np.int16)
+        n = len(samples)
+        if n > self.capacity:
+            raise ValueError(f"Block ({n}) större än ringens kapacitet ({self.capacity})")
+
+        start = self.write_pos
+        if block:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while start + n - self.read_pos > self.capacity:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise PipelineError("Timeout vid skrivning till ljudring")
+                time.sleep(0.002)
+
+        offset = start % self.capacity
+        first = min(n, self.capacity - offset)
+        self._data[offset:offset + first] = samples[:first]
+        if first < n:
+            self._data[:n - first] = samples[first:]
+        # Publicera positionen först när datat är på plats
+        self._header[0] = start + n
+        return start
+
+    def read(self, start: int, count: int) -> np.ndarray:
+        """
+        Läs samples från absolut position.
+
+        Returnerar en vy direkt i det delade minnet när segmentet är
+        sammanhängande, annars en kopia. Vyn är bara giltig tills
+        skrivaren hunnit runt ringen.
+
+        Args:
+            start: Absolut startposition
+            count: Antal samples
+
+        Raises:
+            PipelineError: Om datat redan skrivits över eller inte skrivits än
+        """
+        end = start + count
+        if end > self.write_pos:
+            raise PipelineError(f"Ljud ej tillgängligt än ({end} > {self.write_pos})")
+        self.check_intact(start)
+
+        offset = start % self.capacity
+        if offset + count <= self.capacity:
+            return self._data[offset:offset + count]
+        first = self.capacity - offset
+        return np.concatenate((self._data[offset:], self._data[:count - first]))
+
+    def check_intact(self, start: int) -> None:
+        """
+        Kontrollera att ljudet från start inte har skrivits över.
+
+        Anropas även efter att en vy från read() har använts, eftersom
+        skrivaren kan ha hunnit runt ringen under tiden.
+
+        Raises:
+            PipelineError: Om datat har skrivits över
+        """
+        if self.write_pos - start > self.capacity:
+            raise PipelineError("Ljud har skrivits över i ringen")
+
+    def wait_for(self, pos: int, timeout: Optional[float] = None) -> bool:
+        """
+        Vänta tills ringen innehåller data fram till pos.
+
+        Returns:
+            True om datat finns, False vid timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.write_pos < pos:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def close(self) -> None:
+        """Släpp det delade minnet (och ta bort det om vi äger det)."""
+        # Vyerna måste släppas innan minnesblocket kan stängas
+        self._header = None
+        self._data = None
+        try:
+            self._shm.close()
+            if self._owner:
+                self._shm.unlink()
+        except Exception as e:
+            logging.error(f"Fel vid stängning av ljudring: {e}")
+
+def _worker_logging() -> None:
+    """Konfigurera loggning i en arbetsprocess."""
+    from log_utils import configure_logging
+
+    configure_logging(mp.current_process().name)
+
+def capture_worker(ring_name: str, capacity: int, events: Any, stop: Any) -> None:
+    """
+    Process: läs mikrofonen, skriv till ljudringen och kör Porcupine.
+
+    Skickar ("ready", "capture") när processen är igång och ("wake", keyword_index,
+    position) vid varje detektion.
+    """
+    _worker_logging()
+    from audio_utils import AudioIO, CaptureWatchdog
+    from models import create_porcupine, create_activity_gate
+    from metrics import metrics, MetricsReporter, WakewordStats
+    from scheduling import CpuLayout, apply_policy
+
+    layout = CpuLayout()
+    if layout.enabled:
+        logging.info(f"Capture-process: {apply_policy(layout.wakeword) or 'oförändrad'}")
+
+    ring = SharedAudioRing.attach(ring_name, capacity)
+    audio = None
+    porcupine = None
+    stream = None
+    try:
+        audio = AudioIO(
+            sample_rate=config.SAMPLE_RATE,
+            input_device_index=config.INPUT_DEVICE_INDEX,
+            output_device_index=config.OUTPUT_DEVICE_INDEX,
+            input_rate=config.INPUT_SAMPLE_RATE,
+            output_rate=config.OUTPUT_SAMPLE_RATE,
+            input_channels=config.INPUT_CHANNELS,
+            mic_aperture_m=config.MIC_ARRAY_APERTURE_M,
+            input_device_name=config.INPUT_DEVICE_NAME,
+            read_timeout=config.AUDIO_STALL_TIMEOUT,
+            input_buffer_frames=config.AUDIO_INPUT_BUFFER
+        )
+        porcupine = create_porcupine()
+        frame_length = porcupine.frame_length
+        stream = audio.open_capture(frames_per_buffer=frame_length)
+        gate = create_activity_gate(frame_length)
+        stats = WakewordStats(metrics, config.WAKEWORD_STATS_INTERVAL, gate)
+        watchdog = CaptureWatchdog(config.AUDIO_MAX_ERRORS)
+        MetricsReporter(metrics, config.METRICS_LOG_INTERVAL).start()
+        events.put(("ready", "capture"))
+
+        while not stop.is_set():
+            try:
+                pcm = stream.read(frame_length)
+                watchdog.progress()
+                pos = ring.write(pcm)
+                stats.tick()
+                # Ringen får allt ljud; detektorn bara ramar med aktivitet
+                for frame in (gate.process(pcm) if gate else (pcm,)):
+                    result = porcupine.process(frame)
+                    if result >= 0:
+                        if stream.beamformer is not None:
+                            logging.debug(f"Mikrofonarray: {stream.beamformer.describe()}")
+                        events.put(("wake", result, pos + frame_length))
+                        break
+            except Exception as e:
+                logging.error(f"Fel i capture-process: {e}")
+                metrics.incr("audio.errors")
+                if not watchdog.failed(e):
+                    time.sleep(0.1)
+                    continue
+                # Porcupine och ringen behålls; bara ljudenheten öppnas på nytt
+                logging.warning("⚠ Ljudinspelningen svarar inte, återställer ljudenheten...")
+                metrics.incr("audio.recoveries")
+                try:
+                    stream.close()
+                except Exception as close_error:
+                    logging.debug(f"Fel vid stängning av hängd ström: {close_error}")
+                stream = audio.recover_capture(
+                    frame_length, lambda: not stop.is_set(), config.AUDIO_RECOVERY_MAX_BACKOFF)
+                if stream is None:
+                    break
+                watchdog.progress()
+    except Exception as e:
+        logging.exception(f"Capture-processen kunde inte starta: {e}")
+        events.put(("error", "capture", str(e)))
+    finally:
+        if stream is not None:
+            stream.close()
+        if porcupine is not None:
+            porcupine.delete()
+        if audio is not None:
+            audio.cleanup()
+        ring.close()
+        events.cancel_join_thread()
+
+def stt_worker(ring_name: str, capacity: int, requests: Any, results: Any) -> None:
+    """
+    Process: transkribera segment ur capture-ringen med Vosk.
+
+    Tar emot ("transcribe", req_id, start, count, grammar, fast_only) och
+    svarar med (req_id, stt_dict) eller (req_id, None, felmeddelande). Med
+    grammatik (JSON-lista med fraser) görs en begränsad, snabbare avkodning.
+    """
+    _worker_logging()
+    from models import create_speech_recognizer, create_capture_dsp
+    from metrics import metrics, MetricsReporter
+    from scheduling import CpuLayout, apply_policy
+
+    layout = CpuLayout()
+    if layout.enabled:
+        logging.info(f"STT-process: {apply_policy(layout.stt) or 'oförändrad'}")
+
+    ring = SharedAudioRing.attach(ring_name, capacity)
+    try:
+        recognizer = create_speech_recognizer()
+        dsp = create_capture_dsp()
+        logging.info(f"Ljudförbehandling: {dsp.describe() if dsp else 'av'}")
+        MetricsReporter(metrics, config.METRICS_LOG_INTERVAL).start()
+        results.put(("ready", "stt"))
+        for msg in iter(requests.get, None):
+            _, req_id, start, count, grammar, fast_only = msg
+            try:
+                # Vyn i delat minne skickas direkt till Vosk (eller DSP-kedjan)
+                # utan mellanlagring
+                audio = ring.read(start, count)
+                if dsp is not None:
+                    dsp.reset()
+                    audio = dsp.process(audio)
+                result = recognizer.transcribe(audio, grammar=grammar, fast_only=fast_only)
+                # Hann capture-processen runt ringen under avkodningen fick
+                # Vosk delvis nytt ljud; svara med fel i stället för fel text
+                ring.check_intact(start)
+                results.put((req_id, result))
+            except Exception as e:
+                results.put((req_id, None, str(e)))
+    except Exception as e:
+        logging.exception(f"STT-processen kunde inte starta: {e}")
+        results.put(("error", "stt", str(e)))
+    finally:
+        ring.close()
+        results.cancel_join_thread()
+
+def tts_worker(ring_name: str, capacity: int, requests: Any, results: Any) -> None:
+    """
+    Process: syntetisera text med Piper och skriv PCM till TTS-ringen.
+
+    Tar emot ("synthesize", req_id, text, speaker_id, length_scale, fallback)
+    och svarar med ("chunk", req_id, start, count, sample_rate) per block
+    följt av ("done", req_id) eller ("failed", req_id, felmeddelande). Med
+    fallback används den snabba rösten, om GOVERNOR_PIPER_MODEL_PATH är satt.
+    """
+    _worker_logging()
+    from piper.config import SynthesisConfig
+    from models import load_piper_voice, load_fallback_piper_voice, piper_options_from_config
+    from tts_utils import warm_up
+    from scheduling import CpuLayout, apply_policy
+
+    layout = CpuLayout()
+    if layout.enabled:
+        logging.info(f"TTS-process: {apply_policy(layout.tts) or 'oförändrad'}")
+
+    ring = SharedAudioRing.attach(ring_name, capacity)
+    try:
+        voice = load_piper_voice(config.PIPER_MODEL_PATH, **piper_options_from_config())
+        if config.PIPER_WARMUP:
+            warm_up(voice, config.PIPER_SPEAKER)
+        fallback_voice = load_fallback_piper_voice()
+        results.put(("ready", "tts"))
+        for msg in iter(requests.get, None):
+            _, req_id, text, speaker_id, length_scale, fallback = msg
+            try:
+                if fallback and fallback_voice is not None:
+                    selected, speaker_id = fallback_voice, None
+                else:
+                    selected = voice
+                syn_config = SynthesisConfig(speaker_id=speaker_id, length_scale=length_scale, volume=1.0)
+                for audio_chunk in selected.synthesize(text, syn_config):
+                    pcm = np.frombuffer(audio_chunk.audio_int16_bytes, dtype=np.int16)
+                    # Dela upp så att varje block ryms i ringen
+                    for i in range(0, len(pcm), capacity // 2):
+                        part = pcm[i:i + capacity // 2]
+                        start = ring.write(part, block=True, timeout=30.0)
+                        results.put(("chunk", req_id, start, len(part), audio_chunk.sample_rate))
+                results.put(("done", req_id))
+            except Exception as e:
+                results.put(("failed", req_id, str(e)))
+    except Exception as e:
+        logging.exception(f"TTS-processen kunde inte starta: {e}")
+        results.put(("error", "tts", str(e)))
+    finally:
+        ring.close()
+        results.cancel_join_thread()
+
+class MultiprocessPipeline:
+    """
+    Startar och styr capture/wakeword-, STT- och TTS-processerna.
+
+    Används av VoiceAssistant när PIPELINE_MODE=multiprocess.
+    """
+
+    def __init__(self, capture_seconds: int = 30, tts_seconds: int = 30,
+                 startup_timeout: float = 120.0):
+        """
+        Initialisera pipeline (processerna startas av start()).
+
+        Args:
+            capture_seconds: Capture-ringens längd i sekunder
+            tts_seconds: TTS-ringens längd i sekunder (vid 22.05 kHz)
+            startup_timeout: Max väntetid på att processerna laddat sina modeller
+        """
+        self._ctx = mp.get_context("spawn")
+        self.capture_ring = SharedAudioRing.create(capture_seconds * config.SAMPLE_RATE)
+        self.tts_ring = SharedAudioRing.create(tts_seconds * 22050)
+        self.startup_timeout = startup_timeout
+
+        self._stop = self._ctx.Event()
+        self.events = self._ctx.Queue()
+        self._stt_requests = self._ctx.Queue()
+        self._stt_results = self._ctx.Queue()
+        self._tts_requests = self._ctx.Queue()
+        self._tts_results = self._ctx.Queue()
+        self._stt_lock = threading.Lock()
+        self._tts_lock = threading.Lock()
+        self._req_ids = itertools.count(1)
+        self._processes = []
+
+    def start(self) -> None:
+        """
+        Starta arbetsprocesserna och vänta tills alla är redo.
+
+        Raises:
+            PipelineError: Om någon process inte startar
+        """
+        specs = [
+            ("capture", capture_worker,
+             (self.capture_ring.name, self.capture_ring.capacity, self.events, self._stop),
+             self.events),
+            ("stt", stt_worker,
+             (self.capture_ring.name, self.capture_ring.capacity,
+              self._stt_requests, self._stt_results),
+             self._stt_results),
+            ("tts", tts_worker,
+             (self.tts_ring.name, self.tts_ring.capacity,
+              self._tts_requests, self._tts_results),
+             self._tts_results),
+        ]
+        for name, target, args, _ in specs:
+            proc = self._ctx.Process(target=target, args=args, name=name, daemon=True)
+            proc.start()
+            self._processes.append(proc)
+            logging.info(f"Startade {name}-process (pid {proc.pid})")
+
+        for name, _, _, ready_queue in specs:
+            try:
+                msg = ready_queue.get(timeout=self.startup_timeout)
+            except queue.Empty:
+                raise PipelineError(f"{name}-processen startade inte inom {self.startup_timeout}s")
+            if msg[0] != "ready":
+                raise PipelineError(f"{name}-processen misslyckades: {msg[-1]}")
+
+    def next_event(self, timeout: float = 0.5) -> Optional[Tuple]:
+        """Hämta nästa händelse från capture-processen (None vid timeout)."""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def discard_wake_events(self) -> int:
+        """
+        Släng wakeword-händelser som köats medan ett kommando hanterades.
+
+        Felhändelser loggas i stället för att slängas.
+
+        Returns:
+            Antal slängda händelser
+        """
+        discarded = 0
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                return discarded
+            if event[0] == "wake":
+                discarded += 1
+            elif event[0] == "error":
+                logging.error(f"Fel i {event[1]}-processen: {event[2]}")
+
+    def record(self, seconds: float) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """
+        Hämta de kommande sekunderna ljud ur capture-ringen.
+
+        Args:
+            seconds: Inspelningstid i sekunder
+
+        Returns:
+            Tuple (ljud som vy/kopia ur ringen, (startposition, antal))
+        """
+        count = int(seconds * config.SAMPLE_RATE)
+        start = self.capture_ring.write_pos
+        if not self.capture_ring.wait_for(start + count, timeout=seconds + 5.0):
+            raise PipelineError("Capture-processen levererar inget ljud")
+        return self.capture_ring.read(start, count), (start, count)
+
+    def record_utterance(self, gate: Any, max_seconds: float,
+                         start_timeout: float) -> Optional[Tuple[np.ndarray, Tuple[int, int]]]:
+        """
+        Hämta ett yttrande ur capture-ringen med VAD-slutpunkt.
+
+        Ramarna läses som vyer ur ringen och matas genom gate; ingen kopia
+        görs, utan segmentet avkodas sedan direkt i STT-processen.
+
+        Args:
+            gate: audio_utils.ActivityGate som avgör start och slut
+            max_seconds: Max längd på yttrandet
+            start_timeout: Max väntetid på att tal börjar
+
+        Returns:
+            Tuple (ljud, (startposition, antal)), eller None om inget tal började
+        """
+        frame = gate.frame_length
+        pos = self.capture_ring.write_pos
+        deadline = pos + int(start_timeout * config.SAMPLE_RATE)
+        start = None
+        while True:
+            if not self.capture_ring.wait_for(pos + frame, timeout=5.0):
+                raise PipelineError("Capture-processen levererar inget ljud")
+            frames = gate.process(self.capture_ring.read(pos, frame))
+            pos += frame
+            if start is None:
+                if frames:
+                    start = pos - len(frames) * frame
+                elif pos >= deadline:
+                    return None
+            elif not gate.open or pos - start >= max_seconds * config.SAMPLE_RATE:
+                break
+        count = pos - start
+        return self.capture_ring.read(start, count), (start, count)
+
+    def transcribe(self, start: int, count: int, grammar: Optional[str] = None,
+                   timeout: float = 60.0, fast_only: bool = False) -> dict:
+        """
+        Transkribera ett segment ur capture-ringen i STT-processen.
+
+        Args:
+            start: Absolut startposition i capture-ringen
+            count: Antal samples
+            grammar: Vosk-grammatik för begränsad avkodning (None = fri)
+            timeout: Max väntetid på svar i sekunder
+            fast_only: Bara den snabba modellen (se SpeechRecognizer.transcribe)
+
+        Returns:
+            Vosk-resultat som dict
+
+        Raises:
+            PipelineError: Om avkodningen misslyckas eller inget svar kommer i tid
+        """
+        with self._stt_lock:
+            req_id = next(self._req_ids)
+            self._stt_requests.put(("transcribe", req_id, start, count, grammar, fast_only))
+            while True:
+                try:
+                    msg = self._stt_results.get(timeout=timeout)
+                except queue.Empty:
+                    raise PipelineError(f"STT svarade inte inom {timeout:.0f}s")
+                if msg[0] != req_id:
+                    continue  # Svar på en tidigare, övergiven begäran
+                if msg[1] is None:
+                    raise PipelineError(f"STT misslyckades: {msg[2]}")
+                return msg[1]
+
+    def synthesize(self, text: str, speaker_id: Optional[int] = None,
+                   timeout: float = 60.0, length_scale: float = 1.0,
+                   fallback: bool = False) -> Tuple[np.ndarray, int]:
+        """
+        Syntetisera text i TTS-processen.
+
+        Args:
+            text: Text att läsa upp
+            speaker_id: Piper speaker ID (None = modellens standard)
+            timeout: Max väntetid på varje block i sekunder
+            length_scale: Talhastighet (lägre = snabbare)
+            fallback: Använd den snabba rösten (GOVERNOR_PIPER_MODEL_PATH)
+
+        Returns:
+            Tuple (PCM som int16-array, samplingsfrekvens i Hz)
+
+        Raises:
+            PipelineError: Om syntesen misslyckas eller ett block dröjer för länge
+        """
+        with self._tts_lock:
+            req_id = next(self._req_ids)
+            self._tts_requests.put(("synthesize", req_id, text, speaker_id, length_scale, fallback))
+            parts = []
+            sample_rate = 22050
+            while True:
+                try:
+                    msg = self._tts_results.get(timeout=timeout)
+                except queue.Empty:
+                    raise PipelineError(f"TTS svarade inte inom {timeout:.0f}s")
+                if msg[0] == "chunk":
+                    _, chunk_id, start, count, chunk_rate = msg
+                    if chunk_id == req_id:
+                        # Kopiera ut innan utrymmet frigörs för nästa block
+                        parts.append(self.tts_ring.read(start, count).copy())
+                        sample_rate = chunk_rate
+                    self.tts_ring.advance_read(start + count)
+                    continue
+                if msg[1] != req_id:
+                    continue  # Svar på en tidigare, övergiven begäran
+                if msg[0] == "done":
+                    break
+                else:
+                    raise PipelineError(f"TTS misslyckades: {msg[2]}")
+            pcm = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int16)
+            return pcm, sample_rate
+
+    def stop(self) -> None:
+        """Stoppa arbetsprocesserna och frigör delat minne."""
+        self._stop.set()
+        for q in (self._stt_requests, self._tts_requests):
+            try:
+                q.put(None)
+            except Exception:
+                pass
+        for proc in self._processes:
+            proc.join(timeout=5.0)
+            if proc.is_alive():
+                logging.warning(f"{proc.name}-processen svarar inte, avslutar")
+                proc.terminate()
+        self._processes = []
+        self.capture_ring.close()
+        self.tts_ring.close()
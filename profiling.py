@@ -0,0 +1,205 @@
+"""
+Profilering på begäran av en körande process.
+
+En session samplar stackarna i alla trådar (sys._current_frames) med
+ett fast intervall under en begränsad tid, och tar en tracemalloc-
+ögonblicksbild i början och slutet. cProfile används inte eftersom det
+bara ser tråden där det startas. Utanför en session görs ingenting, så
+det kostar inget när ingen profilerar.
+
+Resultatet sparas komprimerat: stackarna i "folded"-format (en rad per
+unik stack med antal, läsbart av flamegraph.pl och speedscope) och en
+JSON-sammanfattning med de mest samplade funktionerna, CPU-tid per tråd
+och de största minnesökningarna. Sammanfattningen returneras också så
+att den kan publiceras över MQTT.
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+def _thread_cpu_seconds() -> Dict[int, float]:
+    """CPU-tid (user + system) per tråd från /proc, nycklad på native id."""
+    result = {}
+    ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+    try:
+        for task in os.listdir("/proc/self/task"):
+            try:
+                with open(f"/proc/self/task/{task}/stat", "r") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                # utime och stime är fält 14 och 15 i proc(5)
+                result[int(task)] = (int(fields[11]) + int(fields[12])) / ticks
+            except (OSError, ValueError, IndexError):
+                continue
+    except OSError:
+        pass
+    return result
+
+def _frame_label(frame) -> str:
+    """Funktion och plats för en stackram, t.ex. "process (audio_utils.py:458)"."""
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class ProfilingSession:
+    """
+    Tidsbegränsad profilering av alla trådar i processen.
+
+    Användning:
+        session = ProfilingSession(30, "profiles", on_done=publish)
+        session.start()
+    """
+
+    def __init__(self, seconds: float, output_dir: str, interval: float = 0.005,
+                 trace_memory: bool = True, top: int = 15,
+                 on_done: Optional[Callable[[dict], None]] = None):
+        """
+        Args:
+            seconds: Sessionens längd
+            output_dir: Katalog för resultatfilerna
+            interval: Sekunder mellan stacksamplingar
+            trace_memory: Jämför tracemalloc-ögonblicksbilder före och efter
+            top: Antal rader per topplista i sammanfattningen
+            on_done: Anropas med sammanfattningen när sessionen är klar
+        """
+        self.seconds = seconds
+        self.output_dir = output_dir
+        self.interval = interval
+        self.trace_memory = trace_memory
+        self.top = top
+        self.on_done = on_done
+        self._stacks: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        """Om sessionen pågår."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Starta sessionen i en bakgrundstråd."""
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        """Sampla, skriv resultatet och anropa on_done."""
+        try:
+            summary = self.run()
+        except Exception as e:
+            logging.exception(f"Profileringen misslyckades: {e}")
+            summary = {"ok": False, "error": str(e)}
+        if self.on_done is not None:
+            self.on_done(summary)
+
+    def run(self) -> dict:
+        """
+        Kör sessionen i den anropande tråden.
+
+        Returns:
+            Sammanfattning (se modulbeskrivningen) med sökvägarna till filerna
+        """
+        started_tracing = False
+        before = None
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(5)
+                started_tracing = True
+            before = tracemalloc.take_snapshot()
+
+        cpu_before = _thread_cpu_seconds()
+        own = threading.get_ident()
+        samples = 0
+        start = time.perf_counter()
+        deadline = start + self.seconds
+        next_sample = start
+        try:
+            while next_sample < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_label(frame))
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    self._stacks[";".join(reversed(stack))] += 1
+                samples += 1
+                next_sample += self.interval
+                delay = next_sample - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            elapsed = time.perf_counter() - start
+            cpu_after = _thread_cpu_seconds()
+            memory = self._memory_diff(before) if before is not None else []
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+        summary = self._summarize(samples, elapsed, cpu_before, cpu_after, memory)
+        summary["files"] = self._write(summary)
+        logging.info(f"Profilering klar: {samples} samplingar på {elapsed:.1f} s, "
+                     f"sparad i {summary['files'][0]}")
+        return summary
+
+    def _memory_diff(self, before: "tracemalloc.Snapshot") -> List[dict]:
+        """De största minnesökningarna sedan before, per kodrad."""
+        after = tracemalloc.take_snapshot()
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        stats = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+        return [{"where": f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}",
+                 "size_diff_kb": round(s.size_diff / 1024, 1), "count_diff": s.count_diff}
+                for s in stats[:self.top] if s.size_diff > 0]
+
+    def _summarize(self, samples: int, elapsed: float, cpu_before: Dict[int, float],
+                   cpu_after: Dict[int, float], memory: List[dict]) -> dict:
+        """Topplistor över samplade funktioner och CPU-tid per tråd."""
+        own_total: Counter = Counter()
+        cumulative: Counter = Counter()
+        for stack, count in self._stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own_total[frames[-1]] += count
+            for label in set(frames):
+                cumulative[label] += count
+        total = sum(self._stacks.values()) or 1
+
+        threads = []
+        for thread in threading.enumerate():
+            native = getattr(thread, "native_id", None)
+            if native in cpu_after:
+                cpu = cpu_after[native] - cpu_before.get(native, 0.0)
+                threads.append({"thread": thread.name, "cpu_seconds": round(cpu, 2),
+                                "cpu_percent": round(cpu / elapsed * 100, 1)})
+        threads.sort(key=lambda t: -t["cpu_seconds"])
+
+        return {
+            "ok": True,
+            "seconds": round(elapsed, 1),
+            "samples": samples,
+            "threads": threads,
+            "top_self": [{"function": f, "percent": round(n / total * 100, 1)}
+                         for f, n in own_total.most_common(self.top)],
+            "top_cumulative": [{"function": f, "percent": round(n / total * 100, 1)}
+                               for f, n in cumulative.most_common(self.top)],
+            "memory": memory,
+        }
+
+    def _write(self, summary: dict) -> List[str]:
+        """Spara stackarna och sammanfattningen gzip-komprimerade."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        stem = os.path.join(self.output_dir, time.strftime("profile-%Y%m%d-%H%M%S"))
+        folded = f"{stem}.folded.gz"
+        with gzip.open(folded, "wt", encoding="utf-8") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        report = f"{stem}.json.gz"
+        with gzip.open(report, "wt", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        return [folded, report]
@@ -0,0 +1,205 @@
+"""
+CPU-affinitet och schemaläggningsprioritet för pipelinens steg.
+
+Wakeword-tråden kan låsas till en egen kärna med förhöjd prioritet
+(valfritt SCHED_FIFO), medan STT och TTS hålls på övriga kärnor.
+Inställningarna gäller den anropande tråden (Linux), och trådar som
+skapas därefter ärver dem.
+"""
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional, Set, Dict
+
+import config
+
+def parse_cpu_list(spec: str) -> Set[int]:
+    """
+    Tolka en CPU-lista i taskset-format, t.ex. "0", "1-3" eller "0,2-3".
+
+    Args:
+        spec: CPU-lista (tom sträng = ingen begränsning)
+
+    Returns:
+        Mängd med CPU-index (tom mängd = ingen begränsning)
+
+    Raises:
+        ValueError: Om listan är ogiltig
+    """
+    cpus: Set[int] = set()
+    for part in spec.replace(" ", "").split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            if int(first) > int(last):
+                raise ValueError(f"Ogiltigt CPU-intervall: {part}")
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+def format_cpu_list(cpus: Set[int]) -> str:
+    """Formatera en CPU-mängd kompakt, t.ex. {1, 2, 3} -> "1-3"."""
+    if not cpus:
+        return "alla"
+    ranges = []
+    ordered = sorted(cpus)
+    start = prev = ordered[0]
+    for cpu in ordered[1:]:
+        if cpu != prev + 1:
+            ranges.append(f"{start}-{prev}" if start != prev else str(start))
+            start = cpu
+        prev = cpu
+    ranges.append(f"{start}-{prev}" if start != prev else str(start))
+    return ",".join(ranges)
+
+class StagePolicy:
+    """Schemaläggningspolicy för ett pipelinesteg."""
+
+    def __init__(self, name: str, cpus: Set[int], rt_priority: int = 0,
+                 nice: Optional[int] = None):
+        """
+        Args:
+            name: Stegets namn (för loggning)
+            cpus: Tillåtna CPU:er (tom mängd = ingen begränsning)
+            rt_priority: SCHED_FIFO-prioritet 1-99 (0 = vanlig schemaläggning)
+            nice: Nice-värde för tråden (None = oförändrat)
+        """
+        if not 0 <= rt_priority <= 99:
+            raise ValueError(f"Ogiltig realtidsprioritet: {rt_priority}")
+        self.name = name
+        self.cpus = cpus
+        self.rt_priority = rt_priority
+        self.nice = nice
+
+    def describe(self) -> str:
+        """Kort beskrivning för loggning."""
+        parts = [f"cpu={format_cpu_list(self.cpus)}"]
+        if self.rt_priority:
+            parts.append(f"SCHED_FIFO {self.rt_priority}")
+        if self.nice is not None:
+            parts.append(f"nice={self.nice}")
+        return f"{self.name}: " + ", ".join(parts)
+
+def _thread_id() -> int:
+    """Kärnans tråd-ID för anropande tråd (0 = anropande tråd i syscalls)."""
+    return threading.get_native_id() if hasattr(threading, "get_native_id") else 0
+
+def apply_policy(policy: StagePolicy) -> Dict[str, str]:
+    """
+    Tillämpa policy på den anropande tråden.
+
+    Misslyckade delar (t.ex. SCHED_FIFO utan CAP_SYS_NICE) loggas som
+    varningar men avbryter inte.
+
+    Args:
+        policy: Policy att tillämpa
+
+    Returns:
+        Dict med vad som faktiskt tillämpades
+    """
+    applied: Dict[str, str] = {}
+    tid = _thread_id()
+
+    if policy.cpus and hasattr(os, "sched_setaffinity"):
+        try:
+            available = os.sched_getaffinity(0)
+            cpus = policy.cpus & available if available else policy.cpus
+            if not cpus:
+                raise ValueError(f"Inga av CPU:erna {format_cpu_list(policy.cpus)} finns tillgängliga")
+            os.sched_setaffinity(tid, cpus)
+            applied["cpu"] = format_cpu_list(cpus)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Kunde inte sätta CPU-affinitet för {policy.name}: {e}")
+
+    if hasattr(os, "sched_setscheduler"):
+        try:
+            if policy.rt_priority:
+                os.sched_setscheduler(tid, os.SCHED_FIFO, os.sched_param(policy.rt_priority))
+                applied["sched"] = f"SCHED_FIFO {policy.rt_priority}"
+            elif os.sched_getscheduler(tid) != os.SCHED_OTHER:
+                os.sched_setscheduler(tid, os.SCHED_OTHER, os.sched_param(0))
+                applied["sched"] = "SCHED_OTHER"
+        except OSError as e:
+            logging.warning(f"Kunde inte sätta schemaläggning för {policy.name} "
+                            f"(kräver CAP_SYS_NICE): {e}")
+
+    if policy.nice is not None and hasattr(os, "setpriority"):
+        try:
+            os.setpriority(os.PRIO_PROCESS, tid, policy.nice)
+            applied["nice"] = str(policy.nice)
+        except OSError as e:
+            logging.warning(f"Kunde inte sätta nice för {policy.name}: {e}")
+
+    return applied
+
+def current_policy(name: str = "nuvarande") -> StagePolicy:
+    """Läs den anropande trådens nuvarande policy (för återställning)."""
+    tid = _thread_id()
+    cpus: Set[int] = set()
+    rt_priority = 0
+    nice = None
+    try:
+        cpus = set(os.sched_getaffinity(tid))
+        if os.sched_getscheduler(tid) == os.SCHED_FIFO:
+            rt_priority = os.sched_getparam(tid).sched_priority
+        nice = os.getpriority(os.PRIO_PROCESS, tid)
+    except (AttributeError, OSError):
+        pass
+    return StagePolicy(name, cpus, rt_priority, nice)
+
+class CpuLayout:
+    """
+    CPU-layout för wakeword-, STT- och TTS-stegen enligt konfigurationen.
+    """
+
+    def __init__(self):
+        """Läs layouten från config."""
+        self.wakeword = StagePolicy(
+            "wakeword",
+            parse_cpu_list(config.WAKEWORD_CPUS),
+            rt_priority=config.WAKEWORD_RT_PRIORITY,
+            nice=config.WAKEWORD_NICE
+        )
+        self.stt = StagePolicy("stt", parse_cpu_list(config.STT_CPUS))
+        self.tts = StagePolicy("tts", parse_cpu_list(config.TTS_CPUS))
+        self.workers = StagePolicy("workers", self.stt.cpus | self.tts.cpus)
+
+    @property
+    def enabled(self) -> bool:
+        """True om någon del av layouten är konfigurerad."""
+        return bool(self.wakeword.cpus or self.stt.cpus or self.tts.cpus
+                    or self.wakeword.rt_priority or self.wakeword.nice is not None)
+
+    def report(self) -> None:
+        """Logga den konfigurerade layouten."""
+        if not self.enabled:
+            logging.info("CPU-layout: ingen (alla steg delar alla kärnor)")
+            return
+        try:
+            online = format_cpu_list(os.sched_getaffinity(0))
+        except (AttributeError, OSError):
+            online = "okänt"
+        threads = config.ORT_INTRA_OP_THREADS or "standard"
+        logging.info(f"CPU-layout (tillgängliga: {online}, ORT intra-op-trådar: {threads})")
+        for policy in (self.wakeword, self.stt, self.tts):
+            logging.info(f"  {policy.describe()}")
+
+    @contextmanager
+    def pinned(self, policy: StagePolicy):
+        """
+        Kör ett block med en viss policy och återställ sedan den föregående.
+
+        Används t.ex. när wakeword-tråden själv utför STT-avkodningen.
+        """
+        if not self.enabled:
+            yield
+            return
+        previous = current_policy(policy.name)
+        apply_policy(policy)
+        try:
+            yield
+        finally:
+            apply_policy(previous)
@@ -2,11 +2,13 @@
 Setup wizard för rpi-n8n-voice-assistant.
 
 Guidar användaren genom initial konfiguration och skapar .env-fil.
+Med --calibrate mäts ljudvägen på de konfigurerade enheterna och de
+inställda värdena skrivs in i en befintlig .env.
 """
 import os
 import sys
 import pathlib
-from typing import Optional, Callable
+from typing import Dict, Optional, Callable
 
 ENV_FILE = ".env"
 
@@ -97,6 +99,97 @@ def strip_mqtt_protocol(url: str) -> str:
     
     return url
 
+def run_calibration(**audio_options) -> Dict[str, str]:
+    """
+    Mät ljudvägen och returnera rekommenderade .env-värden.
+
+    numpy och PyAudio importeras först här, så att resten av guiden
+    fungerar innan ljudpaketen är installerade.
+
+    Args:
+        audio_options: Argument till audio_utils.AudioIO (enheter, takter)
+
+    Returns:
+        Dict variabelnamn -> värde (tomt om kalibreringen inte kunde köras)
+    """
+    try:
+        from audio_utils import AudioIO
+        from calibration import calibrate
+    except ImportError as e:
+        print(f"⚠️  Kalibrering kräver numpy och PyAudio: {e}")
+        return {}
+
+    try:
+        with AudioIO(**audio_options) as audio:
+            values = calibrate(audio)
+    except Exception as e:
+        print(f"⚠️  Kalibreringen misslyckades: {e}")
+        return {}
+
+    if values:
+        print("\nUppmätta värden:")
+        for key, value in values.items():
+            print(f"  {key}={value}")
+    return values
+
+def update_env_file(path: str, values: Dict[str, str]) -> None:
+    """
+    Skriv in värden i en befintlig .env-fil.
+
+    Rader för variabler som redan finns ersätts på plats; övriga läggs
+    till sist under en egen rubrik. Kommentarer och ordning behålls.
+
+    Args:
+        path: Sökväg till .env
+        values: Variabelnamn -> värde
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+
+    remaining = dict(values)
+    for i, line in enumerate(lines):
+        key = line.split("=", 1)[0].strip()
+        if "=" in line and not line.lstrip().startswith("#") and key in remaining:
+            lines[i] = f"{key}={remaining.pop(key)}"
+    if remaining:
+        lines += ["", "# Audio calibration (setup_wizard.py --calibrate)"]
+        lines += [f"{key}={value}" for key, value in remaining.items()]
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.chmod(path, 0o600)
+
+def calibrate_main() -> None:
+    """Kalibrera ljudet med enheterna i befintlig .env och uppdatera filen."""
+    if not os.path.isfile(ENV_FILE):
+        print(f"❌ {ENV_FILE} saknas; kör setup_wizard.py utan argument först")
+        sys.exit(1)
+    import config
+
+    print("=" * 70)
+    print("  🎚️  Kalibrering av ljud")
+    print("=" * 70)
+    print("Högtalaren och mikrofonen används. Håll rummet tyst under mätningen.\n")
+    values = run_calibration(
+        sample_rate=config.SAMPLE_RATE,
+        input_device_index=config.INPUT_DEVICE_INDEX,
+        output_device_index=config.OUTPUT_DEVICE_INDEX,
+        input_rate=config.INPUT_SAMPLE_RATE,
+        output_rate=config.OUTPUT_SAMPLE_RATE,
+        input_channels=config.INPUT_CHANNELS,
+        mic_aperture_m=config.MIC_ARRAY_APERTURE_M,
+        input_device_name=config.INPUT_DEVICE_NAME,
+        read_timeout=config.AUDIO_STALL_TIMEOUT
+    )
+    if not values:
+        print("❌ Inga värden uppmätta, .env lämnas orörd")
+        sys.exit(1)
+    if ask("Spara värdena i .env? (ja/nej)", "ja").lower() not in ("ja", "j", "yes", "y"):
+        print("Inget sparat")
+        return
+    update_env_file(ENV_FILE, values)
+    print(f"✓ {ENV_FILE} uppdaterad; starta om assistenten för att använda värdena")
+
 def main():
     """Huvudfunktion för setup wizard."""
     print("=" * 70)
@@ -222,6 +315,16 @@ def main():
         error_msg="Måste vara mellan 1 och 60 sekunder"
     )
 
+    calibrated: Dict[str, str] = {}
+    print("\nKalibreringen mäter fördröjningar, buffertstorlek och brusgolv")
+    print("med högtalaren och mikrofonen (tar ungefär en halv minut).")
+    if ask("Kalibrera ljudet nu? (ja/nej)", "nej").lower() in ("ja", "j", "yes", "y"):
+        calibrated = run_calibration(
+            sample_rate=int(sample_rate),
+            input_device_index=int(input_dev) if input_dev.isdigit() else None,
+            output_device_index=int(output_dev) if output_dev.isdigit() else None
+        )
+
     print("\n" + "─" * 70)
     print("📝 Loggning")
     print("─" * 70)
@@ -271,7 +374,10 @@ def main():
             if output_dev:
                 f.write(f"OUTPUT_DEVICE_INDEX={output_dev}\n")
             f.write(f"SAMPLE_RATE={sample_rate}\n")
-            f.write(f"RECORD_SECONDS_AFTER_WAKE={record_seconds}\n\n")
+            f.write(f"RECORD_SECONDS_AFTER_WAKE={record_seconds}\n")
+            for key, value in calibrated.items():
+                f.write(f"{key}={value}\n")
+            f.write("\n")
             
             f.write("# Logging\n")
             f.write(f"LOG_LEVEL={log_level}\n")
@@ -309,7 +415,10 @@ def main():
 
 if __name__ == "__main__":
     try:
-        main()
+        if "--calibrate" in sys.argv[1:]:
+            calibrate_main()
+        else:
+            main()
     except KeyboardInterrupt:
         print("\n\n⚠️  Setup avbruten av användare")
         sys.exit(1)
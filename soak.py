@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+"""
+Långtidstest (soak) av röstassistenten.
+
+Den riktiga VoiceAssistant körs med sina modeller, men mot ett simulerat
+ljudkort och en fake-broker i processen. Ljudkortet levererar bakgrundsbrus
+i realtid och spelar in det assistenten spelar upp. En "n8n" på brokern
+besvarar varje kommando: omväxlande hela svar, strömmade fragment och svar
+som väntar på en följdfråga. Varje interaktion går genom samma kod som i
+drift: wakeword-loop, inspelning, Vosk, MQTT, Piper och uppspelning.
+
+Kommandona är Piper-syntes av några fraser, eller egna WAV-filer med
+--command-wav. Med --wake-wav avgör Porcupine själv om wakewordet hörs.
+Utan den triggas detektorn när en kort ljudstöt har öppnat aktivitetsgrinden.
+
+Med jämna mellanrum loggas RSS, öppna filer, trådar och latens per steg.
+Efter uppvärmningen anpassas en rät linje till varje serie, och serier
+som växer linjärt flaggas.
+
+Flerprocessläget stöds inte, eftersom ljudkortet bara simuleras i denna
+process.
+
+Användning:
+    python soak.py [--hours 4] [--interval 60] [--warmup 10] [--csv soak.csv]
+                   [--wake-wav wake.wav] [--command-wav cmd.wav ...]
+"""
+import csv
+import json
+import time
+import logging
+import argparse
+import threading
+from typing import Callable, List, Optional, Tuple
+from unittest import mock
+
+import numpy as np
+import pyaudio
+import soundfile as sf
+
+import config
+from audio_utils import resample
+from fake_broker import FakeBroker
+from metrics import metrics, process_resources
+
+PHRASES = (
+    "tänd lampan i köket",
+    "vad blir det för väder i morgon",
+    "spela lite musik i vardagsrummet",
+    "påminn mig om mötet klockan tre",
+)
+
+# Serier som övervakas och minsta tillväxt per timme som räknas som en trend
+TREND_LIMITS = {
+    "rss_mb": 1.0,
+    "fds": 0.5,
+    "threads": 0.5,
+    "command_ms": 50.0,
+    "stt_ms": 20.0,
+    "tts_ms": 20.0,
+    "queue_to_play_ms": 20.0,
+}
+TREND_MIN_R2 = 0.6
+TREND_MIN_SAMPLES = 6
+
+class FakeMicrophone:
+    """
+    Simulerad mikrofon med en gemensam tidslinje.
+
+    Alla öppna inspelningsströmmar läser samma tidslinje: bakgrundsbrus
+    plus klipp som har lagts in på givna positioner.
+    """
+
+    def __init__(self, sample_rate: int, noise_dbfs: float = -60.0):
+        """
+        Args:
+            sample_rate: Mikrofonens samplingsfrekvens i Hz
+            noise_dbfs: Bakgrundsbrusets nivå
+        """
+        self.sample_rate = sample_rate
+        rng = np.random.default_rng(0)
+        self._noise = (rng.standard_normal(sample_rate) * 32768 * 10 ** (noise_dbfs / 20)).astype(np.int16)
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._clips: List[Tuple[int, np.ndarray]] = []
+        self._armed: Optional[Tuple[np.ndarray, float]] = None
+
+    def now(self) -> int:
+        """Nuvarande position på tidslinjen i samples."""
+        return int((time.monotonic() - self._start) * self.sample_rate)
+
+    def play(self, clip: np.ndarray, at: Optional[int] = None) -> None:
+        """Lägg in ett klipp på tidslinjen (None = nu)."""
+        with self._lock:
+            self._clips.append((self.now() if at is None else at, clip))
+
+    def arm(self, clip: np.ndarray, delay: float) -> None:
+        """Spela klippet delay sekunder efter att nästa ström har öppnats."""
+        with self._lock:
+            self._armed = (clip, delay)
+
+    def disarm(self) -> None:
+        """Glöm ett klipp som väntar på nästa ström."""
+        with self._lock:
+            self._armed = None
+
+    def stream_opened(self) -> None:
+        """Anropas när en inspelningsström öppnas."""
+        with self._lock:
+            armed, self._armed = self._armed, None
+        if armed is not None:
+            self.play(armed[0], self.now() + int(armed[1] * self.sample_rate))
+
+    def render(self, start: int, count: int) -> np.ndarray:
+        """Ljudet på tidslinjen från start och count samples framåt."""
+        index = (np.arange(start, start + count) % len(self._noise))
+        block = self._noise[index].astype(np.int32)
+        with self._lock:
+            self._clips = [(at, clip) for at, clip in self._clips if at + len(clip) > start - self.sample_rate]
+            clips = list(self._clips)
+        for at, clip in clips:
+            lo, hi = max(start, at), min(start + count, at + len(clip))
+            if lo < hi:
+                block[lo - start:hi - start] += clip[lo - at:hi - at]
+        return np.clip(block, -32768, 32767).astype(np.int16)
+
+class FakeInputStream:
+    """PyAudio-inspelningsström i callback-läge som läser från FakeMicrophone i realtid."""
+
+    def __init__(self, microphone: FakeMicrophone, channels: int, frames: int, callback: Callable):
+        self._microphone = microphone
+        self._channels = channels
+        self._frames = frames
+        self._callback = callback
+        self._active = True
+        microphone.stream_opened()
+        self._thread = threading.Thread(target=self._run, name="soak-mic", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        position = self._microphone.now()
+        rate = self._microphone.sample_rate
+        while self._active:
+            wait = (position + self._frames - self._microphone.now()) / rate
+            if wait > 0:
+                time.sleep(wait)
+            block = self._microphone.render(position, self._frames)
+            if self._channels > 1:
+                block = np.repeat(block, self._channels)
+            position += self._frames
+            if not self._active:
+                break
+            _, flag = self._callback(block.tobytes(), self._frames, None, 0)
+            if flag != pyaudio.paContinue:
+                break
+        self._active = False
+
+    def is_active(self) -> bool:
+        return self._active
+
+    def stop_stream(self) -> None:
+        self._active = False
+
+    def close(self) -> None:
+        self._active = False
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+class FakeOutputStream:
+    """PyAudio-uppspelningsström som tar lika lång tid som ljudet och räknar samples."""
+
+    def __init__(self, rate: int):
+        self._rate = rate
+
+    def write(self, data: bytes) -> None:
+        samples = len(data) // 2
+        FakePyAudio.played_seconds += samples / self._rate
+        time.sleep(samples / self._rate)
+
+    def stop_stream(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+class FakePyAudio:
+    """
+    Ersätter pyaudio.PyAudio under soak: en enhet med in- och utgång.
+
+    Mikrofonen sätts på klassen innan AudioIO skapas.
+    """
+
+    microphone: Optional[FakeMicrophone] = None
+    output_rate = 48000
+    played_seconds = 0.0
+
+    def _info(self, index: int = 0) -> dict:
+        return {"index": index, "name": "soak", "maxInputChannels": 8, "maxOutputChannels": 2,
+                "defaultSampleRate": float(self.output_rate)}
+
+    def get_device_count(self) -> int:
+        return 1
+
+    def get_device_info_by_index(self, index: int) -> dict:
+        return self._info(index)
+
+    def get_default_input_device_info(self) -> dict:
+        return self._info()
+
+    def get_default_output_device_info(self) -> dict:
+        return self._info()
+
+    def get_host_api_info_by_index(self, index: int) -> dict:
+        return {"deviceCount": 1}
+
+    def get_device_info_by_host_api_device_index(self, api: int, index: int) -> dict:
+        return self._info(index)
+
+    def is_format_supported(self, rate, **kwargs) -> bool:
+        return rate == self.microphone.sample_rate if "input_device" in kwargs else True
+
+    def open(self, format=None, channels=1, rate=16000, input=False, output=False,
+             frames_per_buffer=1024, stream_callback=None, **kwargs):
+        if input:
+            if rate != self.microphone.sample_rate:
+                raise ValueError(f"Simulerad mikrofon har {self.microphone.sample_rate} Hz, inte {rate}")
+            return FakeInputStream(self.microphone, channels, frames_per_buffer, stream_callback)
+        return FakeOutputStream(rate)
+
+    def terminate(self) -> None:
+        pass
+
+class FakeN8n:
+    """Besvarar kommandon på brokern som ett n8n-flöde."""
+
+    def __init__(self, broker: FakeBroker, expect_reply_every: int = 4):
+        self.broker = broker
+        self.expect_reply_every = expect_reply_every
+        self.commands: List[Tuple[float, dict]] = []
+        self.received = threading.Condition()
+        broker.on_publish = self._on_publish
+
+    def _on_publish(self, topic: str, payload: bytes) -> None:
+        if topic != config.MQTT_TOPIC_COMMANDS:
+            return
+        command = json.loads(payload)
+        with self.received:
+            self.commands.append((time.perf_counter(), command))
+            count = len(self.commands)
+            self.received.notify_all()
+        text = f"Okej, {command.get('text', '')}. Det är ordnat."
+        expect_reply = count % self.expect_reply_every == 0
+        if count % 2:
+            self._send({"tts_text": text, "expect_reply": expect_reply})
+            return
+        # Strömmat svar i tre fragment
+        response_id = f"soak-{count}"
+        words = text.split()
+        size = -(-len(words) // 3)
+        parts = [" ".join(words[i:i + size]) for i in range(0, len(words), size)]
+        for seq, part in enumerate(parts):
+            self._send({"response_id": response_id, "seq": seq, "tts_text": part + ". ",
+                        "final": seq == len(parts) - 1, "expect_reply": expect_reply})
+
+    def _send(self, data: dict) -> None:
+        self.broker.publish(config.MQTT_TOPIC_RESPONSES, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+    def wait_for(self, count: int, timeout: float) -> Optional[float]:
+        """Vänta på kommando nummer count; returnerar tiden det kom."""
+        with self.received:
+            if not self.received.wait_for(lambda: len(self.commands) >= count, timeout):
+                return None
+            return self.commands[count - 1][0]
+
+class TriggeredDetector:
+    """
+    Porcupine som också kan triggas utifrån.
+
+    Detektorn körs på varje ram som vanligt (samma CPU-last), men efter
+    trigger() svarar den med index 0 på nästa ram som når den.
+    """
+
+    def __init__(self, porcupine):
+        self._porcupine = porcupine
+        self._trigger = threading.Event()
+        self.frame_length = porcupine.frame_length
+
+    def trigger(self) -> None:
+        self._trigger.set()
+
+    def process(self, frame) -> int:
+        index = self._porcupine.process(frame)
+        if self._trigger.is_set():
+            self._trigger.clear()
+            return 0
+        return index
+
+    def delete(self) -> None:
+        self._porcupine.delete()
+
+def linear_trend(xs: List[float], ys: List[float]) -> Tuple[float, float]:
+    """
+    Minsta kvadrat-anpassning av en rät linje.
+
+    Returns:
+        (lutning per x-enhet, förklaringsgrad R²)
+    """
+    x = np.asarray(xs, dtype=float)
+    y = np.asarray(ys, dtype=float)
+    if len(x) < 2 or np.ptp(x) == 0:
+        return 0.0, 0.0
+    slope, intercept = np.polyfit(x, y, 1)
+    residual = np.sum((y - (slope * x + intercept)) ** 2)
+    total = np.sum((y - y.mean()) ** 2)
+    return float(slope), float(1 - residual / total) if total > 0 else 0.0
+
+def find_trends(samples: List[dict], warmup_hours: float) -> List[str]:
+    """
+    Hitta serier som växer linjärt efter uppvärmningen.
+
+    Returns:
+        En rad per flaggad serie
+    """
+    steady = [s for s in samples if s["hours"] >= warmup_hours]
+    if len(steady) < TREND_MIN_SAMPLES:
+        return []
+    flagged = []
+    for key, limit in TREND_LIMITS.items():
+        points = [(s["hours"], s[key]) for s in steady if s.get(key) is not None]
+        if len(points) < TREND_MIN_SAMPLES:
+            continue
+        slope, r2 = linear_trend(*zip(*points))
+        if slope >= limit and r2 >= TREND_MIN_R2:
+            flagged.append(f"{key} växer {slope:+.2f}/h (R² {r2:.2f}, "
+                           f"{points[0][1]:.1f} -> {points[-1][1]:.1f})")
+    return flagged
+
+def _load_clip(path: str, sample_rate: int) -> np.ndarray:
+    """Läs en WAV-fil som mono int16 i sample_rate."""
+    audio, rate = sf.read(path, dtype="int16")
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1).astype(np.int16)
+    return resample(audio, rate, sample_rate)
+
+def _burst(sample_rate: int, seconds: float = 0.6) -> np.ndarray:
+    """Kort talliknande ljudstöt som öppnar aktivitetsgrinden."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    envelope = np.sin(np.pi * t / seconds) ** 2
+    tone = np.sin(2 * np.pi * 220 * t) + 0.5 * np.sin(2 * np.pi * 660 * t)
+    return (tone * envelope * 6000).astype(np.int16)
+
+def _percentile_ms(values: List[float], q: float) -> Optional[float]:
+    return float(np.percentile(values, q) * 1000) if values else None
+
+class SoakRunner:
+    """Kör interaktioner och samplar resurser tills tiden är slut."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.samples: List[dict] = []
+        self.command_latencies: List[float] = []
+        self.interactions = 0
+        self.missed = 0
+        self._stop = threading.Event()
+
+    def run(self) -> int:
+        from main import VoiceAssistant
+
+        rate = config.SAMPLE_RATE
+        microphone = FakeMicrophone(rate)
+        FakePyAudio.microphone = microphone
+
+        with FakeBroker() as broker, mock.patch.object(pyaudio, "PyAudio", FakePyAudio):
+            n8n = FakeN8n(broker)
+            # Assistenten ansluter till fake-brokern och det simulerade ljudkortet
+            config.MQTT_HOST, config.MQTT_PORT = broker.host, broker.port
+            config.MQTT_USERNAME = config.MQTT_PASSWORD = ""
+            config.MQTT_TLS = False
+            config.PIPELINE_MODE = "threaded"
+            config.INPUT_DEVICE_NAME = ""
+            config.INPUT_DEVICE_INDEX = config.OUTPUT_DEVICE_INDEX = None
+            config.INPUT_SAMPLE_RATE = config.OUTPUT_SAMPLE_RATE = None
+            config.RECORD_SECONDS_AFTER_WAKE = self.args.record_seconds
+
+            va = VoiceAssistant()
+            try:
+                commands = ([_load_clip(path, rate) for path in self.args.command_wav]
+                            or [resample(*va._synthesize(text), rate) for text in PHRASES])
+                wake = _load_clip(self.args.wake_wav, rate) if self.args.wake_wav else None
+                detector = None
+                if wake is None:
+                    detector = va.porcupine = TriggeredDetector(va.porcupine)
+
+                listener = threading.Thread(target=va.listen_for_wake, name="soak-assistant", daemon=True)
+                listener.start()
+                sampler = threading.Thread(target=self._sample_loop, name="soak-sampler", daemon=True)
+                sampler.start()
+
+                deadline = time.monotonic() + self.args.hours * 3600
+                while time.monotonic() < deadline and listener.is_alive():
+                    self._interaction(va, microphone, n8n, commands, wake, detector)
+                self._stop.set()
+                sampler.join()
+            finally:
+                va.stop()
+                va.cleanup()
+
+        return self._report()
+
+    def _interaction(self, va, microphone: FakeMicrophone, n8n: FakeN8n,
+                     commands: List[np.ndarray], wake: Optional[np.ndarray],
+                     detector: Optional[TriggeredDetector]) -> None:
+        """Kör en interaktion: wakeword, kommando, svar och eventuell följdfråga."""
+        clip = commands[self.interactions % len(commands)]
+        # Kommandot börjar strax efter att inspelningsströmmen har stabiliserats
+        microphone.arm(clip, config.AUDIO_STREAM_STABILIZE_DELAY + 0.2)
+        started = time.perf_counter()
+        if wake is not None:
+            microphone.play(wake)
+        else:
+            microphone.play(_burst(microphone.sample_rate))
+            detector.trigger()
+
+        self.interactions += 1
+        expected = len(n8n.commands) + 1
+        arrived = n8n.wait_for(expected, self.args.record_seconds + 30)
+        if arrived is None:
+            self.missed += 1
+            microphone.disarm()
+            logging.warning(f"Soak: interaktion {self.interactions} gav inget kommando")
+            return
+        self.command_latencies.append(arrived - started)
+
+        # Vänta tills svaret har lästs upp, och på följdfrågefönstret
+        time.sleep(0.3)
+        done = threading.Event()
+        va.speech.call_when_done(done.set)
+        done.wait(60)
+        if expected % n8n.expect_reply_every == 0:
+            time.sleep(config.FOLLOWUP_TIMEOUT + 1.0)
+        time.sleep(self.args.pause)
+
+    def _sample_loop(self) -> None:
+        """Sampla resurser och latens med jämna mellanrum."""
+        start = time.monotonic()
+        writer = None
+        csv_file = open(self.args.csv, "w", newline="", encoding="utf-8") if self.args.csv else None
+        try:
+            while not self._stop.wait(self.args.interval):
+                sample = self._sample((time.monotonic() - start) / 3600)
+                self.samples.append(sample)
+                if csv_file is not None:
+                    if writer is None:
+                        writer = csv.DictWriter(csv_file, fieldnames=list(sample))
+                        writer.writeheader()
+                    writer.writerow(sample)
+                    csv_file.flush()
+                logging.info("Soak: " + ", ".join(
+                    f"{key}={value:.1f}" if isinstance(value, float) else f"{key}={value}"
+                    for key, value in sample.items() if value is not None))
+                for line in find_trends(self.samples, self.args.warmup / 60):
+                    logging.warning(f"Soak: ⚠ {line}")
+        finally:
+            if csv_file is not None:
+                csv_file.close()
+
+    def _sample(self, hours: float) -> dict:
+        """En mätpunkt: resurser och latens sedan förra punkten."""
+        latencies, self.command_latencies = self.command_latencies, []
+        timings = metrics.snapshot()["timings"]
+
+        def p50(name: str) -> Optional[float]:
+            timing = timings.get(name)
+            return timing["p50_ms"] if timing else None
+
+        return {
+            "hours": round(hours, 4),
+            "interactions": self.interactions,
+            "missed": self.missed,
+            **process_resources(),
+            "python_threads": threading.active_count(),
+            "command_ms": _percentile_ms(latencies, 50),
+            "stt_ms": p50("stt.total"),
+            "tts_ms": p50("tts.synthesize"),
+            "queue_to_play_ms": p50("tts.queue_to_play"),
+            "played_seconds": round(FakePyAudio.played_seconds, 1),
+        }
+
+    def _report(self) -> int:
+        """Skriv en sammanfattning; returnerar 1 om någon serie växer."""
+        print(f"\nSoak: {self.interactions} interaktioner, {self.missed} utan kommando, "
+              f"{len(self.samples)} mätpunkter")
+        if self.samples:
+            first, last = self.samples[0], self.samples[-1]
+            for key in ("rss_mb", "fds", "threads", "command_ms", "stt_ms", "tts_ms"):
+                if first.get(key) is not None and last.get(key) is not None:
+                    print(f"  {key:<18}{first[key]:>10.1f} -> {last[key]:.1f}")
+        trends = find_trends(self.samples, self.args.warmup / 60)
+        if len(self.samples) < TREND_MIN_SAMPLES:
+            print("För få mätpunkter för trendanalys")
+        for line in trends:
+            print(f"⚠ {line}")
+        if not trends:
+            print("Ingen linjär tillväxt upptäckt")
+        return 1 if trends else 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Långtidstest av röstassistenten")
+    parser.add_argument("--hours", type=float, default=4.0, help="Testets längd i timmar")
+    parser.add_argument("--interval", type=float, default=60.0, help="Sekunder mellan mätpunkter")
+    parser.add_argument("--warmup", type=float, default=10.0,
+                        help="Minuter i början som inte räknas i trendanalysen")
+    parser.add_argument("--pause", type=float, default=2.0, help="Sekunder mellan interaktioner")
+    parser.add_argument("--record-seconds", type=int, default=config.RECORD_SECONDS_AFTER_WAKE,
+                        help="Inspelningstid per kommando")
+    parser.add_argument("--wake-wav", help="Inspelat wakeword (annars triggas detektorn)")
+    parser.add_argument("--command-wav", nargs="*", default=[],
+                        help="Inspelade kommandon (annars Piper-syntes)")
+    parser.add_argument("--csv", help="Spara mätpunkterna som CSV")
+    args = parser.parse_args(argv)
+    return SoakRunner(args).run()
+
+if __name__ == "__main__":
+    raise SystemExit(main())
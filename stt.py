@@ -0,0 +1,150 @@
+"""
+Taligenkänning med Vosk.
+
+Stödjer två nivåer: en liten, snabb modell avkodar först och det lagrade
+ljudet avkodas om med den stora modellen bara när den genomsnittliga
+ordkonfidensen är låg, eller när den lilla modellen inte hittade några
+ord i ljud som ändå innehåller tal.
+"""
+import json
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from vosk import KaldiRecognizer
+
+from audio_utils import frame_levels
+from metrics import metrics
+
+def average_confidence(result: dict) -> Optional[float]:
+    """
+    Genomsnittlig ordkonfidens i ett Vosk-resultat.
+
+    Args:
+        result: Vosk-resultat avkodat med SetWords(True)
+
+    Returns:
+        Medelvärdet av "conf" för alla ord, eller None om inga ord finns
+    """
+    words = result.get("result") or []
+    if not words:
+        return None
+    return sum(w.get("conf", 0.0) for w in words) / len(words)
+
+class SpeechRecognizer:
+    """
+    Vosk-avkodare med valfri snabb första nivå och grammatikstöd.
+    """
+
+    def __init__(self, model, sample_rate: int, fast_model=None,
+                 confidence_threshold: float = 0.0, speech_margin_db: float = 10.0,
+                 grammar_cache_size: int = 8):
+        """
+        Args:
+            model: Vosk-modell (den stora/noggranna)
+            sample_rate: Ljudets samplingsfrekvens i Hz
+            fast_model: Liten Vosk-modell som provas först (None = en nivå)
+            confidence_threshold: Under denna medelkonfidens avkodas om med model
+            speech_margin_db: Toppnivå över brusgolvet som räknas som tal när
+                den snabba modellen inte hittade några ord
+            grammar_cache_size: Max antal sparade grammatik-recognizers
+        """
+        self.model = model
+        self.fast_model = fast_model
+        self.sample_rate = sample_rate
+        self.confidence_threshold = confidence_threshold
+        self.speech_margin_db = speech_margin_db
+        self.grammar_cache_size = grammar_cache_size
+        self._grammar_recognizers: "OrderedDict[str, KaldiRecognizer]" = OrderedDict()
+
+    def _has_speech(self, audio: np.ndarray) -> bool:
+        """Om ljudet har en tydlig topp över sitt brusgolv (skattat ur ljudet)."""
+        levels = frame_levels(audio, self.sample_rate // 100)  # 10 ms-ramar
+        if len(levels) == 0:
+            return False
+        return float(levels.max() - np.percentile(levels, 20)) >= self.speech_margin_db
+
+    def _decode(self, model, data: bytes, name: str) -> dict:
+        """Avkoda med en ny recognizer och mät tiden."""
+        start = time.perf_counter()
+        rec = KaldiRecognizer(model, self.sample_rate)
+        rec.SetWords(True)  # Aktivera ordnivå-detaljer för bättre precision
+        rec.AcceptWaveform(data)
+        result = json.loads(rec.Result())
+        metrics.observe(f"stt.{name}", time.perf_counter() - start)
+        metrics.incr(f"stt.{name}")
+        return result
+
+    def transcribe(self, audio: np.ndarray, grammar: Optional[str] = None,
+                   fast_only: bool = False) -> dict:
+        """
+        Transkribera ljud.
+
+        Args:
+            audio: int16-ljud i sample_rate
+            grammar: Vosk-grammatik (JSON-lista med fraser) för begränsad avkodning
+            fast_only: Avkoda aldrig om med stora modellen
+                (kvalitetsguvernören under CPU-brist)
+
+        Returns:
+            Vosk-resultat som dict, kompletterat med "tier" och "confidence"
+        """
+        data = audio.tobytes()
+
+        if grammar is not None:
+            return self._decode_grammar(data, grammar)
+
+        if self.fast_model is None:
+            result = self._decode(self.model, data, "full")
+            result["tier"] = "full"
+            result["confidence"] = average_confidence(result)
+            return result
+
+        result = self._decode(self.fast_model, data, "fast")
+        confidence = average_confidence(result)
+        escalate = False
+        if not fast_only and confidence is None:
+            # Inga ord: tystnad, eller tal som den lilla modellen inte klarade
+            escalate = self._has_speech(audio)
+            if escalate:
+                logging.info("Snabba modellen hittade inga ord i tal, avkodar om med stora modellen")
+        elif not fast_only and confidence < self.confidence_threshold:
+            logging.info(f"Låg konfidens ({confidence:.2f} < {self.confidence_threshold:.2f}), "
+                         f"avkodar om med stora modellen")
+            escalate = True
+        if escalate:
+            metrics.incr("stt.escalated")
+            result = self._decode(self.model, data, "full")
+            result["tier"] = "full"
+            result["confidence"] = average_confidence(result)
+            return result
+
+        result["tier"] = "fast"
+        result["confidence"] = confidence
+        return result
+
+    def _decode_grammar(self, data: bytes, grammar: str) -> dict:
+        """
+        Avkoda med begränsad grammatik.
+
+        Grammatik stöds bara av modeller med dynamisk graf (de små
+        modellerna), så den snabba modellen används när den finns.
+        Recognizers för de senast använda grammatikerna återanvänds.
+        """
+        start = time.perf_counter()
+        rec = self._grammar_recognizers.get(grammar)
+        if rec is None:
+            rec = KaldiRecognizer(self.fast_model or self.model, self.sample_rate, grammar)
+            self._grammar_recognizers[grammar] = rec
+            while len(self._grammar_recognizers) > self.grammar_cache_size:
+                self._grammar_recognizers.popitem(last=False)
+        else:
+            self._grammar_recognizers.move_to_end(grammar)
+            rec.Reset()
+        rec.SetWords(True)
+        rec.AcceptWaveform(data)
+        result = json.loads(rec.Result())
+        metrics.observe("stt.grammar", time.perf_counter() - start)
+        return result
@@ -0,0 +1,481 @@
+"""
+Hjälpfunktioner för talsyntes med Piper.
+
+Innehåller även stöd för strömmade svar: textfragment med gemensamt
+svars-ID sätts ihop i rätt ordning, och varje färdig mening syntetiseras
+och spelas upp så fort den är komplett.
+"""
+import re
+import time
+import queue
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import metrics
+
+def synthesize_pcm(voice, text: str, speaker_id: Optional[int] = None,
+                   length_scale: float = 1.0) -> Tuple[np.ndarray, int]:
+    """
+    Syntetisera text till PCM.
+
+    Args:
+        voice: Laddad PiperVoice
+        text: Text att läsa upp
+        speaker_id: Piper speaker ID (None = modellens standard)
+        length_scale: Talhastighet (lägre = snabbare)
+
+    Returns:
+        Tuple (PCM som int16-array, samplingsfrekvens i Hz)
+    """
+    from piper.config import SynthesisConfig
+
+    syn_config = SynthesisConfig(
+        speaker_id=speaker_id,
+        length_scale=length_scale,
+        volume=1.0
+    )
+
+    # Synthesize returns an iterable of AudioChunk objects
+    chunks = []
+    sample_rate = voice.config.sample_rate
+    for audio_chunk in voice.synthesize(text, syn_config):
+        chunks.append(audio_chunk.audio_int16_bytes)
+        sample_rate = audio_chunk.sample_rate
+
+    return np.frombuffer(b''.join(chunks), dtype=np.int16), sample_rate
+
+def warm_up(voice, speaker_id: Optional[int] = None) -> float:
+    """
+    Kör en kort syntes så att första riktiga svaret slipper uppstartskostnaden.
+
+    Args:
+        voice: Laddad PiperVoice
+        speaker_id: Piper speaker ID
+
+    Returns:
+        Latens för första syntesen i millisekunder
+    """
+    start = time.perf_counter()
+    synthesize_pcm(voice, "Hej.", speaker_id)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    logging.info(f"Piper första syntes (uppvärmning): {elapsed_ms:.0f} ms")
+    return elapsed_ms
+
+# Meningsslut: . ! ? (eventuellt följt av citattecken/parentes) och blanksteg
+_SENTENCE_END = re.compile(r'[.!?…]+["\'»”)\]]*\s+')
+
+# Svenska förkortningar som slutar med punkt men inte avslutar meningen
+_ABBREVIATIONS = {
+    "t.ex", "bl.a", "m.m", "m.fl", "osv", "o.s.v", "dvs", "d.v.s", "s.k", "ca",
+    "kl", "nr", "st", "obs", "resp", "jfr", "fr.o.m", "t.o.m", "p.g.a", "pga",
+    "etc", "f.d", "fr", "mfl", "mm", "tel", "ang", "inkl", "exkl",
+    "min", "sek", "tim", "kr", "öre", "dr", "prof", "el", "ev", "vs", "jan",
+    "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept", "okt", "nov", "dec",
+}
+# Förkortningar som ofta står sist i en mening ("kostar 5 kr.")
+_TERMINAL_ABBREVIATIONS = {"osv", "o.s.v", "etc", "m.m", "m.fl", "mfl", "mm",
+                           "kr", "öre", "st", "min", "sek", "tim"}
+
+def _sentence_ends(text: str):
+    """
+    Hitta positioner där meningar slutar, med hänsyn till svenska förkortningar.
+
+    En punkt räknas inte som meningsslut efter en känd förkortning (utom
+    de som ofta avslutar meningar, följda av versal), efter en enskild
+    bokstav (initial), efter ett ordningstal ("den 3. maj") eller när
+    nästa ord börjar med gemen.
+    """
+    for match in _SENTENCE_END.finditer(text):
+        punct = match.group().strip()
+        if punct.startswith(".") and not punct.startswith(".."):
+            word = text[:match.start()].rsplit(None, 1)[-1] if text[:match.start()].strip() else ""
+            word = word.lstrip("(\"'»“").lower()
+            nxt = text[match.end():match.end() + 1]
+            if word in _ABBREVIATIONS or (len(word) == 1 and word.isalpha()):
+                # Efter t.ex. "kr." kan en ny mening börja; avgör på nästa tecken
+                if not (word in _TERMINAL_ABBREVIATIONS and nxt and not nxt.islower()
+                        and not nxt.isdigit()):
+                    continue
+            if word.isdigit() and nxt and not nxt.isupper():
+                continue
+            if nxt and (nxt.islower() or nxt.isdigit()):
+                continue
+        yield match.end()
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Dela text i meningar (svenskanpassat).
+
+    Args:
+        text: Text att dela
+
+    Returns:
+        Lista med meningar (utan tomma)
+    """
+    sentences = []
+    start = 0
+    for end in _sentence_ends(text):
+        sentence = text[start:end].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = end
+    if text[start:].strip():
+        sentences.append(text[start:].strip())
+    return sentences
+
+def split_complete_sentences(text: str, max_pending: int = 200) -> Tuple[List[str], str]:
+    """
+    Dela av alla kompletta meningar från början av en textbuffert.
+
+    Args:
+        text: Buffrad text
+        max_pending: Blir resten längre än så bryts den vid sista komma/blanksteg
+
+    Returns:
+        Tuple (kompletta meningar, ofullständig rest)
+    """
+    sentences = []
+    start = 0
+    for end in _sentence_ends(text):
+        sentence = text[start:end].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = end
+    rest = text[start:]
+
+    # Undvik att vänta länge på ett meningsslut som aldrig kommer
+    if len(rest) > max_pending:
+        cut = max(rest.rfind(",", 0, max_pending), rest.rfind(" ", 0, max_pending))
+        if cut > 0:
+            sentences.append(rest[:cut + 1].strip())
+            rest = rest[cut + 1:]
+    return sentences, rest
+
+def join_with_crossfade(parts: List[np.ndarray], fade_samples: int) -> np.ndarray:
+    """
+    Foga ihop PCM-block med kort linjär övertoning i skarvarna.
+
+    Args:
+        parts: int16-block i ordning
+        fade_samples: Övertoningens längd i samples
+
+    Returns:
+        Sammanfogat int16-ljud
+    """
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return np.zeros(0, dtype=np.int16)
+    if len(parts) == 1:
+        return parts[0]
+
+    total = len(parts[0])
+    overlaps = []
+    for part in parts[1:]:
+        overlap = min(fade_samples, total, len(part))
+        overlaps.append(overlap)
+        total += len(part) - overlap
+
+    out = np.empty(total, dtype=np.float32)
+    out[:len(parts[0])] = parts[0]
+    pos = len(parts[0])
+    for part, overlap in zip(parts[1:], overlaps):
+        if overlap:
+            ramp = np.linspace(0.0, 1.0, overlap, endpoint=False, dtype=np.float32)
+            seg = out[pos - overlap:pos]
+            seg *= 1.0 - ramp
+            seg += part[:overlap] * ramp
+        out[pos:pos + len(part) - overlap] = part[overlap:]
+        pos += len(part) - overlap
+    return np.clip(np.rint(out), -32768, 32767).astype(np.int16)
+
+# Röst för processbaserad parallell syntes (en per arbetsprocess)
+_worker_voice = None
+
+def _init_worker_voice(model_path: str, load_options: dict) -> None:
+    """Ladda Piper-rösten i en arbetsprocess."""
+    global _worker_voice
+    from models import load_piper_voice
+    _worker_voice = load_piper_voice(model_path, **load_options)
+
+def _synthesize_in_worker(text: str, speaker_id: Optional[int],
+                          length_scale: float) -> Tuple[np.ndarray, int]:
+    """Syntetisera i en arbetsprocess."""
+    return synthesize_pcm(_worker_voice, text, speaker_id, length_scale)
+
+class ParallelSynthesizer:
+    """
+    Syntetiserar långa svar mening för mening parallellt.
+
+    Trådläget delar en röst (ONNX Runtime släpper GIL under inferens och
+    sessionen är trådsäker); processläget laddar en röst per process.
+    Bäst resultat fås med ORT_INTRA_OP_THREADS=1 så att varje mening
+    använder en kärna.
+    """
+
+    def __init__(self, voice, workers: int, mode: str = "thread",
+                 model_path: Optional[str] = None, load_options: Optional[dict] = None,
+                 crossfade_ms: float = 10.0):
+        """
+        Args:
+            voice: Laddad PiperVoice (används i trådläge)
+            workers: Antal parallella synteser
+            mode: "thread" eller "process"
+            model_path: Piper-modell att ladda i varje process (processläge)
+            load_options: Argument till load_piper_voice (processläge)
+            crossfade_ms: Övertoning i skarvarna mellan meningar
+        """
+        if workers < 1:
+            raise ValueError(f"Ogiltigt antal arbetare: {workers}")
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Okänt parallelläge: {mode}")
+
+        self.voice = voice
+        self.workers = workers
+        self.mode = mode
+        self.crossfade_ms = crossfade_ms
+        if mode == "process":
+            import multiprocessing as mp
+            from concurrent.futures import ProcessPoolExecutor
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=mp.get_context("spawn"),
+                initializer=_init_worker_voice,
+                initargs=(model_path, load_options or {})
+            )
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts-par")
+
+    def synthesize(self, text: str, speaker_id: Optional[int] = None,
+                   length_scale: float = 1.0) -> Tuple[np.ndarray, int]:
+        """
+        Syntetisera text, med meningarna fördelade på arbetarna.
+
+        Returns:
+            Tuple (PCM som int16-array, samplingsfrekvens i Hz)
+        """
+        sentences = split_sentences(text)
+        start = time.perf_counter()
+
+        if len(sentences) <= 1:
+            result = synthesize_pcm(self.voice, text, speaker_id, length_scale)
+        else:
+            if self.mode == "process":
+                futures = [self._executor.submit(_synthesize_in_worker, s, speaker_id, length_scale)
+                           for s in sentences]
+            else:
+                futures = [self._executor.submit(synthesize_pcm, self.voice, s, speaker_id, length_scale)
+                           for s in sentences]
+            parts = [f.result() for f in futures]
+            sample_rate = parts[0][1]
+            fade = int(sample_rate * self.crossfade_ms / 1000)
+            result = (join_with_crossfade([pcm for pcm, _ in parts], fade), sample_rate)
+
+        elapsed = time.perf_counter() - start
+        metrics.observe("tts.synthesize", elapsed)
+        logging.debug(f"Syntes av {len(text)} tecken i {len(sentences)} meningar: {elapsed * 1000:.0f} ms")
+        return result
+
+    def shutdown(self, wait: bool = False) -> None:
+        """
+        Stäng arbetarpoolen.
+
+        Args:
+            wait: Vänta tills köade synteser är klara i stället för att avbryta dem
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+class _StreamState:
+    """Tillstånd för ett strömmat svar."""
+
+    def __init__(self):
+        self.next_seq = 0
+        self.pending: Dict[int, Tuple[str, bool]] = {}
+        self.buffer = ""
+        self.length = 0
+        self.updated = time.monotonic()
+
+class ResponseAssembler:
+    """
+    Sätter ihop strömmade textfragment till meningar.
+
+    Fragment kan komma i fel ordning; de buffras tills alla tidigare
+    sekvensnummer har anlänt.
+    """
+
+    def __init__(self, max_length: int = 1000, stale_after: float = 60.0):
+        """
+        Args:
+            max_length: Max antal tecken per svar (resten ignoreras)
+            stale_after: Svar utan nya fragment så länge (sekunder) kastas
+        """
+        self.max_length = max_length
+        self.stale_after = stale_after
+        self._streams: Dict[str, _StreamState] = {}
+        self._lock = threading.Lock()
+
+    def add(self, response_id: str, seq: int, text: str, final: bool) -> List[str]:
+        """
+        Lägg till ett fragment.
+
+        Args:
+            response_id: Svarets ID
+            seq: Fragmentets sekvensnummer (börjar på 0)
+            text: Fragmentets text
+            final: True för svarets sista fragment
+
+        Returns:
+            Meningar som nu är kompletta, i ordning
+        """
+        with self._lock:
+            self._drop_stale()
+            state = self._streams.setdefault(response_id, _StreamState())
+            state.updated = time.monotonic()
+            if seq < state.next_seq or seq in state.pending:
+                logging.debug(f"Dubblett av fragment {seq} för svar {response_id}")
+                return []
+            state.pending[seq] = (text, final)
+
+            sentences: List[str] = []
+            finished = False
+            while state.next_seq in state.pending:
+                fragment, is_final = state.pending.pop(state.next_seq)
+                state.next_seq += 1
+                # Säkerhet: begränsa total textlängd per svar
+                room = self.max_length - state.length
+                if room <= 0:
+                    fragment = ""
+                elif len(fragment) > room:
+                    logging.warning(f"Strömmat svar {response_id} för långt, klipper av")
+                    fragment = fragment[:room]
+                state.length += len(fragment)
+                state.buffer += fragment
+
+                complete, state.buffer = split_complete_sentences(state.buffer)
+                sentences.extend(complete)
+                if is_final:
+                    finished = True
+                    break
+
+            if finished:
+                if state.buffer.strip():
+                    sentences.append(state.buffer.strip())
+                del self._streams[response_id]
+            return sentences
+
+    def is_active(self, response_id: str) -> bool:
+        """True om svaret har påbörjats men inte avslutats."""
+        with self._lock:
+            return response_id in self._streams
+
+    def purge(self) -> List[str]:
+        """
+        Kasta svar som inte fått nya fragment på stale_after sekunder.
+
+        Returns:
+            ID:n för de kastade svaren
+        """
+        with self._lock:
+            return self._drop_stale()
+
+    def _drop_stale(self) -> List[str]:
+        """Kasta svar som slutat få fragment (anropas med låset taget)."""
+        now = time.monotonic()
+        stale = [rid for rid, st in self._streams.items() if now - st.updated > self.stale_after]
+        for response_id in stale:
+            logging.warning(f"Strömmat svar {response_id} avbröts utan slutfragment")
+            del self._streams[response_id]
+        return stale
+
+class SpeechQueue:
+    """
+    Köad uppläsning med syntes och uppspelning i separata trådar.
+
+    Nästa mening syntetiseras medan föregående spelas upp, och allt spelas
+    i den ordning det köades.
+    """
+
+    def __init__(self, synthesize: Callable[[str], Tuple[np.ndarray, int]],
+                 play: Callable[[np.ndarray, int], None], max_buffered: int = 4):
+        """
+        Args:
+            synthesize: Funktion text -> (PCM, samplingsfrekvens)
+            play: Funktion (PCM, samplingsfrekvens) som spelar upp blockerande
+            max_buffered: Max antal syntetiserade men ej uppspelade meningar
+        """
+        self._synthesize = synthesize
+        self._play = play
+        # (text, köad, generation, callback) och (PCM, takt, köad, generation,
+        # callback); poster med text/PCM None är markörer som bara bär en callback
+        self._texts: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._audio: "queue.Queue[Optional[tuple]]" = queue.Queue(max_buffered)
+        self._generation = 0
+        self._threads = [
+            threading.Thread(target=self._synth_loop, name="tts-synth", daemon=True),
+            threading.Thread(target=self._play_loop, name="tts-play", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def say(self, text: str) -> None:
+        """Köa text för uppläsning."""
+        self._texts.put((text, time.perf_counter(), self._generation, None))
+
+    def call_when_done(self, callback: Callable[[], None]) -> None:
+        """
+        Anropa callback (i uppspelningstråden) när allt som köats hittills
+        har spelats upp. Anropas inte om kön töms med clear() dessförinnan.
+        """
+        self._texts.put((None, time.perf_counter(), self._generation, callback))
+
+    def clear(self) -> None:
+        """Släng allt som väntar på syntes eller uppspelning."""
+        self._generation += 1
+        for q in (self._texts, self._audio):
+            try:
+                while True:
+                    q.get_nowait()
+            except queue.Empty:
+                pass
+
+    def stop(self) -> None:
+        """Stoppa trådarna."""
+        self.clear()
+        self._texts.put(None)
+
+    def _synth_loop(self) -> None:
+        """Syntetisera köad text."""
+        for item in iter(self._texts.get, None):
+            text, queued_at, generation, callback = item
+            if generation != self._generation:
+                continue
+            if text is None:
+                self._audio.put((None, 0, queued_at, generation, callback))
+                continue
+            try:
+                pcm, sample_rate = self._synthesize(text)
+                self._audio.put((pcm, sample_rate, queued_at, generation, None))
+            except Exception as e:
+                logging.error(f"TTS-syntes misslyckades: {e}")
+        self._audio.put(None)
+
+    def _play_loop(self) -> None:
+        """Spela upp syntetiserat ljud i ordning."""
+        for item in iter(self._audio.get, None):
+            pcm, sample_rate, queued_at, generation, callback = item
+            if generation != self._generation:
+                continue
+            if callback is not None:
+                try:
+                    callback()
+                except Exception as e:
+                    logging.error(f"Fel i callback efter uppläsning: {e}")
+                continue
+            metrics.observe("tts.queue_to_play", time.perf_counter() - queued_at)
+            try:
+                self._play(pcm, sample_rate)
+            except Exception as e:
+                logging.error(f"Uppspelning misslyckades: {e}")
@@ -0,0 +1,182 @@
+"""
+Andra stegets kontroll av wakeword-träffar.
+
+Varje Porcupine-träff startar den dyra vägen: signal, inspelning,
+Vosk-avkodning och ett kommando till n8n. Verifieraren tittar först på
+ljudet strax före träffen och släpper bara igenom den om
+
+  1. energiprofilen ser ut som ett kort yttrande: toppen ligger minst
+     margin_db över brusgolvet och tillräckligt många ramar är aktiva, och
+  2. en Vosk-avkodning med en grammatik som bara innehåller ordets fras
+     (och [unk]) hittar frasen med tillräcklig ordkonfidens.
+
+Energikontrollen kostar nästan inget och stoppar klick och brus innan
+avkodningen körs; grammatikavkodningen av 1–2 s ljud tar några tiotal ms
+med den lilla modellen.
+"""
+import json
+import time
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from audio_utils import frame_levels
+from metrics import metrics
+
+class PrerollBuffer:
+    """Ringbuffert med de senaste sekundernas ljud, utan allokering per ram."""
+
+    def __init__(self, seconds: float, sample_rate: int):
+        """
+        Args:
+            seconds: Hur mycket ljud som sparas
+            sample_rate: Ljudets samplingsfrekvens
+        """
+        self._data = np.zeros(max(1, int(seconds * sample_rate)), dtype=np.int16)
+        self._pos = 0
+        self._filled = 0
+
+    def write(self, pcm: np.ndarray) -> None:
+        """Lägg till ljud (kopieras; pcm får vara en återanvänd vy)."""
+        n = len(pcm)
+        size = len(self._data)
+        if n >= size:
+            self._data[:] = pcm[-size:]
+            self._pos, self._filled = 0, size
+            return
+        end = self._pos + n
+        if end <= size:
+            self._data[self._pos:end] = pcm
+        else:
+            split = size - self._pos
+            self._data[self._pos:] = pcm[:split]
+            self._data[:end - size] = pcm[split:]
+        self._pos = end % size
+        self._filled = min(size, self._filled + n)
+
+    def latest(self) -> np.ndarray:
+        """Det sparade ljudet i tidsordning (kopia)."""
+        if self._filled < len(self._data):
+            return self._data[:self._filled].copy()
+        return np.concatenate((self._data[self._pos:], self._data[:self._pos]))
+
+    def clear(self) -> None:
+        """Glöm det sparade ljudet."""
+        self._pos = self._filled = 0
+
+class WakewordVerifier:
+    """
+    Kontrollerar en wakeword-träff mot ljudet före den.
+
+    Användning:
+        ok, reason = verifier.verify(preroll, keyword, transcribe)
+    """
+
+    def __init__(self, sample_rate: int, seconds: float = 1.5, min_confidence: float = 0.5,
+                 margin_db: float = 10.0, min_active_ms: float = 150.0):
+        """
+        Args:
+            sample_rate: Ljudets samplingsfrekvens
+            seconds: Hur mycket ljud före träffen som kontrolleras
+            min_confidence: Minsta Vosk-konfidens för frasens ord
+            margin_db: Hur mycket toppnivån måste ligga över brusgolvet
+            min_active_ms: Minsta tid över brusgolvet + margin_db / 2
+        """
+        self.sample_rate = sample_rate
+        self.seconds = seconds
+        self.min_confidence = min_confidence
+        self.margin_db = margin_db
+        self.min_active_ms = min_active_ms
+        self._grammars: Dict[str, str] = {}
+
+    @property
+    def samples(self) -> int:
+        """Antal samples före träffen som behövs."""
+        return int(self.seconds * self.sample_rate)
+
+    def grammar(self, phrase: str) -> str:
+        """Vosk-grammatik med bara frasen och [unk]."""
+        grammar = self._grammars.get(phrase)
+        if grammar is None:
+            grammar = self._grammars[phrase] = json.dumps([phrase, "[unk]"], ensure_ascii=False)
+        return grammar
+
+    def check_energy(self, audio: np.ndarray, noise_floor_dbfs: Optional[float] = None) -> Optional[str]:
+        """
+        Kontrollera att ljudet innehåller ett tydligt yttrande.
+
+        Args:
+            audio: Ljudet före träffen
+            noise_floor_dbfs: Känt brusgolv (None = skatta ur ljudet)
+
+        Returns:
+            Orsaken om kontrollen underkänner ljudet, annars None
+        """
+        levels = frame_levels(audio, self.sample_rate // 100)  # 10 ms-ramar
+        if len(levels) == 0:
+            return "inget ljud"
+        floor = noise_floor_dbfs if noise_floor_dbfs is not None else float(np.percentile(levels, 20))
+        peak = float(levels.max())
+        if peak - floor < self.margin_db:
+            return f"för svagt ({peak - floor:.0f} dB över brusgolvet)"
+        active_ms = np.count_nonzero(levels > floor + self.margin_db / 2) * 10.0
+        if active_ms < self.min_active_ms:
+            return f"för kort ({active_ms:.0f} ms aktivt)"
+        return None
+
+    def check_transcript(self, result: dict, phrase: str) -> Optional[str]:
+        """
+        Kontrollera att grammatikavkodningen hittade frasen.
+
+        Args:
+            result: Vosk-resultat avkodat med grammar(phrase)
+            phrase: Ordets fras
+
+        Returns:
+            Orsaken om kontrollen underkänner resultatet, annars None
+        """
+        wanted = phrase.split()
+        words = [w for w in (result.get("result") or []) if w.get("word") in wanted]
+        if phrase not in result.get("text", "") or not words:
+            return f"frasen hördes inte ('{result.get('text', '')}')"
+        confidence = min(w.get("conf", 0.0) for w in words)
+        if confidence < self.min_confidence:
+            return f"låg konfidens ({confidence:.2f})"
+        return None
+
+    def verify(self, audio: np.ndarray, phrase: str, transcribe: Callable[[str], dict],
+               noise_floor_dbfs: Optional[float] = None) -> Tuple[bool, str]:
+        """
+        Kontrollera en träff.
+
+        Args:
+            audio: Ljudet före träffen (samples långt)
+            phrase: Ordets fras för grammatiken
+            transcribe: Avkodar audio med given grammatik och returnerar Vosk-resultatet
+            noise_floor_dbfs: Känt brusgolv (None = skatta ur ljudet)
+
+        Returns:
+            Tuple (godkänd, orsak eller "ok")
+        """
+        start = time.perf_counter()
+        try:
+            reason = self.check_energy(audio, noise_floor_dbfs)
+            stage = "energy"
+            if reason is None:
+                stage = "grammar"
+                reason = self.check_transcript(transcribe(self.grammar(phrase)), phrase)
+        except Exception as e:
+            # Ett fel i kontrollen ska inte göra assistenten döv
+            logging.warning(f"Wakeword-verifieringen misslyckades, godkänner träffen: {e}")
+            metrics.incr("wakeword.verify_errors")
+            return True, "fel"
+        finally:
+            metrics.observe("wakeword.verify", time.perf_counter() - start)
+
+        if reason is None:
+            metrics.incr("wakeword.verified")
+            return True, "ok"
+        metrics.incr("wakeword.rejected")
+        metrics.incr(f"wakeword.rejected_{stage}")
+        return False, reason
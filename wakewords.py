@@ -0,0 +1,141 @@
+"""
+Register över wakewords.
+
+Alla wakewords betjänas av samma Porcupine-instans, så detekteringen
+kostar en inferens per ram oavsett antal ord. Varje ord har en egen
+känslighet och en egen åtgärd och MQTT-topic.
+
+Filformat:
+    {
+      "wakewords": [
+        {"name": "assistans", "path": "models/wakewords/sv/assistans.ppn", "sensitivity": 0.6},
+        {"name": "köket", "path": "models/wakewords/sv/koket.ppn", "sensitivity": 0.5,
+         "topic": "kitchen/commands/text"},
+        {"name": "tyst", "path": "models/wakewords/sv/tyst.ppn", "action": "stop"}
+      ]
+    }
+
+Åtgärder:
+    command: Spela in, transkribera och publicera texten till topic (standard)
+    event:   Publicera bara {"wakeword": namn} till topic
+    övriga:  Lokal intent-åtgärd (t.ex. stop, volume_up, time, say)
+
+"phrase" är det som sägs, t.ex. "hej genio" för namnet "hej_genio", och
+används av andra stegets kontroll (WAKEWORD_VERIFY); standard är namnet.
+"""
+import os
+import json
+import logging
+from typing import List, Optional
+
+class WakewordError(Exception):
+    """Bas exception för wakeword-relaterade fel."""
+    pass
+
+class Wakeword:
+    """Ett wakeword med modellfil, känslighet och routing."""
+
+    def __init__(self, name: str, path: str, sensitivity: float = 0.6,
+                 topic: Optional[str] = None, action: str = "command",
+                 response: Optional[str] = None, phrase: Optional[str] = None):
+        """
+        Args:
+            name: Ordets namn (för loggning och händelser)
+            path: Sökväg till Porcupine .ppn-fil
+            sensitivity: Känslighet 0-1 (högre = fler träffar och falsklarm)
+            topic: MQTT-topic för kommandon/händelser (None = standard-topic)
+            action: command, event eller en lokal intent-åtgärd
+            response: Text att läsa upp efter en lokal åtgärd (None = ingen)
+            phrase: Det som sägs, för verifieringen med Vosk (None = name)
+        """
+        if not 0.0 <= sensitivity <= 1.0:
+            raise ValueError(f"Ogiltig känslighet för '{name}': {sensitivity}")
+        self.name = name
+        self.path = path
+        self.sensitivity = sensitivity
+        self.topic = topic
+        self.action = action
+        self.response = response
+        self.phrase = (phrase or name).lower()
+
+class WakewordRegistry:
+    """Ordnad lista med wakewords; index motsvarar Porcupines keyword_index."""
+
+    def __init__(self, keywords: List[Wakeword]):
+        """
+        Args:
+            keywords: Wakewords i den ordning de ges till Porcupine
+        """
+        if not keywords:
+            raise WakewordError("Inga wakewords definierade")
+        self.keywords = keywords
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    def __getitem__(self, index: int) -> Wakeword:
+        return self.keywords[index]
+
+    @property
+    def paths(self) -> List[str]:
+        """Modellfiler i Porcupine-ordning."""
+        return [k.path for k in self.keywords]
+
+    @property
+    def sensitivities(self) -> List[float]:
+        """Känsligheter i Porcupine-ordning."""
+        return [k.sensitivity for k in self.keywords]
+
+    def validate(self) -> None:
+        """
+        Kontrollera att alla modellfiler finns.
+
+        Raises:
+            FileNotFoundError: Om en .ppn-fil saknas
+        """
+        for keyword in self.keywords:
+            if not os.path.exists(keyword.path):
+                raise FileNotFoundError(f"Wakeword-fil saknas för '{keyword.name}': {keyword.path}")
+
+    def describe(self) -> str:
+        """Kort beskrivning för loggning."""
+        return ", ".join(f"{k.name} ({k.sensitivity:.2f}, {k.action})" for k in self.keywords)
+
+    @classmethod
+    def load(cls, path: str) -> "WakewordRegistry":
+        """
+        Ladda register från JSON-fil.
+
+        Args:
+            path: Sökväg till JSON-filen
+
+        Raises:
+            WakewordError: Om filen saknas eller är ogiltig
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise WakewordError(f"Kunde inte läsa wakeword-fil {path}: {e}")
+
+        keywords = []
+        for entry in data.get("wakewords", []):
+            try:
+                keywords.append(Wakeword(
+                    name=entry["name"],
+                    path=entry["path"],
+                    sensitivity=float(entry.get("sensitivity", 0.6)),
+                    topic=entry.get("topic"),
+                    action=entry.get("action", "command"),
+                    response=entry.get("response"),
+                    phrase=entry.get("phrase")
+                ))
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                raise WakewordError(f"Ogiltigt wakeword i {path}: {entry!r} ({e})")
+
+        names = [k.name for k in keywords]
+        if len(set(names)) != len(names):
+            raise WakewordError(f"Dubbla wakeword-namn i {path}")
+        registry = cls(keywords)
+        logging.info(f"Laddade {len(keywords)} wakewords från {path}")
+        return registry